@@ -0,0 +1,222 @@
+'''离线性能测试。
+
+在本地启动 bilib.mockserver.MockServer，分别测试同步、多线程和 asyncio 的调用，
+输出吞吐量和 p50/p99 延迟。
+
+    $ python benchmark.py --latency 0.005 --requests 500 --concurrency 32
+    $ python benchmark.py --json result.json
+    $ python benchmark.py --baseline result.json --tolerance 0.2
+
+给定 --baseline 时，吞吐量比基线低 tolerance 以上的项目会被列出，并以非 0 状态退出。
+'''
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bilib
+from bilib import transport as bilibTransport
+from bilib.fleet import Fleet
+from bilib.mockserver import MockServer
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    if not samples:
+        return 0
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def summarize(name, latencies, elapsed):
+    return {
+        'name': name,
+        'requests': len(latencies),
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed else 0,
+        'p50': percentile(latencies, 0.5) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def runSerial(name, func, n):
+    start = time.perf_counter()
+    latencies = [timed(func, i) for i in range(n)]
+    return summarize(name, latencies, time.perf_counter() - start)
+
+
+def runThreads(name, func, n, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(lambda i: timed(func, i), range(n)))
+    return summarize(name, latencies, time.perf_counter() - start)
+
+
+def runAsync(name, server, n, concurrency):
+    import aiohttp
+    from bilib.aio import AsyncUser
+
+    class MockAsyncUser(AsyncUser):
+        async def do(self, method, url, **kws):
+            return await super().do(method, server.rewrite(url), **kws)
+
+    async def main():
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        users = [MockAsyncUser('123%08d' % i, 'password', connector=connector)
+                 for i in range(concurrency)]
+        for user in users:
+            await user.login()
+        latencies = []
+
+        async def worker(user, count):
+            for _ in range(count):
+                start = time.perf_counter()
+                await user.getUserInfo()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(user, n // concurrency) for user in users))
+        elapsed = time.perf_counter() - start
+        for user in users:
+            await user.close()
+        await connector.close()
+        return summarize(name, latencies, elapsed)
+
+    return asyncio.run(main())
+
+
+def runCrypto(args, transport):
+    '''各个 RSA 后端的加密速度，以及多线程登陆的吞吐量（登陆/秒）'''
+    from bilib import crypto
+    from bilib.mockserver import PUBLIC_KEY
+
+    results = []
+    backends = []
+    for name in crypto.BACKENDS:
+        try:
+            backends.append(crypto.getBackend(name))
+        except ImportError:
+            print('%s is not installed, skipping' % name)
+    backends.append(crypto.ProcessPoolBackend())
+
+    n = min(args.requests, 200)
+    old = crypto.getDefaultBackend()
+    for backend in backends:
+        message = b'0123456789abcdef' + b'password'
+        backend.encrypt(PUBLIC_KEY, message)    # 加载公钥、启动子进程
+        results.append(runThreads('encrypt (%s)' % backend.name,
+                                  lambda i: backend.encrypt(PUBLIC_KEY, message),
+                                  args.requests, args.concurrency))
+
+        crypto.setDefaultBackend(backend)
+
+        def login(i):
+            bilib.User('125%08d' % i, 'password', transport=transport).login()
+        results.append(runThreads('login (%s)' % backend.name, login, n, args.concurrency))
+    crypto.setDefaultBackend(old)
+    backends[-1].close()
+    return results
+
+
+def benchmark(args):
+    results = []
+    # 测量的是请求本身，关掉账号状态的缓存
+    bilib.User.STATE_TTL = {}
+    with MockServer(latency=args.latency) as server:
+        transport = server.transport(maxConnections=args.concurrency,
+                                     maxPerHost=args.concurrency)
+        bilibTransport.setDefaultTransport(transport)
+
+        def login(i):
+            bilib.User('123%08d' % i, 'password', transport=transport).login()
+        results.append(runSerial('login', login, min(args.requests, 100)))
+
+        user = bilib.User('12300000000', 'password', transport=transport)
+        user.login()
+        results.append(runSerial('sync getUserInfo',
+                                 lambda i: user.getUserInfo(), args.requests))
+        results.append(runThreads('threads getUserInfo',
+                                  lambda i: user.getUserInfo(),
+                                  args.requests, args.concurrency))
+
+        danmu = bilib.Danmu('benchmark', 1000, 271, 2710)
+        results.append(runThreads('threads postDanmu',
+                                  lambda i: user.postDanmu(danmu),
+                                  args.requests, args.concurrency))
+
+        # 每个账号执行一遍 DAILY_TASKS，requests 一栏为账号数
+        users = [bilib.User('124%08d' % i, 'password', transport=transport)
+                 for i in range(min(args.requests, 100))]
+        report = Fleet(users, workers=args.concurrency).run()
+        results.append(summarize('fleet daily tasks',
+                                 [result.elapsed for result in report.accounts.values()],
+                                 report.elapsed))
+
+        bilib.Danmu.pageCache.clear()
+        results.append(runSerial('getCid (100 aids)',
+                                 lambda i: bilib.Danmu.getCid(i % 100 + 1),
+                                 args.requests))
+
+        results.extend(runCrypto(args, transport))
+
+        try:
+            import aiohttp  # noqa: F401
+        except ImportError:
+            print('aiohttp is not installed, skipping async benchmark')
+        else:
+            results.append(runAsync('async getUserInfo', server,
+                                    args.requests, args.concurrency))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '返回吞吐量下降超过 tolerance 的项目'
+    baseline = {item['name']: item for item in baseline}
+    regressions = []
+    for item in results:
+        old = baseline.get(item['name'])
+        if old and item['throughput'] < old['throughput'] * (1 - tolerance):
+            regressions.append((item['name'], old['throughput'], item['throughput']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='模拟服务器每个请求的延迟，秒')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--json', help='把结果保存为 json')
+    parser.add_argument('--baseline', help='与之前保存的 json 比较')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = benchmark(args)
+
+    print('%-24s %8s %8s %10s %9s %9s' % (
+        'name', 'requests', 'seconds', 'req/s', 'p50(ms)', 'p99(ms)'))
+    for item in results:
+        print('%-24s %8d %8.2f %10.1f %9.2f %9.2f' % (
+            item['name'], item['requests'], item['seconds'],
+            item['throughput'], item['p50'], item['p99']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, old, new in regressions:
+            print('REGRESSION %s: %.1f -> %.1f req/s' % (name, old, new))
+        exit(bool(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,3 @@
 from .user import User
 from .danmu import Danmu, DanmuMode
+from .batch import DanmuBatch
@@ -0,0 +1,627 @@
+'''基于 asyncio 的 User 实现。
+
+依赖 aiohttp，需要单独安装::
+
+    $ pip install aiohttp
+
+Usage::
+
+    from bilib.aio import AsyncUser
+
+    async def main():
+        async with AsyncUser(phone, password) as user:
+            await user.login()
+            await user.postDanmu(danmu)
+'''
+import asyncio
+import functools
+import time
+
+import aiohttp
+from yarl import URL
+
+from .user import User, BiliError, BiliRequireLogin, _requireLogined
+from .danmu import Danmu
+from .metrics import RequestInfo
+from .videos import AsyncVideoIterator
+from .ranking import RANKING_URL, rankingParams, parseRanking
+
+
+_MISSING = object()
+
+
+def _requireLoginedAsync(func):
+    '同 bilib.user._requireLogined，装饰协程函数，在 await 时而不是调用时检查'
+    @functools.wraps(func)
+    async def wrapped(self, *args, **kws):
+        if not self.logined:
+            raise BiliRequireLogin(
+                'This api requires user logined. Call method login() first.')
+        return await func(self, *args, **kws)
+
+    return wrapped
+
+
+class AsyncUser(User):
+    '''User 的异步版本。
+
+    接口与 User 一致，所有请求 API 的方法都是协程，错误处理和返回码检查的规则与
+    User.do 相同。多个 AsyncUser 可以共用一个 aiohttp.TCPConnector，在同一个事件
+    循环中并发。
+
+    Args:
+        phone (str): 同 User。
+        password (str): 同 User。
+        username (str): 同 User。
+        level (int): 同 User。
+        coins (int): 同 User。
+        connector (aiohttp.BaseConnector): 共享的连接池，不给定时每个用户独占一个，
+            由 close() 关闭。
+
+    Note:
+        aiohttp.ClientSession 在第一次请求时才创建，用完后需要调用 close()，
+        或者使用 async with。
+
+    '''
+
+    def __init__(self, phone, password, username=None, level=0, coins=0, connector=None, **kws):
+        self._connector = connector
+        self._asyncRefreshLock = None
+        # 与 _asyncRefreshLock 分开，续期失败时会在持有它的情况下重新登陆
+        self._asyncLoginLock = None
+        self._stateLoading = {}     # field -> 正在进行的读取
+        super().__init__(phone, password, username, level, coins, **kws)
+
+    def _newSession(self):
+        # aiohttp.ClientSession 需要在事件循环中创建，留到第一次请求时
+        return None
+
+    def _getSession(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                headers=self.HEADERS,
+                connector=self._connector,
+                connector_owner=self._connector is None)
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def __del__(self):
+        # ClientSession.close 是协程，无法在这里调用
+        pass
+
+    # 基础函数
+
+    async def _getKey(self):
+        '同 User._getKey，与 User 共用缓存'
+        # 不能在 await 时持有线程锁，缓存失效时并发的协程可能各自拉取一次
+        keyPair = self._keyCache.get()
+        if keyPair is None:
+            url = 'https://passport.bilibili.com/api/oauth2/getKey'
+            params = self._signed({'appkey': self.APPKEY})
+            data = await self.do(self._getSession().post, url, data=params,
+                                 headers={'Host': 'passport.bilibili.com'})
+            keyPair = self._parseKey(data)
+            self._keyCache.set(keyPair, self.KEY_TTL)
+        return keyPair
+
+    async def _getPwd(self, username, password):
+        '''对密码进行 RSA 加密
+
+        使用 ProcessPoolBackend 时加密在子进程中进行，不阻塞事件循环。
+        '''
+        from .crypto import getDefaultBackend
+        salt, key = await self._getKey()
+        encrypted = await asyncio.wrap_future(
+            getDefaultBackend().submit(key, (salt + password).encode('utf8')))
+        return self._quotePwd(username, encrypted)
+
+    async def do(self, method, url, key='data', checkCode=True, raw=False, **kws):
+        retry = self.retry
+        idempotent = retry.isIdempotent(method)
+        hooks = self.hooks
+        info = None
+        timeout = kws.pop('timeout', None)
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            code = retryAfter = None
+
+            if self.limiter is not None:
+                await self.limiter.acquireAsync(url, self.phone)
+
+            if hooks:
+                info = RequestInfo(hooks, self, method, url, attempt)
+                info.emit('beforeRequest')
+
+            # 处理 aiohttp 抛出的异常
+            try:
+                attemptTimeout = aiohttp.ClientTimeout(
+                    total=retry.attemptTimeout(start, timeout))
+                async with method(url, timeout=attemptTimeout, **kws) as response:
+                    if not retry.shouldRetryStatus(response.status, idempotent):
+                        body = await response.read()
+                        retry.succeeded()
+                        if raw:
+                            if info:
+                                info.responded(response.status, len(body))
+                                info.emit('afterResponse')
+                            # 离开 async with 之后不能再读取响应体，一起返回
+                            return response, body
+                        if info:
+                            info.responded(response.status, len(body))
+                            return self._parseTraced(info, body, key, checkCode)
+                        return self._parseResponse(body, key, checkCode)
+                    if info:
+                        info.responded(response.status, response.content_length or 0)
+                        info.emit('afterResponse')
+                    code = response.status
+                    reason = 'HTTP %d' % code
+                    retryAfter = response.headers.get('Retry-After')
+            except aiohttp.ClientConnectorError as ex:
+                if info:
+                    info.failed(ex)
+                reason = type(ex).__name__
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as ex:
+                if info:
+                    info.failed(ex)
+                # 连接建立之后出错时服务器可能已经处理了请求
+                if not idempotent:
+                    raise
+                reason = type(ex).__name__
+
+            # robust
+            delay = retry.nextDelay(attempt, start, retryAfter)
+            if delay is None:
+                raise BiliError('Max retry times reached. (%s)' % reason, code=code)
+            self.logger.warning('%s.do: %s. Retrying in %.2fs...' %
+                                (type(self).__name__, reason, delay))
+            await asyncio.sleep(delay)
+
+    async def get(self, url, params=None, **kws):
+        await self._checkToken()
+        return await self.do(self._getSession().get, url, params=params, **kws)
+
+    async def post(self, url, data=None, **kws):
+        await self._checkToken()
+        return await self.do(self._getSession().post, url, data=data, **kws)
+
+    # 登陆部分
+
+    async def login(self, force=False):
+        '''登陆
+
+        Note:
+            同 User.login，多个协程同时调用时只登陆一次。
+
+        '''
+        if self._asyncLoginLock is None:
+            self._asyncLoginLock = asyncio.Lock()
+        loginCount = self._loginCount
+        async with self._asyncLoginLock:
+            # 等锁期间可能已经被其他协程登陆了
+            if not force and self._loginCount != loginCount:
+                return
+            await self._login(force)
+            self._loginCount += 1
+
+    async def _login(self, force):
+        if not force and self._restore():
+            self.logger.info(f'用户 {self.phone} 从缓存恢复登陆')
+            return
+
+        self.logger.debug(f'用户 {self.phone} 登陆中...')
+
+        try:
+            data = await self._postLogin()
+        except BiliError as ex:
+            if ex.code != self.STALE_KEY_CODE:
+                raise
+            self._keyCache.invalidate()
+            data = await self._postLogin()
+
+        # 处理返回数据
+        self._setTokenInfo(data['token_info'])
+
+        self._setCookies({cookie['name']: cookie['value']
+                          for cookie in data['cookie_info']['cookies']})
+        self.logger.info(f'用户 {self.phone} 登陆成功')
+        self.logined = True
+        self.invalidate()
+
+        # 同 User._login，不经过 _cached
+        self._remember('userInfo', await self._loadUserInfo())
+        self._save()
+
+    async def _postLogin(self):
+        url = 'https://passport.bilibili.com/api/v2/oauth2/login'
+
+        user, pwd = await self._getPwd(self.phone, self.password)
+        params = self._signed({
+            'appkey': self.APPKEY,
+            'password': pwd,
+            'username': user
+        })
+
+        return await self.do(self._getSession().post, url,
+                             data=self._flaten(params),
+                             headers={'Host': 'passport.bilibili.com',
+                                      "Content-type": "application/x-www-form-urlencoded"})
+
+    async def _checkToken(self):
+        if self._needRefresh():
+            await self.refreshToken()
+
+    async def refreshToken(self, force=False):
+        '''同 User.refreshToken，同一个用户的多个协程只会续期一次。'''
+        if not self.logined:
+            raise BiliRequireLogin(
+                'This api requires user logined. Call method login() first.')
+        if self._asyncRefreshLock is None:
+            self._asyncRefreshLock = asyncio.Lock()
+        async with self._asyncRefreshLock:
+            if not force and not self._needRefresh():
+                return
+            url = 'https://passport.bilibili.com/api/v2/oauth2/refresh_token'
+            try:
+                data = await self.do(self._getSession().post, url,
+                                     data=self._refreshParams(),
+                                     headers={'Host': 'passport.bilibili.com'})
+            except BiliError as ex:
+                self.logger.warning(f'token 续期失败 {ex!r}，重新登陆')
+                await self.login(force=True)
+                return
+            self._setRefreshData(data)
+
+    def _setCookies(self, cookies):
+        self._getSession().cookie_jar.update_cookies(cookies)
+
+    def _getCookies(self):
+        return {cookie.key: cookie.value
+                for cookie in self._getSession().cookie_jar}
+
+    # 视频部分
+
+    @_requireLoginedAsync
+    async def getRecommendAids(self):
+        '获取推荐视频的 aid'
+        url = 'https://www.bilibili.com/index/recommend.json'
+        data = await self.get(url,
+                              headers={'Host': 'www.bilibili.com'},
+                              checkCode=False,
+                              key='list')
+        return [item['aid'] for item in data]
+
+    async def getRankingList(self, rid=0, day=3, original=False, recent=False):
+        data = await self.get(RANKING_URL, params=rankingParams(rid, day, original, recent))
+        return parseRanking(data, rid)
+
+    async def getRankingAids(self, rid=0, day=3, original=False, recent=False):
+        return [str(item.aid)
+                for item in await self.getRankingList(rid, day, original, recent)]
+
+    async def getVideosOfUser(self, uid, page=1, pageSize=30, order='pubdate'):
+        return (await self._getVideoPage(uid, page, pageSize, order) or {}).get('vlist')
+
+    def iterVideosOfUser(self, uid, cursor=0, pageSize=30, order='pubdate', prefetch=4):
+        '''同 User.iterVideosOfUser，返回 bilib.videos.AsyncVideoIterator，使用 async for 迭代'''
+        return AsyncVideoIterator(
+            lambda page: self._getVideoPage(uid, page, pageSize, order),
+            cursor, pageSize, prefetch)
+
+    async def _getVideoPage(self, uid, page, pageSize, order):
+        key = (uid, page, pageSize, order)
+        cached = self.videoPageCache.get(key)
+        if self._isFresh(cached):
+            return cached[2]
+        response, body = await self.get(self.VIDEOS_URL,
+                                        params=self._videoPageParams(*key),
+                                        headers=self._videoPageHeaders(cached),
+                                        raw=True)
+        return self._storeVideoPage(key, cached, response.status,
+                                    response.headers.get('ETag'), body)
+
+    # 账号状态
+
+    async def _cached(self, field, load):
+        '''同 User._cached，load 是协程函数，同时进行的读取共用一个 Task'''
+        ttl = self._stateTTL(field)
+        if not ttl:
+            return await load()
+        value = self._state.get(field, _MISSING)
+        if value is not _MISSING:
+            return value
+        task = self._stateLoading.get(field)
+        if task is None:
+            task = asyncio.ensure_future(self._loadState(field, load, ttl))
+            self._stateLoading[field] = task
+        # 一个等待者被取消时不影响其他等待者
+        return await asyncio.shield(task)
+
+    async def _loadState(self, field, load, ttl):
+        generation = self._stateGeneration
+        try:
+            value = await load()
+        finally:
+            if self._stateLoading.get(field) is asyncio.current_task():
+                del self._stateLoading[field]
+        if self._stateGeneration == generation:
+            self._state.set(field, value, ttl)
+        return value
+
+    def invalidate(self, *fields):
+        # 正在进行的读取可能是旧的，之后的读取不再等待它
+        for field in fields or list(self._stateLoading):
+            self._stateLoading.pop(field, None)
+        super().invalidate(*fields)
+
+    # 接口
+
+    @_requireLoginedAsync
+    async def getUserInfo(self):
+        '''拉取用户的信息
+
+        Raises:
+            BiliRequireLogin: 如果用户未调用过 login() 方法
+        '''
+        await self._cached('userInfo', self._loadUserInfo)
+
+    async def _loadUserInfo(self):
+        url = 'http://account.bilibili.com/home/userInfo'
+        data = await self.get(url, headers={'Host': 'account.bilibili.com'})
+        self._setUserInfo(data)
+        return data
+
+    @_requireLoginedAsync
+    async def updateCoins(self):
+        '''更新硬币数量
+
+        Raises:
+            BiliRequireLogin: 如果用户未调用过 login() 方法
+
+        '''
+        async def load():
+            url = 'https://account.bilibili.com/site/getCoin'
+            data = await self.get(url, headers={'Host': 'account.bilibili.com',
+                                                'Referer': 'https://account.bilibili.com/account/coin'})
+            self.coins = data['money']
+            return self.coins
+        await self._cached('coins', load)
+
+    @_requireLoginedAsync
+    async def getTodayCoinExp(self):
+        '''返回今天投币经验
+        '''
+        async def load():
+            url = 'https://www.bilibili.com/plus/account/exp.php'
+            data = await self.get(url, key='number', headers={
+                                  'Host': 'www.bilibili.com'})
+            self.logger.debug('今日投币经验: %s' % data)
+            return data
+        return await self._cached('coinExp', load)
+
+    @_requireLoginedAsync
+    async def giveCoin(self, aid, num=1, like=False):
+        '''同 User.giveCoin'''
+        url, params, headers = self._coinRequest(aid, num, like)
+        data = await self.post(url, params, headers=headers)
+        self.invalidate(*self.COIN_FIELDS)
+        return data
+
+    @_requireLoginedAsync
+    async def comment(self, aid, msg):
+        '''同 User.comment'''
+        url, params = self._commentRequest(aid, msg)
+        return await self.post(url, params=params)
+
+    # 弹幕
+
+    @_requireLoginedAsync
+    async def postDanmu(self, danmu):
+        '''发送弹幕。
+
+        Args:
+            danmu(bilib.Danmu): 要发送的弹幕
+
+        Raises:
+            BiliError: if any error occured.
+        '''
+        self.assertType(danmu, 'danmu', Danmu)
+        if danmu._cid is None:
+            # 访问 danmu.cid 会在事件循环中同步地请求分 P 列表
+            danmu.cid = await self.getCid(danmu.aid, danmu.page)
+
+        url = 'https://api.bilibili.com/x/v2/dm/post'
+        param = {
+            'type': danmu.mode.value,
+            'oid': danmu.cid,
+            'msg': danmu.msg,
+            'aid': danmu.aid,
+            'progress': int(danmu.t),
+            'color': int(danmu.color),
+            'fontsize': danmu.fontsize,
+            'pool': 0,
+            'mode': danmu.mode.value,
+            'plat': 1,
+            'rnd': int(1000000 * time.time()),
+            'csrf': self.csrf
+        }
+        assert self.csrf != ''
+        await self.post(url, param)
+
+        self.logger.info(f'弹幕 {danmu} 发送成功')
+
+    async def getPageList(self, aid):
+        '''同 Danmu.getPageList，通过本用户的 session 请求，与它共用 Danmu.pageCache'''
+        pages = Danmu.pageCache.get(aid)
+        if pages is None:
+            data = await self.get(Danmu.PAGE_LIST_URL, params={'aid': aid},
+                                  headers={'Host': 'www.bilibili.com'},
+                                  key=None, checkCode=False)
+            pages = Danmu._checkPageList(aid, data)
+            Danmu.pageCache.set(aid, pages)
+        return pages
+
+    async def getCid(self, aid, page=None):
+        '''同 Danmu.getCid'''
+        return Danmu._selectCid(aid, await self.getPageList(aid), page)
+
+    # 直播
+
+    async def getRoomInfo(self, showID):
+        '''同 User.getRoomInfo，但需要在实例上调用以复用连接。'''
+        showID = int(showID)
+        info = self.roomCache.get(showID)
+        if info is None:
+            data = await self.get(self.ROOM_INFO_URL, params={'room_id': showID},
+                                  headers={'Host': 'api.live.bilibili.com'})
+            info = self._cacheRoomInfo(self._parseRoomInfo(data))
+        return info
+
+    async def getAncherName(self, roomID):
+        '''同 User.getAncherName，但需要在实例上调用以复用连接。'''
+        return (await self.getRoomInfo(roomID))['uname']
+
+    @_requireLoginedAsync
+    async def getUserLiveLevel(self):
+        async def load():
+            data = await self.get('https://api.live.bilibili.com/User/getUserInfo?ts=%s' %
+                                  int(1000 * time.time()),
+                                  headers={
+                                      'Host': 'api.live.bilibili.com'
+                                  })
+            return data['user_level']
+        return await self._cached('liveLevel', load)
+
+    @_requireLoginedAsync
+    async def postLiveDanmu(self, msg, roomid, fontsize=25):
+        url = 'https://api.live.bilibili.com/msg/send'
+        form = {
+            'color': 0xFFFFFF,
+            'fontsize': fontsize,
+            'mode': 1,
+            'msg': msg,
+            'rnd': int(time.time()),
+            'roomid': roomid,
+            'csrf_token': self.csrf,
+            'csrf': self.csrf
+        }
+        headers = {
+            'Host': 'api.live.bilibili.com'
+        }
+        res = await self.post(url, form, headers=headers)
+        if res != []:
+            raise BiliError('result: %s' % res)
+
+    @_requireLoginedAsync
+    async def liveSignIn(self):
+        if await self.todaySigned():
+            self.logger.info('already signed in.')
+            return
+        data = await self.get('https://api.live.bilibili.com/sign/doSign',
+                              headers={'Host': 'api.live.bilibili.com'})
+        self.invalidate(*self.SIGN_FIELDS)
+        self.logger.info('今日收获: ' + data['text'])
+        if data['specialText']:
+            self.logger.info(data['specialText'])
+        return data
+
+    @_requireLoginedAsync
+    async def todaySigned(self):
+        async def load():
+            data = await self.get('https://api.live.bilibili.com/sign/GetSignInfo',
+                                  headers={'Host': 'api.live.bilibili.com'})
+            return self._isSigned(data)
+        return await self._cached('signed', load)
+
+    # 密保问题
+
+    async def _updateSafeQuestion(self, oldSQ, oldAnswer, newSQ, newAnswer, canChange):
+        data = await self.post(self.SAFE_QUESTION_URL,
+                               self._safeQuestionParams(oldSQ, oldAnswer, newSQ, newAnswer,
+                                                        canChange),
+                               headers={'Host': 'passport.bilibili.com'})
+        self.invalidate('safeQuestion')
+        return data
+
+    @_requireLoginedAsync
+    async def hasSafeQuestion(self):
+        '''检查用户是否有安全问题
+
+        return:
+            bool
+        '''
+        async def load():
+            url = 'https://account.bilibili.com/home/reward'
+            data = await self.get(url, headers={
+                'Referer': 'https://account.bilibili.com/account/home',
+                'Host': 'account.bilibili.com'})
+            return data['safequestion']
+        return await self._cached('safeQuestion', load)
+
+    @_requireLoginedAsync
+    async def initSafeQuestion(self, questionID, answer):
+        '''初始化密保问题
+        '''
+        self.assertType(questionID, 'questionID', int)
+        self.assertType(answer, 'answer', str)
+        return await self._updateSafeQuestion(
+            questionID, answer,
+            0, '', 1)
+
+    @_requireLoginedAsync
+    async def verifySafeQuestion(self, questionID, answer):
+        '''验证密保问题
+
+        return:
+            bool: True if correct, False otherwise
+        '''
+        self.assertType(questionID, 'questionID', int)
+        self.assertType(answer, 'answer', str)
+        try:
+            await self._updateSafeQuestion(
+                questionID, answer,
+                0, '', 1)
+            return True
+        except BiliError as ex:
+            if ex.code == -632:
+                return False
+            else:
+                raise
+
+    @_requireLoginedAsync
+    async def changeSafeQuestion(self, oldQuestionID, oldAnswer, newQuestionID, newAnswer):
+        '''更改密保问题
+
+        Raise:
+            BiliError: 验证未通过
+        '''
+        self.assertType(oldQuestionID, 'oldQuestionID', int)
+        self.assertType(oldAnswer, 'oldAnswer', str)
+        self.assertType(newQuestionID, 'newQuestionID', int)
+        self.assertType(newAnswer, 'newAnswer', str)
+
+        await self._updateSafeQuestion(
+            oldQuestionID, oldAnswer,
+            newQuestionID, newAnswer, 1)
+        await self._updateSafeQuestion(
+            oldQuestionID, oldAnswer,
+            newQuestionID, newAnswer, 2)
+
+    # properties
+
+    @property
+    @_requireLogined
+    def csrf(self):
+        cookies = self._getSession().cookie_jar.filter_cookies(
+            URL('https://api.bilibili.com'))
+        return cookies['bili_jct'].value
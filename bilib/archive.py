@@ -0,0 +1,186 @@
+'''弹幕的二进制列式存档格式。
+
+文件结构（小端序）::
+
+    header      magic 'BDMA', version u16, 列数 u16, 弹幕数 u64, 字符串数 u64
+    directory   每列 (名称 8 字节, 偏移 u64, 字节数 u64)，最后两项是字符串表的
+                offsets 和 blob
+    columns     DanmuBatch.COLUMNS 中的各列，按时间排序，8 字节对齐
+    strings     offsets (u64 × (字符串数 + 1)) 和 utf8 编码的 blob
+
+DanmuArchive 用 mmap 打开存档，数值列直接以 memoryview 访问，不复制、不反序列化。
+按时间查询时二分查找 t 列，只会读到需要的页。
+
+Usage::
+
+    writeArchive(batch, 'av271.bdma')
+    with DanmuArchive('av271.bdma') as archive:
+        batch = archive.read(start=60_000, end=120_000)
+'''
+import bisect
+import mmap
+import struct
+import sys
+from array import array
+
+from .batch import DanmuBatch
+
+
+MAGIC = b'BDMA'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQQ')
+ENTRY = struct.Struct('<8sQQ')
+ALIGN = 8
+
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+
+def _pad(size):
+    return -size % ALIGN
+
+
+def _toLittle(column):
+    if _BIG_ENDIAN and column.itemsize > 1:
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column
+
+
+def writeArchive(batch, path):
+    '''把 DanmuBatch 按时间排序后写入存档。
+
+    Args:
+        batch (bilib.DanmuBatch): 要保存的弹幕。
+        path (str): 文件路径。
+    '''
+    batch = batch.sortByTime()
+
+    # 只保存用到的字符串，同时重新编号
+    remap = {}
+    strings = []
+    msgIndex = array('I')
+    for i in batch.msgIndex:
+        j = remap.get(i)
+        if j is None:
+            j = remap[i] = len(strings)
+            strings.append(batch.strings[i].encode('utf8'))
+        msgIndex.append(j)
+
+    offsets = array('Q', [0])
+    for s in strings:
+        offsets.append(offsets[-1] + len(s))
+
+    sections = [(name, getattr(batch, name)) for name, _ in DanmuBatch.COLUMNS
+                if name != 'msgIndex']
+    sections += [('msgIndex', msgIndex), ('offsets', offsets),
+                 ('strings', b''.join(strings))]
+
+    pos = HEADER.size + ENTRY.size * len(sections)
+    pos += _pad(pos)
+    directory = []
+    for name, data in sections:
+        size = len(data) * data.itemsize if isinstance(data, array) else len(data)
+        directory.append((name, pos, size))
+        pos += size + _pad(size)
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(sections), len(batch), len(strings)))
+        for name, offset, size in directory:
+            f.write(ENTRY.pack(name.encode('ascii'), offset, size))
+        for (name, data), (_, offset, size) in zip(sections, directory):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(_toLittle(data) if isinstance(data, array) else data)
+
+
+class DanmuArchive:
+    '''以 mmap 方式只读打开的存档。
+
+    Attributes:
+        t, aid, cid, color, fontsize, mode, msgIndex (memoryview): 各列，直接映射
+            到文件，不复制。大端序的机器上会读入内存并转换。
+
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        magic, version, sections, self.count, self.stringCount = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            view.release()
+            self.close()
+            raise ValueError('%s is not a danmu archive' % path)
+
+        self._views = [view]
+        typecodes = dict(DanmuBatch.COLUMNS, offsets='Q')
+        self._strings = None
+        for i in range(sections):
+            name, offset, size = ENTRY.unpack_from(view, HEADER.size + ENTRY.size * i)
+            name = name.rstrip(b'\0').decode('ascii')
+            section = view[offset:offset + size]
+            self._views.append(section)
+            if name == 'strings':
+                self._strings = section
+                continue
+            column = section.cast(typecodes[name])
+            if _BIG_ENDIAN and column.itemsize > 1:
+                column = array(column.typecode, column)
+                column.byteswap()
+                column = memoryview(column)
+            self._views.append(column)
+            setattr(self, name, column)
+
+    def close(self):
+        # 释放所有 memoryview 之后才能关闭 mmap
+        for view in reversed(getattr(self, '_views', [])):
+            view.release()
+        self._views = []
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return '<%s %s %d danmus>' % (type(self).__name__, self.path, self.count)
+
+    def string(self, i):
+        '第 i 个字符串'
+        return str(self._strings[self.offsets[i]:self.offsets[i + 1]], 'utf8')
+
+    def range(self, start=None, end=None):
+        '''时间轴在 [start, end) 中的弹幕的下标范围。
+
+        Returns:
+            (lo, hi)
+        '''
+        lo = 0 if start is None else bisect.bisect_left(self.t, start)
+        hi = self.count if end is None else bisect.bisect_left(self.t, end, lo)
+        return lo, hi
+
+    def read(self, start=None, end=None):
+        '''读取时间轴在 [start, end) 中的弹幕。
+
+        Returns:
+            bilib.DanmuBatch: 只包含用到的字符串。
+        '''
+        lo, hi = self.range(start, end)
+        batch = DanmuBatch()
+        for name, _ in DanmuBatch.COLUMNS:
+            if name != 'msgIndex':
+                getattr(batch, name).frombytes(getattr(self, name)[lo:hi].cast('B'))
+        remap = {}
+        for i in self.msgIndex[lo:hi]:
+            j = remap.get(i)
+            if j is None:
+                j = remap[i] = batch._intern(self.string(i))
+            batch.msgIndex.append(j)
+        return batch
@@ -0,0 +1,210 @@
+'''列式存储的弹幕集合。
+
+数值字段保存在 array 中，弹幕内容保存在一张去重的字符串表里，每条弹幕只占
+三十几个字节，适合在内存中分析几十万条弹幕的时间轴。
+
+Usage::
+
+    batch = DanmuBatch.fromDanmus(danmus)
+    batch = batch.filter(start=60_000, end=120_000).sortByTime()
+    for t, msg in zip(batch.timeStrs(), batch.msgs()):
+        print(t, msg)
+'''
+from array import array
+
+from .danmu import Danmu, DanmuMode, formatTime
+
+# numpy 是可选的，只用来加速排序和过滤。导入 numpy 很慢，第一次用到时才导入
+_NOT_LOADED = object()
+np = _NOT_LOADED
+
+
+def _numpy():
+    '返回 numpy 模块，没有安装时返回 None'
+    global np
+    if np is _NOT_LOADED:
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+    return np
+
+
+class DanmuBatch:
+    '''一批弹幕，按列存储。
+
+    列：
+        t (array('d')): 时间轴，ms。
+        aid, cid (array('q')): cid 为 0 表示未知。
+        color (array('I')), fontsize (array('H')), mode (array('B')): 同 Danmu。
+        msgIndex (array('I')): 弹幕内容在 strings 中的下标。
+
+    切片、过滤、排序都返回新的 DanmuBatch，共用同一张字符串表。
+
+    '''
+
+    COLUMNS = (('t', 'd'), ('aid', 'q'), ('cid', 'q'), ('color', 'I'),
+               ('fontsize', 'H'), ('mode', 'B'), ('msgIndex', 'I'))
+
+    def __init__(self):
+        for name, typecode in self.COLUMNS:
+            setattr(self, name, array(typecode))
+        # 字符串表，以及内容到下标的映射，用于去重
+        self.strings = []
+        self._stringIndex = {}
+
+    def _empty(self):
+        '共用字符串表的空 DanmuBatch'
+        batch = DanmuBatch()
+        batch.strings = self.strings
+        batch._stringIndex = self._stringIndex
+        return batch
+
+    # 构造
+
+    def _intern(self, msg):
+        index = self._stringIndex.get(msg)
+        if index is None:
+            index = self._stringIndex[msg] = len(self.strings)
+            self.strings.append(msg)
+        return index
+
+    def append(self, msg, t, aid, cid=None, fontsize=25, color=0xFFFFFF, mode=DanmuMode.FLY):
+        '参数同 Danmu'
+        self.t.append(t)
+        self.aid.append(aid)
+        self.cid.append(cid or 0)
+        self.color.append(color)
+        self.fontsize.append(fontsize)
+        self.mode.append(mode.value if isinstance(mode, DanmuMode) else mode)
+        self.msgIndex.append(self._intern(msg))
+
+    def appendDanmu(self, danmu):
+        # 不触发 cid 的自动查找
+        self.append(danmu.msg, danmu.t, danmu.aid, danmu._cid,
+                    danmu.fontsize, danmu.color, danmu.mode)
+
+    def extend(self, danmus):
+        for danmu in danmus:
+            self.appendDanmu(danmu)
+
+    @classmethod
+    def fromDanmus(cls, danmus):
+        batch = cls()
+        batch.extend(danmus)
+        return batch
+
+    # 访问
+
+    def __len__(self):
+        return len(self.t)
+
+    def _danmu(self, i):
+        return Danmu(self.strings[self.msgIndex[i]], self.t[i], self.aid[i],
+                     self.cid[i] or None, self.fontsize[i], self.color[i],
+                     DanmuMode(self.mode[i]))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            batch = self._empty()
+            for name, _ in self.COLUMNS:
+                setattr(batch, name, getattr(self, name)[key])
+            return batch
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('DanmuBatch index out of range')
+        return self._danmu(key)
+
+    def __iter__(self):
+        return (self._danmu(i) for i in range(len(self)))
+
+    def msgs(self):
+        '所有弹幕的内容'
+        strings = self.strings
+        return [strings[i] for i in self.msgIndex]
+
+    def timeStrs(self):
+        '所有弹幕的时间轴字符串，格式同 Danmu.getTimeStr'
+        # 同一毫秒的弹幕很多，缓存格式化的结果
+        cache = {}
+        result = []
+        for t in self.t:
+            s = cache.get(t)
+            if s is None:
+                s = cache[t] = formatTime(t)
+            result.append(s)
+        return result
+
+    def __repr__(self):
+        return '<%s %d danmus, %d strings>' % (
+            type(self).__name__, len(self), len(self.strings))
+
+    # 运算
+
+    def take(self, indices):
+        '''按下标取出弹幕组成新的 DanmuBatch。
+
+        Args:
+            indices (iterable of int): 下标，可以重复、乱序。
+        '''
+        if not isinstance(indices, (list, array)):
+            indices = list(indices)
+        batch = self._empty()
+        for name, typecode in self.COLUMNS:
+            column = getattr(self, name)
+            setattr(batch, name, array(typecode, [column[i] for i in indices]))
+        return batch
+
+    def argsortByTime(self):
+        '按时间排序的下标，时间相同时保持原顺序'
+        np = _numpy()
+        if np is not None:
+            return np.argsort(np.frombuffer(self.t, dtype=np.float64),
+                              kind='stable').tolist()
+        return sorted(range(len(self)), key=self.t.__getitem__)
+
+    def sortByTime(self):
+        '返回按时间排序的新 DanmuBatch'
+        return self.take(self.argsortByTime())
+
+    def filter(self, predicate=None, start=None, end=None, aid=None, cid=None, mode=None):
+        '''过滤弹幕，所有条件同时满足才保留。
+
+        Args:
+            predicate (callable): 接收 Danmu，返回 bool。会为每条弹幕构造 Danmu，
+                比较慢，尽量使用其他参数。
+            start, end (float): 时间轴范围 [start, end)，ms。
+            aid, cid (int): 只保留这个视频/分 P 的弹幕。
+            mode (bilib.DanmuMode): 只保留这种模式的弹幕。
+        '''
+        np = _numpy()
+        if np is not None:
+            mask = np.ones(len(self), dtype=bool)
+            t = np.frombuffer(self.t, dtype=np.float64)
+            if start is not None:
+                mask &= t >= start
+            if end is not None:
+                mask &= t < end
+            if aid is not None:
+                mask &= np.frombuffer(self.aid, dtype=np.int64) == aid
+            if cid is not None:
+                mask &= np.frombuffer(self.cid, dtype=np.int64) == cid
+            if mode is not None:
+                mask &= np.frombuffer(self.mode, dtype=np.uint8) == mode.value
+            indices = np.flatnonzero(mask).tolist()
+        else:
+            indices = range(len(self))
+            if start is not None:
+                indices = [i for i in indices if self.t[i] >= start]
+            if end is not None:
+                indices = [i for i in indices if self.t[i] < end]
+            if aid is not None:
+                indices = [i for i in indices if self.aid[i] == aid]
+            if cid is not None:
+                indices = [i for i in indices if self.cid[i] == cid]
+            if mode is not None:
+                indices = [i for i in indices if self.mode[i] == mode.value]
+        if predicate is not None:
+            indices = [i for i in indices if predicate(self._danmu(i))]
+        return self.take(indices)
@@ -0,0 +1,173 @@
+'''线程安全的 LRU + TTL 缓存。
+
+Usage::
+
+    cache = TTLCache(maxsize=1024, ttl=60, disk=SQLiteCache('cache.db'))
+    value = cache.getOrLoad(key, lambda: fetch(key))
+'''
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    '''按最近使用淘汰、按时间过期的内存缓存。
+
+    Args:
+        maxsize (int): 最多缓存的条目数，超出时淘汰最久没有使用的。
+        ttl (float): 默认的过期时间，秒，None 表示不过期。
+        disk (SQLiteCache): 可选的第二级缓存，内存未命中时查询，写入时同步写入。
+            此时 key 会被转成 str，value 需要可以 json 序列化。
+
+    '''
+
+    def __init__(self, maxsize=1024, ttl=None, disk=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.disk = disk
+        self._data = OrderedDict()      # key -> (expires, value)
+        self._lock = threading.Lock()
+        self._loading = {}              # key -> 正在加载该 key 的锁
+
+        self.hits = 0
+        self.misses = 0
+
+    def _expires(self, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        return float('inf') if ttl is None else time.monotonic() + ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._data[key]
+
+        if self.disk is not None:
+            value, ttl = self.disk.get(str(key))
+            if value is not _MISSING:
+                self._set(key, value, ttl)
+                with self._lock:
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def _set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (self._expires(ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        self._set(key, value, ttl)
+        if self.disk is not None:
+            self.disk.set(str(key), value, self.ttl if ttl is None else ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        if self.disk is not None:
+            self.disk.delete(str(key))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def getOrLoad(self, key, loader, ttl=None):
+        '''取出 key 对应的值，不存在时调用 loader() 加载并缓存。
+
+        同一个 key 同时只会有一个线程调用 loader，其他线程等待并共用它的结果。
+        loader 抛出异常时不缓存，等待的线程会各自重试。
+        '''
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            lock = self._loading.get(key)
+            if lock is None:
+                lock = self._loading[key] = threading.Lock()
+        try:
+            with lock:
+                # 等锁期间可能已经被其他线程加载了
+                value = self.get(key, _MISSING)
+                if value is _MISSING:
+                    value = loader()
+                    self.set(key, value, ttl)
+                return value
+        finally:
+            with self._lock:
+                if self._loading.get(key) is lock:
+                    del self._loading[key]
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return '<%s %d/%d hits=%d misses=%d>' % (
+            type(self).__name__, len(self._data), self.maxsize, self.hits, self.misses)
+
+
+class SQLiteCache:
+    '''保存在 SQLite 中的缓存，作为 TTLCache 的第二级，进程重启后仍然有效。
+
+    Args:
+        path (str): 数据库路径。
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        import sqlite3
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)')
+
+    def get(self, key):
+        '''Returns:
+            tuple: (value, 剩余的 ttl)，不存在或已过期时 value 为 _MISSING。
+        '''
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return _MISSING, None
+        value, expires = row
+        if expires is None:
+            return json.loads(value), None
+        ttl = expires - time.time()
+        if ttl <= 0:
+            self.delete(key)
+            return _MISSING, None
+        return json.loads(value), ttl
+
+    def set(self, key, value, ttl=None):
+        expires = None if ttl is None else time.time() + ttl
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                (key, json.dumps(value), expires))
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,148 @@
+'''批量抓取多个 up 主的投稿和视频的分 P 信息。
+
+Crawler 在固定大小的线程池中并发请求，合并重复的 uid 和 aid，结果放在所有
+Crawler 共享的 Crawler.cache 中。再次抓取同一个 up 主时只读取新的投稿，没有
+新投稿时只需要确认第一页。
+
+Usage::
+
+    crawler = Crawler(user, workers=8)
+    videos = crawler.videosOfUsers(uids)
+    aids = crawler.collectAids(uids, ranking=True)
+    pages = crawler.pageLists(aids)
+'''
+import collections
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import TTLCache
+from .danmu import Danmu
+
+
+logger = logging.getLogger(__name__)
+
+
+class Crawler:
+    '''批量抓取。
+
+    Args:
+        user (User): 用来请求的用户，在多个线程中共享。
+        workers (int): 线程池的大小。
+        prefetch (int): 每个 up 主预取的页数，同时进行的请求最多为
+            workers * (1 + prefetch)。
+        cache (TTLCache): 结果缓存，默认使用共享的 Crawler.cache。
+
+    Attributes:
+        errors (dict): 上一次调用中出错的 uid 或 aid -> 异常。出错的项不会出现在结果中。
+        stats (collections.Counter): 每个 up 主的投稿是怎样得到的，
+            'cached'（没有变化）、'incremental'（只读取了新投稿）或 'full'。
+
+    '''
+
+    # ('videos', uid) -> 投稿列表，按发布时间从新到旧
+    cache = TTLCache(maxsize=10000, ttl=24 * 60 * 60)
+
+    def __init__(self, user, workers=8, prefetch=0, cache=None):
+        self.user = user
+        self.workers = workers
+        self.prefetch = prefetch
+        if cache is not None:
+            self.cache = cache
+        self.errors = {}
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _map(self, func, items):
+        '在线程池中对去重后的 items 调用 func，返回 item -> 结果，出错的项记录在 errors'
+        self.errors = {}
+        items = list(dict.fromkeys(items))
+
+        def call(item):
+            try:
+                return func(item)
+            except Exception as ex:
+                logger.warning('%s(%r) failed: %r', func.__name__, item, ex)
+                with self._lock:
+                    self.errors[item] = ex
+                return None
+
+        if len(items) <= 1:
+            results = map(call, items)
+        else:
+            with ThreadPoolExecutor(min(self.workers, len(items))) as pool:
+                results = list(pool.map(call, items))
+        return {item: result for item, result in zip(items, results)
+                if item not in self.errors}
+
+    def videosOfUsers(self, uids):
+        '''获取多个 up 主的全部投稿。
+
+        Args:
+            uids (iterable of int): 重复的只会抓取一次。
+
+        Returns:
+            dict: uid -> 投稿列表，按发布时间从新到旧。
+        '''
+        return self._map(self._videosOfUser, uids)
+
+    def _videosOfUser(self, uid):
+        key = ('videos', uid)
+        old = self.cache.get(key)
+        newest = old[0]['aid'] if old else None
+
+        new = []
+        with self.user.iterVideosOfUser(uid, prefetch=self.prefetch) as videos:
+            for video in videos:
+                if video['aid'] == newest:
+                    break
+                new.append(video)
+            else:
+                self._count('full')
+                self.cache.set(key, new)
+                return new
+
+        # 总数对得上时说明旧的投稿没有变化，否则有投稿被删除，重新读取
+        if videos.count == len(new) + len(old):
+            videos = new + old
+            self._count('incremental' if new else 'cached')
+        else:
+            videos = list(self.user.iterVideosOfUser(uid, prefetch=self.prefetch))
+            self._count('full')
+        self.cache.set(key, videos)
+        return videos
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def collectAids(self, uids=(), ranking=False, recommend=False):
+        '''汇总多个来源的 aid 并去重。
+
+        Args:
+            uids (iterable of int): 这些 up 主的全部投稿。
+            ranking (bool): 包括排行榜。
+            recommend (bool): 包括首页推荐，需要 user 已经登陆。
+
+        Returns:
+            list of int: 按第一次出现的顺序。
+        '''
+        aids = []
+        for videos in self.videosOfUsers(uids).values():
+            aids.extend(video['aid'] for video in videos)
+        if ranking:
+            aids.extend(item.aid for item in self.user.getRankingList())
+        if recommend:
+            aids.extend(self.user.getRecommendAids())
+        return list(dict.fromkeys(int(aid) for aid in aids))
+
+    def pageLists(self, aids):
+        '''并发获取视频的分 P 列表，结果同时放入 Danmu.pageCache。
+
+        Args:
+            aids (iterable of int): 重复的只会查询一次。
+
+        Returns:
+            dict: aid -> 分 P 列表。
+        '''
+        return self._map(Danmu.getPageList, aids)
@@ -0,0 +1,218 @@
+'''登陆时加密密码所用的 RSA 后端。
+
+安装了 cryptography 时使用它（基于 OpenSSL），否则使用纯 Python 的 rsa。
+大批量登陆时可以用 ProcessPoolBackend 把加密放到子进程中，调用的线程在等待
+结果时不持有 GIL。公钥加载后会缓存，加密本身通常只需要几十微秒，进程间通信的
+开销可能更大，使用前先用 benchmark.py 比较。
+
+Usage::
+
+    from bilib import crypto
+
+    crypto.setDefaultBackend(crypto.ProcessPoolBackend(processes=4))
+    Fleet(users, workers=32).run()
+'''
+import functools
+import threading
+from concurrent.futures import Future
+
+
+class RSABackend:
+    '''加密后端的基类。
+
+    子类实现 loadKey 和 encryptWithKey，加载的公钥按 PEM 缓存。
+    '''
+
+    name = None
+
+    def __init__(self):
+        self._loadKey = functools.lru_cache(maxsize=16)(self.loadKey)
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, self.name)
+
+    def loadKey(self, pem):
+        '把 PEM 格式的公钥转换为 encryptWithKey 使用的对象'
+        raise NotImplementedError
+
+    def encryptWithKey(self, key, message):
+        raise NotImplementedError
+
+    def encrypt(self, pem, message):
+        '''用公钥以 PKCS#1 v1.5 加密。
+
+        Args:
+            pem (str): PEM 格式的公钥，即 getKey 返回的 key。
+            message (bytes): 明文。
+
+        Returns:
+            bytes: 密文。
+        '''
+        return self.encryptWithKey(self._loadKey(pem), message)
+
+    def submit(self, pem, message):
+        '''同 encrypt，返回 concurrent.futures.Future，可以用 asyncio.wrap_future 等待。'''
+        future = Future()
+        try:
+            future.set_result(self.encrypt(pem, message))
+        except Exception as ex:
+            future.set_exception(ex)
+        return future
+
+    def close(self):
+        pass
+
+
+class PythonRSABackend(RSABackend):
+    '纯 Python 的 rsa 库，bilib 的依赖，总是可用'
+
+    name = 'rsa'
+
+    def __init__(self):
+        super().__init__()
+        import rsa
+        self._rsa = rsa
+
+    def loadKey(self, pem):
+        return self._rsa.PublicKey.load_pkcs1_openssl_pem(pem.encode('utf8'))
+
+    def encryptWithKey(self, key, message):
+        return self._rsa.encrypt(message, key)
+
+
+class CryptographyBackend(RSABackend):
+    '''cryptography 库，需要单独安装::
+
+        $ pip install cryptography
+    '''
+
+    name = 'cryptography'
+
+    def __init__(self):
+        super().__init__()
+        from cryptography.hazmat.primitives.asymmetric import padding
+        from cryptography.hazmat.primitives.serialization import load_pem_public_key
+        self._padding = padding.PKCS1v15()
+        self._loadPem = load_pem_public_key
+
+    def loadKey(self, pem):
+        return self._loadPem(pem.encode('utf8'))
+
+    def encryptWithKey(self, key, message):
+        return key.encrypt(message, self._padding)
+
+
+# 按优先级排列
+BACKENDS = {
+    'cryptography': CryptographyBackend,
+    'rsa': PythonRSABackend,
+}
+
+
+def getBackend(name=None):
+    '''创建一个后端。
+
+    Args:
+        name (str): BACKENDS 中的名字，不给定时选择第一个可以使用的。
+
+    Raises:
+        ValueError: 未知的名字。
+        ImportError: 指定的后端所需的库没有安装。
+    '''
+    if name is not None:
+        if name not in BACKENDS:
+            raise ValueError('Unknown RSA backend %r.' % name)
+        return BACKENDS[name]()
+    for backend in BACKENDS.values():
+        try:
+            return backend()
+        except ImportError:
+            continue
+    raise ImportError('No RSA backend is available.')
+
+
+# 子进程中的后端，name -> RSABackend
+_workerBackends = {}
+
+
+def _encryptInWorker(name, pem, message):
+    backend = _workerBackends.get(name)
+    if backend is None:
+        backend = _workerBackends[name] = getBackend(name)
+    return backend.encrypt(pem, message)
+
+
+class ProcessPoolBackend(RSABackend):
+    '''在子进程中加密。
+
+    每次加密需要一次进程间通信，单个登陆反而更慢，适合多个线程同时登陆的场景。
+
+    Args:
+        backend (str): 子进程中使用的后端名，默认与 getBackend() 的选择相同。
+        processes (int): 子进程数，默认为 CPU 核数。
+
+    Note:
+        子进程在第一次加密时才启动，用完后调用 close()，或者使用 with。
+    '''
+
+    name = 'process'
+
+    def __init__(self, backend=None, processes=None):
+        super().__init__()
+        self.backend = backend or getBackend().name
+        self.processes = processes
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<%s %s x%s>' % (type(self).__name__, self.backend,
+                                self.processes or 'cpu')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, pem, message):
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(self.processes)
+            executor = self._executor
+        return executor.submit(_encryptInWorker, self.backend, pem, message)
+
+    def encrypt(self, pem, message):
+        return self.submit(pem, message).result()
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+_defaultBackend = None
+_defaultLock = threading.Lock()
+
+
+def getDefaultBackend():
+    '获取默认的后端，User 登陆时使用它加密密码'
+    global _defaultBackend
+    with _defaultLock:
+        if _defaultBackend is None:
+            _defaultBackend = getBackend()
+        return _defaultBackend
+
+
+def setDefaultBackend(backend):
+    '''替换默认的后端
+
+    Args:
+        backend (RSABackend or str): 后端或 BACKENDS 中的名字。
+    '''
+    global _defaultBackend
+    if isinstance(backend, str):
+        backend = getBackend(backend)
+    with _defaultLock:
+        _defaultBackend = backend
@@ -1,17 +1,40 @@
-import requests
 from enum import Enum
 import logging
-import unittest
+
+from .cache import TTLCache
 
 
 logger = logging.getLogger(__name__)
 
 
 class DanmuMode(Enum):
-    '弹幕的类型，FLY 平飞, DOWN 底部弹幕，TOP 顶部弹幕'
+    '''弹幕的类型，FLY 平飞, DOWN 底部弹幕，TOP 顶部弹幕
+
+    REVERSE 逆向，SPECIAL 高级弹幕，CODE 代码弹幕只会出现在下载的弹幕中。
+    '''
     FLY = 1
     DOWN = 4
     TOP = 5
+    REVERSE = 6
+    SPECIAL = 7
+    CODE = 8
+
+
+def formatTime(t):
+    '将以 ms 为单位的时间格式化为 h:mm:ss.mmm'
+    # ms
+    res = '.%03d' % (t % 1000)
+    t //= 1000
+
+    # s, min
+    for _ in range(2):
+        res = ('%d' if t < 60 else ':%02d') % (t % 60) + res
+        t //= 60
+        if t == 0:
+            return res
+
+    res = '%d' % t + res
+    return res
 
 
 class Danmu:
@@ -21,54 +44,140 @@ class Danmu:
         msg (str): 要发送的弹幕内容。
         t (int or float): 弹幕在视频中的时间轴，以 ms 为单位。
         aid (int): 视频的 aid，即 www.bilibili.com/video/av{aid}。
-        cid (int): 视频分 P 的 cid。如果不给定，将在构造函数中自动查找。
+        cid (int): 视频分 P 的 cid。如果不给定，将在第一次访问 danmu.cid 时自动查找。
         fontsize (int): 弹幕字号，默认 25，不建议改动。
         color (int): 弹幕的颜色，默认白色。以 16 进制（web 形式）计算。
         mode (bilib.DanmuMode): 弹幕模式，默认平飞。
+        page (int): 没有给定 cid 时，查找第几 P 的 cid，默认第一 P。
+
+    Note:
+        构造函数不会访问网络。大量弹幕需要查找 cid 时，先调用
+        Danmu.resolveCids(danmus) 并发查找。
+
+        使用了 __slots__，不能添加其他属性。大量弹幕建议使用 bilib.DanmuBatch。
     '''
 
-    def __init__(self, msg, t, aid, cid=None, fontsize=25, color=0xFFFFFF, mode=DanmuMode.FLY):
+    __slots__ = ('msg', 't', 'aid', '_cid', 'fontsize', 'color', 'mode', 'page')
+
+    def __init__(self, msg, t, aid, cid=None, fontsize=25, color=0xFFFFFF, mode=DanmuMode.FLY, page=None):
         self.msg = msg
         self.t = t
         self.aid = aid
         self.fontsize = fontsize
         self.color = color
         self.mode = mode
+        self.page = page
+
+        self._cid = cid if cid else None
+
+    @property
+    def cid(self):
+        if self._cid is None:
+            self._cid = self.getCid(self.aid, self.page)
+        return self._cid
 
-        self.cid = cid if cid else self.getCid(aid)
+    @cid.setter
+    def cid(self, value):
+        self._cid = value
+
+    @classmethod
+    def prefetch(cls, aids, workers=8):
+        '''并发获取多个 aid 的分 P 列表并放入缓存。
+
+        Args:
+            aids (iterable): aid，重复的只会查询一次。
+            workers (int): 并发的线程数。
+
+        Returns:
+            dict: aid -> 分 P 列表。
+        '''
+        aids = list(dict.fromkeys(aids))
+        if len(aids) <= 1:
+            return {aid: cls.getPageList(aid) for aid in aids}
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(min(workers, len(aids))) as pool:
+            return dict(zip(aids, pool.map(cls.getPageList, aids)))
+
+    @classmethod
+    def resolveCids(cls, danmus, workers=8):
+        '''为一批没有 cid 的弹幕并发查找 cid。
+
+        Args:
+            danmus (iterable of Danmu): 要查找的弹幕。
+            workers (int): 并发的线程数。
+        '''
+        danmus = [danmu for danmu in danmus if danmu._cid is None]
+        cls.prefetch((danmu.aid for danmu in danmus), workers)
+        for danmu in danmus:
+            # 分 P 列表已经在缓存中，不会再访问网络
+            danmu._cid = cls.getCid(danmu.aid, danmu.page)
+
+    PAGE_LIST_URL = 'https://www.bilibili.com/widget/getPageList'
+    # aid -> 分 P 列表，所有 Danmu 共享。需要持久化时可以替换为带 disk 的 TTLCache
+    pageCache = TTLCache(maxsize=4096, ttl=60 * 60)
+
+    @classmethod
+    def getPageList(cls, aid):
+        '''获取 aid 的所有分 P。
+
+        结果缓存在 Danmu.pageCache 中，同一个 aid 并发查询时只会请求一次。
+
+        Returns:
+            list: 每一 P 的 dict，包含 page (从 1 开始), cid, pagename 等。
+                这是缓存的对象，不要修改。
+        '''
+        return cls.pageCache.getOrLoad(aid, lambda: cls._fetchPageList(aid))
 
     @staticmethod
-    def getCid(aid):
+    def _fetchPageList(aid):
+        '经过匿名用户的 User.do 请求，使用默认连接池的重试策略和超时'
+        from .user import User
+        logger.debug('获取 cid 中')
+        data = User._anonymous().get(Danmu.PAGE_LIST_URL, params={'aid': aid},
+                                     headers={'Host': 'www.bilibili.com'},
+                                     key=None, checkCode=False)
+        return Danmu._checkPageList(aid, data)
+
+    @staticmethod
+    def _checkPageList(aid, data):
+        '检查 getPageList 接口的返回，同步与异步版本共用'
+        if isinstance(data, list):
+            return data
+        from .user import BiliError
+        # 视频不存在等错误时返回的是带有 code 的 dict
+        code = data.get('code') if isinstance(data, dict) else None
+        message = data.get('message') if isinstance(data, dict) else None
+        raise BiliError(message or f'aid {aid} 的分 P 列表不正确: {data!r}', code=code)
+
+    @classmethod
+    def getCid(cls, aid, page=None):
         '''获取 aid 对应的 cid。
 
+        Args:
+            aid (int): 视频的 aid。
+            page (int): 第几 P，从 1 开始。
+
         Note:
-            取第一 P 的 cid，如果是多 P，建议手动指定。
+            不指定 page 时取第一 P 的 cid，如果是多 P，建议手动指定。
 
         '''
-        logger.debug('获取 cid 中')
-        url = f'https://www.bilibili.com/widget/getPageList?aid={aid}'
-        data = requests.get(url).json()
-        if len(data) != 1:
-            logger.warning(f'当前 aid {aid} 有多 P，建议手动指定 aid')
-        cid = data[0]['cid']
+        return cls._selectCid(aid, cls.getPageList(aid), page)
+
+    @staticmethod
+    def _selectCid(aid, data, page):
+        '从分 P 列表中取出第 page P 的 cid，同步与异步版本共用'
+        if page is None:
+            if len(data) != 1:
+                logger.warning(f'当前 aid {aid} 有多 P，建议手动指定 aid')
+            page = 1
+        if not 1 <= page <= len(data):
+            raise ValueError(f'aid {aid} 只有 {len(data)} P，没有第 {page} P')
+        cid = data[page - 1]['cid']
         logger.debug(f'cid 获取: {cid}')
         return cid
 
     def getTimeStr(self):
-        t = self.t
-        # ms
-        res = '.%03d' % (t % 1000)
-        t //= 1000
-
-        # s, min
-        for _ in range(2):
-            res = ('%d' if t < 60 else ':%02d') % (t % 60) + res
-            t //= 60
-            if t == 0:
-                return res
-
-        res = '%d' % t + res
-        return res
+        return formatTime(self.t)
 
     def __repr__(self):
         return f'<Danmu "{self.msg}" @{self.getTimeStr()} #{self.aid}>'
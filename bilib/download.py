@@ -0,0 +1,214 @@
+'''下载视频的弹幕。
+
+支持两种来源：
+
++ XML 弹幕列表 (list.so)，deflate 压缩，只包含最近的一部分弹幕；
++ 分段的 protobuf 弹幕 (seg.so)，每 6 分钟一段，包含全部弹幕。
+
+两者都以生成器的方式逐条返回 Danmu，边下载边解析，不会把整个文件读进内存。
+
+Usage::
+
+    for danmu in iterSegmentDanmus(cid, aid):
+        ...
+'''
+import logging
+import math
+import xml.etree.ElementTree as ET
+
+from .danmu import Danmu, DanmuMode
+from .transport import getDefaultTransport
+from .user import User
+
+
+logger = logging.getLogger(__name__)
+
+# 分段弹幕每段的长度，秒
+SEGMENT_SECONDS = 6 * 60
+CHUNK_SIZE = 64 * 1024
+
+
+def _toMode(value):
+    '2, 3 也是平飞弹幕；无法识别的模式返回 None'
+    if value in (2, 3):
+        return DanmuMode.FLY
+    try:
+        return DanmuMode(value)
+    except ValueError:
+        return None
+
+
+def _checkResponse(response):
+    '出错时 b 站返回 json，转换为 BiliError'
+    if 'json' in response.headers.get('Content-Type', ''):
+        User._parseResponse(response.content)
+    response.raise_for_status()
+
+
+# XML
+
+def parseXml(chunks, aid=0, cid=0):
+    '''增量解析 XML 弹幕。
+
+    Args:
+        chunks (iterable of bytes): XML 文本的分块（已解压）。
+        aid, cid (int): 填入生成的 Danmu。
+
+    Yields:
+        Danmu
+    '''
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    root = None
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if root is None:
+                root = elem
+            if event != 'end' or elem.tag != 'd':
+                continue
+            danmu = _xmlDanmu(elem, aid, cid)
+            if danmu is not None:
+                yield danmu
+        # 已经处理过的节点不再保留
+        if root is not None:
+            root.clear()
+    parser.close()
+
+
+def _xmlDanmu(elem, aid, cid):
+    # p = 时间(s),模式,字号,颜色,发送时间,弹幕池,用户hash,dmid
+    p = elem.get('p', '').split(',')
+    if len(p) < 4:
+        return None
+    mode = _toMode(int(p[1]))
+    if mode is None:
+        logger.debug('跳过未知模式的弹幕 %s' % p)
+        return None
+    return Danmu(elem.text or '', round(float(p[0]) * 1000), aid, cid or None,
+                 int(p[2]), int(p[3]), mode)
+
+
+def iterXmlDanmus(cid, aid=0, session=None):
+    '''下载并解析 XML 弹幕列表。
+
+    Args:
+        cid (int): 分 P 的 cid。
+        aid (int): 填入生成的 Danmu。
+        session (requests.Session): 使用的 session，默认为不带 cookies 的共享连接池。
+
+    Yields:
+        Danmu
+    '''
+    get = session.get if session is not None else getDefaultTransport().get
+    response = get('https://api.bilibili.com/x/v1/dm/list.so',
+                   params={'oid': cid}, stream=True)
+    with response:
+        _checkResponse(response)
+        # requests 会处理 Content-Encoding: deflate
+        yield from parseXml(response.iter_content(CHUNK_SIZE), aid, cid)
+
+
+# protobuf
+
+def _readVarint(data, pos):
+    result = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iterFields(data):
+    '''遍历 protobuf 消息的字段，只实现弹幕需要的部分。
+
+    Yields:
+        (field, value)，varint 为 int，其他类型为 data 的 memoryview 切片，不复制。
+    '''
+    data = memoryview(data)
+    pos, end = 0, len(data)
+    while pos < end:
+        key, pos = _readVarint(data, pos)
+        field, wireType = key >> 3, key & 7
+        if wireType == 0:
+            value, pos = _readVarint(data, pos)
+        elif wireType == 2:
+            length, pos = _readVarint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wireType == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wireType == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError('Unsupported protobuf wire type %d' % wireType)
+        yield field, value
+
+
+def parseSegment(data, aid=0, cid=0):
+    '''解析一段 protobuf 弹幕 (DmSegMobileReply)。
+
+    Yields:
+        Danmu
+    '''
+    for field, elem in _iterFields(data):
+        if field != 1:
+            continue
+        # DanmakuElem: 2 progress, 3 mode, 4 fontsize, 5 color, 7 content
+        progress, mode, fontsize, color, content = 0, 1, 25, 0xFFFFFF, ''
+        for key, value in _iterFields(elem):
+            if key == 2:
+                progress = value
+            elif key == 3:
+                mode = value
+            elif key == 4:
+                fontsize = value
+            elif key == 5:
+                color = value
+            elif key == 7:
+                content = str(value, 'utf8')
+        mode = _toMode(mode)
+        if mode is None:
+            continue
+        yield Danmu(content, progress, aid, cid or None, fontsize, color, mode)
+
+
+def iterSegmentDanmus(cid, aid=0, duration=None, session=None):
+    '''逐段下载并解析 protobuf 弹幕。
+
+    Args:
+        cid (int): 分 P 的 cid。
+        aid (int): 视频 aid。给定且没有给定 duration 时，从分 P 列表中获取时长。
+        duration (int): 视频时长，秒。决定下载多少段。
+        session (requests.Session): 使用的 session，默认为不带 cookies 的共享连接池。
+
+    Note:
+        不知道时长时，下载到第一个空的分段为止，如果视频中间有 6 分钟没有弹幕，
+        之后的弹幕会被漏掉。
+
+    Yields:
+        Danmu
+    '''
+    if duration is None and aid:
+        for page in Danmu.getPageList(aid):
+            if page['cid'] == cid:
+                duration = page.get('duration')
+    segments = math.ceil(duration / SEGMENT_SECONDS) if duration else None
+
+    get = session.get if session is not None else getDefaultTransport().get
+    index = 1
+    while segments is None or index <= segments:
+        response = get('https://api.bilibili.com/x/v2/dm/web/seg.so',
+                       params={'type': 1, 'oid': cid, 'segment_index': index})
+        _checkResponse(response)
+        data = response.content
+        # 每次只保留一段的数据
+        del response
+        if not data and segments is None:
+            return
+        yield from parseSegment(data, aid, cid)
+        index += 1
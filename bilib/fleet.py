@@ -0,0 +1,215 @@
+'''批量维护多个账号。
+
+Fleet 在固定大小的线程池中并发处理多个账号，每个账号按顺序执行一组任务，
+一个账号出错不影响其他账号。给定 progress 时记录每个账号已经完成的任务，
+中断后再次运行同一个 runId 只会执行没有完成的任务。
+
+Usage::
+
+    transport = Transport(maxConnections=32, maxPerHost=16)
+    users = [User(phone, password, transport=transport, store=store)
+             for phone, password in accounts]
+    fleet = Fleet(users, workers=16, progress=FileStore('progress.json'))
+    report = fleet.run()
+    for phone, error in report.failed().items():
+        print(phone, error)
+'''
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+# 每天的维护任务，依次调用 User 上的这些方法
+DAILY_TASKS = ('login', 'liveSignIn', 'getTodayCoinExp', 'getUserInfo')
+
+
+class AccountResult:
+    '''一个账号的执行结果。
+
+    Attributes:
+        phone (str): 账号。
+        results (dict): 完成的任务名 -> 返回值，包括之前运行中已经完成的。
+        errors (dict): 出错的任务名 -> 异常。保存进度失败时键为 PROGRESS。
+        status (dict): 任务名 -> 'ok'、'failed'、'skipped'（登陆失败而没有执行）
+            或 'resumed'（之前运行中已经完成，这次没有执行）。
+        elapsed (float): 这次运行的耗时，秒。
+
+    '''
+
+    __slots__ = ('phone', 'results', 'errors', 'status', 'elapsed')
+
+    PROGRESS = 'progress'
+
+    def __init__(self, phone):
+        self.phone = phone
+        self.results = {}
+        self.errors = {}
+        self.status = {}
+        self.elapsed = 0
+
+    @property
+    def ok(self):
+        return not self.errors and all(
+            status in ('ok', 'resumed') for status in self.status.values())
+
+    def __repr__(self):
+        return '<AccountResult %s %d ok, %d failed>' % (
+            self.phone, len(self.results), len(self.errors))
+
+    def toDict(self):
+        '可以 json 序列化的结果，异常转换为 repr'
+        return {
+            'phone': self.phone,
+            'ok': self.ok,
+            'status': self.status,
+            'results': self.results,
+            'errors': {task: repr(ex) for task, ex in self.errors.items()},
+            'elapsed': self.elapsed,
+        }
+
+
+class FleetReport:
+    '''Fleet.run 的结果。
+
+    Attributes:
+        runId (str): 运行的标识。
+        accounts (dict): phone -> AccountResult，按传入的顺序。
+        elapsed (float): 总耗时，秒。
+
+    '''
+
+    def __init__(self, runId, accounts, elapsed):
+        self.runId = runId
+        self.accounts = accounts
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return '<FleetReport %s %d/%d ok %.1fs>' % (
+            self.runId, len(self.accounts) - len(self.failed()),
+            len(self.accounts), self.elapsed)
+
+    def failed(self):
+        '''出错的账号。
+
+        Returns:
+            dict: phone -> 第一个出错任务的异常。
+        '''
+        return {phone: next(iter(result.errors.values()))
+                for phone, result in self.accounts.items() if result.errors}
+
+    def summary(self):
+        '''每个任务的统计。
+
+        Returns:
+            dict: 任务名 -> {'ok': n, 'failed': n, 'skipped': n, 'resumed': n}。
+        '''
+        summary = {}
+        for result in self.accounts.values():
+            for task, status in result.status.items():
+                counts = summary.setdefault(task, dict.fromkeys(
+                    ('ok', 'failed', 'skipped', 'resumed'), 0))
+                counts[status] += 1
+        return summary
+
+    def toDict(self):
+        '可以 json 序列化的报告'
+        return {
+            'runId': self.runId,
+            'elapsed': self.elapsed,
+            'summary': self.summary(),
+            'accounts': [result.toDict() for result in self.accounts.values()],
+        }
+
+
+class Fleet:
+    '''并发地对多个账号执行相同的任务。
+
+    Args:
+        users (iterable of User): 要处理的账号，phone 重复的只处理一次。
+            建议共享同一个 transport 并设置 store，这样未过期的账号不需要重新登陆。
+        tasks (iterable): 每个账号依次执行的任务，可以是 User 的方法名，或者接收
+            user 的函数，以函数名作为任务名。第一个任务通常是 'login'。
+        workers (int): 同时处理的账号数。
+        progress (bilib.store.CredentialStore): 保存进度，例如 FileStore，
+            不给定时不保存。返回值需要能够 json 序列化。
+        runId (str): 这次运行的标识，进度只在相同的 runId 之间继承，
+            默认为当天的日期。
+
+    '''
+
+    def __init__(self, users, tasks=DAILY_TASKS, workers=8, progress=None, runId=None):
+        self.users = list({user.phone: user for user in users}.values())
+        self.tasks = [(task, task) if isinstance(task, str) else (task.__name__, task)
+                      for task in tasks]
+        self.workers = workers
+        self.progress = progress
+        self.runId = runId or time.strftime('%Y-%m-%d')
+
+    def run(self):
+        '''处理所有账号。
+
+        Returns:
+            FleetReport
+        '''
+        start = time.monotonic()
+        if len(self.users) <= 1:
+            results = list(map(self._runAccount, self.users))
+        else:
+            with ThreadPoolExecutor(min(self.workers, len(self.users))) as pool:
+                results = list(pool.map(self._runAccount, self.users))
+        return FleetReport(self.runId, {result.phone: result for result in results},
+                           time.monotonic() - start)
+
+    def _loadProgress(self, phone):
+        if self.progress is None:
+            return {}
+        state = self.progress.load(phone)
+        if not state or state.get('runId') != self.runId:
+            return {}
+        return state['results']
+
+    def _saveProgress(self, phone, results):
+        if self.progress is not None:
+            self.progress.save(phone, {'runId': self.runId, 'results': dict(results)})
+
+    def _runAccount(self, user):
+        result = AccountResult(user.phone)
+        start = time.monotonic()
+        done = self._loadProgress(user.phone)
+        # 登陆状态不保存在进度中，还有任务要执行时 login 需要重新执行
+        remaining = any(name not in done for name, _ in self.tasks if name != 'login')
+        loginFailed = False
+        for name, task in self.tasks:
+            if name in done and (name != 'login' or not remaining):
+                result.results[name] = done[name]
+                result.status[name] = 'resumed'
+                continue
+            if loginFailed:
+                result.status[name] = 'skipped'
+                continue
+            try:
+                if isinstance(task, str):
+                    value = getattr(user, task)()
+                else:
+                    value = task(user)
+            except Exception as ex:
+                # 任何异常都只影响这个账号，例如接口返回的字段变化导致的 KeyError
+                logger.warning('%s: %s failed: %r', user.phone, name, ex)
+                result.errors[name] = ex
+                result.status[name] = 'failed'
+                loginFailed = name == 'login'
+                continue
+            result.results[name] = value
+            result.status[name] = 'ok'
+            try:
+                self._saveProgress(user.phone, result.results)
+            except Exception as ex:
+                # 例如返回值不能 json 序列化，或者写文件失败。任务本身已经完成，
+                # 只是中断后会重新执行
+                logger.warning('%s: saving progress failed: %r', user.phone, ex)
+                result.errors[result.PROGRESS] = ex
+        result.elapsed = time.monotonic() - start
+        return result
@@ -0,0 +1,147 @@
+'''弹幕与 b 站 XML、ASS 字幕之间的转换。
+
+Usage::
+
+    with open('271.xml', 'rb') as f:
+        batch = DanmuBatch.fromDanmus(readXml(f, aid=271, cid=3659795))
+    with open('271.ass', 'w', encoding='utf8') as f:
+        writeAss(batch, f)
+'''
+from xml.sax.saxutils import escape
+
+from .danmu import DanmuMode
+from .download import parseXml, CHUNK_SIZE
+
+
+# XML
+
+def readXml(fp, aid=0, cid=0):
+    '''增量读取 b 站格式的 XML 弹幕文件。
+
+    Args:
+        fp: 以二进制模式打开的文件。
+
+    Yields:
+        Danmu
+    '''
+    return parseXml(iter(lambda: fp.read(CHUNK_SIZE), b''), aid, cid)
+
+
+def writeXml(danmus, fp, cid=0):
+    '''写入 b 站格式的 XML 弹幕文件。
+
+    Args:
+        danmus (iterable of Danmu): 可以是 DanmuBatch。
+        fp: 以文本模式打开的文件，编码为 utf8。
+        cid (int): 写入 chatid。
+    '''
+    fp.write('<?xml version="1.0" encoding="UTF-8"?><i>'
+             '<chatserver>chat.bilibili.com</chatserver>'
+             '<chatid>%d</chatid>\n' % cid)
+    for danmu in danmus:
+        fp.write('<d p="%.5f,%d,%d,%d,0,0,0,0">%s</d>\n' % (
+            danmu.t / 1000, danmu.mode.value, danmu.fontsize, danmu.color,
+            escape(danmu.msg)))
+    fp.write('</i>\n')
+
+
+# ASS
+
+ASS_HEADER = '''[Script Info]
+ScriptType: v4.00+
+PlayResX: {width}
+PlayResY: {height}
+Collisions: Normal
+WrapStyle: 2
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Danmu,{font},{fontSize},&H{alpha:02X}FFFFFF,&H{alpha:02X}FFFFFF,&H{alpha:02X}000000,&H{alpha:02X}000000,0,0,0,0,100,100,0,0,1,1,0,7,0,0,0,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+'''
+
+
+def _assTime(ms):
+    cs = int(ms) // 10
+    return '%d:%02d:%02d.%02d' % (cs // 360000, cs // 6000 % 60, cs // 100 % 60, cs % 100)
+
+
+def _assText(msg):
+    return msg.replace('\\', '\\\\').replace('{', '\\{').replace('}', '\\}') \
+        .replace('\n', '\\N')
+
+
+class _Lanes:
+    '''为弹幕分配行，避免重叠。每行记录可以再放入弹幕的时间，都不空闲时选最早空闲的'''
+
+    def __init__(self, count):
+        self.free = [0] * count
+
+    def take(self, t, until):
+        lane = next((i for i, free in enumerate(self.free) if free <= t), None)
+        if lane is None:
+            lane = min(range(len(self.free)), key=self.free.__getitem__)
+        self.free[lane] = until
+        return lane
+
+
+def writeAss(danmus, fp, width=1920, height=1080, font='Microsoft YaHei',
+             fontSize=48, duration=8000, staticDuration=5000, opacity=0.8):
+    '''写入 ASS 字幕。
+
+    Args:
+        danmus (iterable of Danmu): 需要按时间排序，可以是 DanmuBatch.sortByTime()。
+        fp: 以文本模式打开的文件。
+        width, height (int): 画面分辨率。
+        font (str): 字体。
+        fontSize (int): 25 号弹幕对应的字号，其他字号按比例缩放。
+        duration (int): 滚动弹幕在屏幕上停留的时间，ms。
+        staticDuration (int): 顶部、底部弹幕停留的时间，ms。
+        opacity (float): 不透明度。
+
+    Note:
+        只转换平飞、顶部、底部和逆向弹幕，高级弹幕和代码弹幕会被忽略。
+    '''
+    alpha = round(255 * (1 - opacity))
+    fp.write(ASS_HEADER.format(width=width, height=height, font=font,
+                               fontSize=fontSize, alpha=alpha))
+
+    lineHeight = fontSize + 4
+    scrolling = _Lanes(max(1, height // lineHeight))
+    top = _Lanes(max(1, height // lineHeight))
+    bottom = _Lanes(max(1, height // lineHeight))
+
+    for danmu in danmus:
+        size = round(fontSize * danmu.fontsize / 25)
+        textWidth = len(danmu.msg) * size
+        start, end = danmu.t, danmu.t + duration
+        tags = []
+        if size != fontSize:
+            tags.append('\\fs%d' % size)
+        if danmu.color != 0xFFFFFF:
+            r, g, b = danmu.color >> 16 & 0xFF, danmu.color >> 8 & 0xFF, danmu.color & 0xFF
+            tags.append('\\c&H%02X%02X%02X&' % (b, g, r))
+
+        if danmu.mode in (DanmuMode.FLY, DanmuMode.REVERSE):
+            # 弹幕的尾部进入屏幕后，这一行就可以放下一条
+            speed = (width + textWidth) / duration
+            y = scrolling.take(start, start + textWidth / speed) * lineHeight
+            x1, x2 = width, -textWidth
+            if danmu.mode == DanmuMode.REVERSE:
+                x1, x2 = x2, x1
+            tags.insert(0, '\\move(%d,%d,%d,%d)' % (x1, y, x2, y))
+        elif danmu.mode in (DanmuMode.TOP, DanmuMode.DOWN):
+            end = start + staticDuration
+            if danmu.mode == DanmuMode.TOP:
+                y = top.take(start, end) * lineHeight
+                tags.insert(0, '\\an8\\pos(%d,%d)' % (width // 2, y))
+            else:
+                y = height - bottom.take(start, end) * lineHeight
+                tags.insert(0, '\\an2\\pos(%d,%d)' % (width // 2, y))
+        else:
+            continue
+
+        fp.write('Dialogue: 2,%s,%s,Danmu,,0,0,0,,{%s}%s\n' % (
+            _assTime(start), _assTime(end), ''.join(tags), _assText(danmu.msg)))
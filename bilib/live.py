@@ -0,0 +1,304 @@
+'''接收直播间的弹幕和其他消息。
+
+基于 asyncio 和 aiohttp 的 WebSocket 客户端，一个进程可以同时监听上百个直播间。
+收到的消息放入有界的 asyncio.Queue，消费者跟不上时停止读取 WebSocket，
+由 TCP 向服务器施加背压。
+
+依赖 aiohttp；安装了 brotli 时使用 brotli 压缩的协议，否则使用 zlib。
+
+Usage::
+
+    async def main():
+        async with LiveMonitor([roomid1, roomid2]) as monitor:
+            async for roomid, message in monitor:
+                if message['cmd'] == 'DANMU_MSG':
+                    print(roomid, message['info'][1])
+'''
+import asyncio
+import json
+import logging
+import random
+import struct
+import time
+import zlib
+
+import aiohttp
+
+try:
+    import brotli
+except ImportError:     # 没有 brotli 时使用 zlib 压缩的协议
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# 包头：包长度, 包头长度, 协议版本, 操作码, 序号
+HEADER = struct.Struct('>IHHII')
+
+# 协议版本
+PROTO_JSON = 0
+PROTO_INT = 1
+PROTO_ZLIB = 2
+PROTO_BROTLI = 3
+
+# 操作码
+OP_HEARTBEAT = 2
+OP_HEARTBEAT_REPLY = 3
+OP_MESSAGE = 5
+OP_AUTH = 7
+OP_AUTH_REPLY = 8
+
+HEARTBEAT_INTERVAL = 30
+# 重连后放入队列的消息的 cmd，表示这段时间内的消息缺失了
+CMD_GAP = 'GAP'
+DEFAULT_HOST = 'broadcastlv.chat.bilibili.com'
+
+
+def makePacket(operation, body=b'', sequence=1):
+    if isinstance(body, dict):
+        body = json.dumps(body).encode('utf8')
+    return HEADER.pack(HEADER.size + len(body), HEADER.size, PROTO_INT,
+                       operation, sequence) + body
+
+
+def parsePackets(data):
+    '''解析一个 WebSocket 消息中的所有包，压缩的包会被解压并递归解析。
+
+    Args:
+        data (bytes): WebSocket 二进制消息。
+
+    Yields:
+        (operation, body)，body 是 data 或解压结果的 memoryview 切片，不复制。
+    '''
+    view = memoryview(data)
+    offset, end = 0, len(view)
+    while offset + HEADER.size <= end:
+        packetLen, headerLen, proto, operation, _ = HEADER.unpack_from(view, offset)
+        if packetLen < headerLen or offset + packetLen > end:
+            raise ValueError('Broken packet at offset %d' % offset)
+        body = view[offset + headerLen:offset + packetLen]
+        offset += packetLen
+
+        if operation == OP_MESSAGE and proto == PROTO_ZLIB:
+            yield from parsePackets(zlib.decompress(body))
+        elif operation == OP_MESSAGE and proto == PROTO_BROTLI:
+            if brotli is None:
+                raise RuntimeError('brotli is required to decode this packet')
+            yield from parsePackets(brotli.decompress(body))
+        else:
+            yield operation, body
+
+
+def decodeBody(operation, body):
+    '''把包体转换成 Python 对象。
+
+    Returns:
+        OP_MESSAGE, OP_AUTH_REPLY 返回 dict；OP_HEARTBEAT_REPLY 返回人气值 int；
+        其他返回 bytes。
+    '''
+    if operation in (OP_MESSAGE, OP_AUTH_REPLY):
+        return json.loads(str(body, 'utf8'))
+    if operation == OP_HEARTBEAT_REPLY:
+        return struct.unpack_from('>I', body)[0]
+    return bytes(body)
+
+
+class LiveClient:
+    '''一个直播间的消息接收器。
+
+    Args:
+        roomid (int): 房间号，可以是短号。
+        queue (asyncio.Queue): 消息输出的队列，元素为 (roomid, message)。
+            roomid 为给定的房间号，message 为 dict，人气值为
+            {'cmd': 'HEARTBEAT_REPLY', 'popularity': int}。断线重连之后放入
+            {'cmd': CMD_GAP, 'since': float, 'until': float}，两个时间戳之间的消息丢失。
+        session (aiohttp.ClientSession): 共享的 session。
+        uid (int): 登陆用户的 mid，匿名时为 0。
+        maxBackoff (float): 断线重连的最大等待时间，秒。
+
+    '''
+
+    def __init__(self, roomid, queue, session, uid=0, maxBackoff=60):
+        self.roomid = roomid
+        self.queue = queue
+        self.session = session
+        self.uid = uid
+        self.maxBackoff = maxBackoff
+
+        self.realRoomID = None
+        self.connected = False
+        self.reconnects = 0
+        # 最后一次收到消息的 time.time()，从未连接时为 None
+        self.lastSeen = None
+
+    def __repr__(self):
+        return '<%s %s%s>' % (type(self).__name__, self.roomid,
+                              '' if self.connected else ' [disconnected]')
+
+    async def _getJson(self, url, params):
+        async with self.session.get(url, params=params,
+                                    headers={'Host': 'api.live.bilibili.com'}) as response:
+            data = await response.json(content_type=None)
+        if data.get('code') != 0:
+            raise ValueError('%s: %s' % (url, data.get('message') or data.get('msg')))
+        return data['data']
+
+    async def _getServer(self):
+        '返回 (真实房间号, WebSocket 地址, token)'
+        if self.realRoomID is None:
+            data = await self._getJson(
+                'https://api.live.bilibili.com/room/v1/Room/room_init',
+                {'id': self.roomid})
+            self.realRoomID = data['room_id']
+        try:
+            data = await self._getJson(
+                'https://api.live.bilibili.com/xlive/web-room/v1/index/getDanmuInfo',
+                {'id': self.realRoomID})
+            host = random.choice(data['host_list'])
+            url = 'wss://%s:%d/sub' % (host['host'], host['wss_port'])
+            return url, data['token']
+        except (ValueError, KeyError, IndexError) as ex:
+            logger.warning('%r: getDanmuInfo failed (%s), using default host' % (self, ex))
+            return 'wss://%s/sub' % DEFAULT_HOST, ''
+
+    async def _heartbeat(self, ws):
+        while True:
+            await ws.send_bytes(makePacket(OP_HEARTBEAT, b'[object Object]'))
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def _session(self):
+        '连接一次直播间，直到断开'
+        url, token = await self._getServer()
+        async with self.session.ws_connect(url, heartbeat=None) as ws:
+            await ws.send_bytes(makePacket(OP_AUTH, {
+                'uid': self.uid,
+                'roomid': self.realRoomID,
+                'protover': PROTO_BROTLI if brotli is not None else PROTO_ZLIB,
+                'platform': 'web',
+                'type': 2,
+                'key': token,
+            }))
+            heartbeat = asyncio.ensure_future(self._heartbeat(ws))
+            try:
+                async for msg in ws:
+                    if msg.type != aiohttp.WSMsgType.BINARY:
+                        if msg.type in (aiohttp.WSMsgType.ERROR, aiohttp.WSMsgType.CLOSED):
+                            break
+                        continue
+                    await self._dispatch(msg.data)
+            finally:
+                self.connected = False
+                heartbeat.cancel()
+                # 不用 await heartbeat，以免吞掉本任务自己的 CancelledError
+                await asyncio.wait([heartbeat])
+                if not heartbeat.cancelled() and heartbeat.exception() is not None:
+                    ex = heartbeat.exception()
+                    logger.warning('%r: heartbeat failed: %s: %s' %
+                                   (self, type(ex).__name__, ex))
+
+    async def _dispatch(self, data):
+        for operation, body in parsePackets(data):
+            if operation == OP_AUTH_REPLY:
+                reply = decodeBody(operation, body)
+                if reply.get('code', 0) != 0:
+                    raise ConnectionError('%r: auth failed %s' % (self, reply))
+                self.connected = True
+                logger.info('%r connected' % self)
+                now = time.time()
+                if self.lastSeen is not None:
+                    await self.queue.put((self.roomid, {
+                        'cmd': CMD_GAP, 'since': self.lastSeen, 'until': now}))
+                self.lastSeen = now
+            elif operation == OP_HEARTBEAT_REPLY:
+                self.lastSeen = time.time()
+                await self.queue.put((self.roomid, {
+                    'cmd': 'HEARTBEAT_REPLY',
+                    'popularity': decodeBody(operation, body)}))
+            elif operation == OP_MESSAGE:
+                self.lastSeen = time.time()
+                # 队列满时在这里等待，不再读取 WebSocket
+                await self.queue.put((self.roomid, decodeBody(operation, body)))
+
+    async def run(self):
+        '''持续接收消息，断线后以指数退避重连，直到被取消。
+
+        Note:
+            服务器不会补发断线期间的消息，也没有可以续传的序号。重连并认证成功后先放入
+            一条 cmd 为 CMD_GAP 的消息，标出缺失的时间段，然后从当前时刻继续接收。
+        '''
+        backoff = 1
+        while True:
+            try:
+                await self._session()
+                backoff = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                logger.warning('%r: %s: %s' % (self, type(ex).__name__, ex))
+            self.reconnects += 1
+            delay = random.uniform(0, backoff)
+            backoff = min(self.maxBackoff, backoff * 2)
+            await asyncio.sleep(delay)
+
+
+class LiveMonitor:
+    '''同时监听多个直播间，所有消息汇总到一个有界队列。
+
+    Args:
+        roomids (iterable of int): 房间号。
+        maxsize (int): 队列的长度，满了之后所有连接暂停读取。
+        session (aiohttp.ClientSession): 共享的 session，不给定时自动创建。
+        uid (int): 同 LiveClient。
+
+    '''
+
+    def __init__(self, roomids=(), maxsize=10000, session=None, uid=0):
+        self.queue = asyncio.Queue(maxsize)
+        self.uid = uid
+        self._session = session
+        self._ownSession = session is None
+        self.clients = {}
+        self._tasks = {}
+        self._initial = list(roomids)
+
+    async def __aenter__(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        for roomid in self._initial:
+            self.watch(roomid)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def watch(self, roomid):
+        '开始监听一个直播间'
+        if roomid in self.clients:
+            return self.clients[roomid]
+        client = LiveClient(roomid, self.queue, self._session, self.uid)
+        self.clients[roomid] = client
+        self._tasks[roomid] = asyncio.ensure_future(client.run())
+        return client
+
+    def unwatch(self, roomid):
+        '停止监听一个直播间'
+        self.clients.pop(roomid, None)
+        task = self._tasks.pop(roomid, None)
+        if task is not None:
+            task.cancel()
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for roomid in list(self._tasks):
+            self.unwatch(roomid)
+        # 等待任务退出之后再关闭它们使用的 session
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._ownSession and self._session is not None:
+            await self._session.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
@@ -0,0 +1,255 @@
+'''请求钩子和进程内的指标统计。
+
+User.do 在每次尝试前后调用钩子，Metrics 按接口统计请求数、重试次数、流量、错误和
+延迟直方图，并可以导出为 Prometheus 的文本格式。
+
+Usage::
+
+    metrics = Metrics()
+    user = User(phone, password, hooks=[metrics])
+    ...
+    print(metrics.prometheus())
+'''
+import bisect
+import collections
+import logging
+import threading
+import time
+from urllib import parse
+
+
+logger = logging.getLogger(__name__)
+
+
+class RequestInfo:
+    '''一次请求尝试的信息，传给钩子。
+
+    Attributes:
+        user (User): 发起请求的用户。
+        method (str): HTTP 方法，如 'GET'。
+        url (str): 请求的 url。
+        endpoint (str): url 的路径部分，用于分组统计。
+        attempt (int): 第几次尝试，从 1 开始。
+        start (float): 开始的时间，time.perf_counter()。
+        elapsed (float): 收到响应或出错时经过的秒数，之前为 None。
+        status (int): HTTP 状态码，没有收到响应时为 None。
+        size (int): 响应体的字节数。
+        code (int): API 返回码，没有解析或不检查返回码时为 None。
+
+    '''
+
+    __slots__ = ('user', 'method', 'url', 'endpoint', 'attempt', 'start',
+                 'elapsed', 'status', 'size', 'code', 'hooks')
+
+    def __init__(self, hooks, user, method, url, attempt):
+        self.hooks = hooks
+        self.user = user
+        self.method = getattr(method, '__name__', str(method)).upper()
+        self.url = url
+        self.endpoint = parse.urlsplit(url).path
+        self.attempt = attempt
+        self.start = time.perf_counter()
+        self.elapsed = self.status = self.code = None
+        self.size = 0
+
+    def emit(self, name, *args):
+        '调用所有钩子的 name 方法，钩子抛出的异常只记录，不影响请求'
+        for hook in self.hooks:
+            try:
+                getattr(hook, name)(self, *args)
+            except Exception:
+                logger.exception('hook %r.%s failed', hook, name)
+
+    def responded(self, status, size):
+        self.elapsed = time.perf_counter() - self.start
+        self.status = status
+        self.size = size
+
+    def failed(self, error):
+        if self.elapsed is None:
+            self.elapsed = time.perf_counter() - self.start
+        self.code = getattr(error, 'code', None)
+        self.emit('onError', error)
+
+
+class Hooks:
+    '''请求钩子的基类，所有方法默认什么也不做，按需要覆盖。
+
+    钩子在发起请求的线程（或事件循环）中同步调用，应当尽量快，不要阻塞。
+    '''
+
+    def beforeRequest(self, info):
+        '每次尝试发送请求之前调用'
+
+    def afterResponse(self, info):
+        '''收到响应之后调用，包括会被重试的响应和返回错误码的响应。
+
+        此时 info.status、info.size、info.elapsed 已经设置，返回码检查通过时
+        info.code 为 0。
+        '''
+
+    def onError(self, info, error):
+        '''请求抛出异常时调用，包括连接错误、超时和 BiliError。
+
+        会被重试的连接错误也会调用，之后还会有下一次 beforeRequest。
+        '''
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels.items())
+
+
+class Metrics(Hooks):
+    '''进程内的指标统计，线程安全，可以在多个 User 之间共享。
+
+    Args:
+        buckets (tuple): 延迟直方图的上界，秒，需要递增。
+
+    '''
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or self.BUCKETS)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._requests = collections.Counter()     # endpoint
+            self._retries = collections.Counter()      # endpoint
+            self._bytes = collections.Counter()        # endpoint
+            self._errors = collections.Counter()       # (endpoint, error, code)
+            self._latency = {}                         # (endpoint, status, code) -> _Histogram
+
+    def beforeRequest(self, info):
+        with self._lock:
+            self._requests[info.endpoint] += 1
+            if info.attempt > 1:
+                self._retries[info.endpoint] += 1
+
+    def afterResponse(self, info):
+        key = (info.endpoint, info.status, info.code)
+        index = bisect.bisect_left(self.buckets, info.elapsed)
+        with self._lock:
+            self._bytes[info.endpoint] += info.size
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = _Histogram(len(self.buckets) + 1)
+            histogram.counts[index] += 1
+            histogram.sum += info.elapsed
+
+    def onError(self, info, error):
+        with self._lock:
+            self._errors[info.endpoint, type(error).__name__, info.code] += 1
+
+    def snapshot(self):
+        '''返回当前统计的副本。
+
+        Returns:
+            dict: 包含以下键：
+
+                - requests, retries, bytes: endpoint -> 数量
+                - errors: (endpoint, 异常类名, 返回码) -> 数量
+                - latency: (endpoint, HTTP 状态码, 返回码) -> {'count', 'sum', 'buckets'}，
+                  buckets 为每个区间的数量（不累积），最后一个为超过最大上界的数量。
+        '''
+        with self._lock:
+            return {
+                'requests': dict(self._requests),
+                'retries': dict(self._retries),
+                'bytes': dict(self._bytes),
+                'errors': dict(self._errors),
+                'latency': {key: {'count': sum(h.counts), 'sum': h.sum,
+                                  'buckets': list(h.counts)}
+                            for key, h in self._latency.items()},
+            }
+
+    def summary(self):
+        '''按接口汇总，按总耗时从大到小排序，用于找出瓶颈。
+
+        Returns:
+            list of dict: 每项包含 endpoint、count、seconds、mean、errors、retries。
+        '''
+        snapshot = self.snapshot()
+        endpoints = {}
+        for (endpoint, _, _), histogram in snapshot['latency'].items():
+            item = endpoints.setdefault(endpoint, {'count': 0, 'seconds': 0.0})
+            item['count'] += histogram['count']
+            item['seconds'] += histogram['sum']
+        errors = collections.Counter()
+        for (endpoint, _, _), count in snapshot['errors'].items():
+            errors[endpoint] += count
+        result = []
+        for endpoint in set(endpoints) | set(errors):
+            item = endpoints.get(endpoint, {'count': 0, 'seconds': 0.0})
+            result.append({
+                'endpoint': endpoint,
+                'count': item['count'],
+                'seconds': item['seconds'],
+                'mean': item['seconds'] / item['count'] if item['count'] else None,
+                'errors': errors[endpoint],
+                'retries': snapshot['retries'].get(endpoint, 0),
+            })
+        result.sort(key=lambda item: item['seconds'], reverse=True)
+        return result
+
+    def prometheus(self, prefix='bilib'):
+        '''导出为 Prometheus 的文本格式 (text/plain; version=0.0.4)。
+
+        Args:
+            prefix (str): 指标名的前缀。
+
+        Returns:
+            str
+        '''
+        snapshot = self.snapshot()
+        lines = []
+
+        def counter(name, description, values, labelNames):
+            name = '%s_%s' % (prefix, name)
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s counter' % name)
+            for key, value in sorted(values.items(), key=lambda item: str(item[0])):
+                if not isinstance(key, tuple):
+                    key = (key,)
+                labels = _labels(**{label: '' if v is None else v
+                                    for label, v in zip(labelNames, key)})
+                lines.append('%s{%s} %s' % (name, labels, value))
+
+        counter('requests_total', 'Request attempts sent.',
+                snapshot['requests'], ('endpoint',))
+        counter('request_retries_total', 'Request attempts that were retries.',
+                snapshot['retries'], ('endpoint',))
+        counter('response_bytes_total', 'Response body bytes received.',
+                snapshot['bytes'], ('endpoint',))
+        counter('request_errors_total', 'Requests that raised an exception.',
+                snapshot['errors'], ('endpoint', 'error', 'code'))
+
+        name = '%s_request_duration_seconds' % prefix
+        lines.append('# HELP %s Time until the response was received.' % name)
+        lines.append('# TYPE %s histogram' % name)
+        for (endpoint, status, code), histogram in sorted(
+                snapshot['latency'].items(), key=lambda item: str(item[0])):
+            labels = _labels(endpoint=endpoint,
+                             status='' if status is None else status,
+                             code='' if code is None else code)
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), histogram['buckets']):
+                total += count
+                lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, total))
+            lines.append('%s_sum{%s} %r' % (name, labels, histogram['sum']))
+            lines.append('%s_count{%s} %d' % (name, labels, total))
+        return '\n'.join(lines) + '\n'
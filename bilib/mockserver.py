@@ -0,0 +1,376 @@
+'''本地的 b 站 API 模拟服务器，用于离线测试和性能测试。
+
+实现了 User 和 Danmu 用到的接口，可以配置延迟、随机错误和限速。MockTransport
+把所有请求改写到模拟服务器，User 和 Danmu 不需要任何修改。
+
+Usage::
+
+    with MockServer(latency=0.01) as server:
+        user = User('12300001234', 'password', transport=server.transport())
+        user.login()
+        user.postDanmu(Danmu('test', 1000, 271))
+'''
+import collections
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+from requests.adapters import HTTPAdapter
+
+from .transport import Transport
+
+
+# 登陆时使用的 RSA 公钥，模拟服务器不校验密码，所以不需要私钥
+PUBLIC_KEY = '''-----BEGIN PUBLIC KEY-----
+MFwwDQYJKoZIhvcNAQEBBQADSwAwSAJBAMGxBG+iGqZcDC9BLi3eZ011sUa/Y4J1
+o8IaV5uPHsMe6f2fyG3l7VvaiKomNvz9xzIHgQWkSRVP9cIguq2Yf3sCAwEAAQ==
+-----END PUBLIC KEY-----
+'''
+
+
+class _Limit:
+    '简单的令牌桶，不预约，令牌不足时直接拒绝'
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def allow(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 头部和响应体分两次写入，开着 Nagle 会和 delayed ACK 叠加出 40ms 的延迟
+    disable_nagle_algorithm = True
+
+    def _handle(self, method):
+        server = self.server.mock
+        url = parse.urlsplit(self.path)
+        params = dict(parse.parse_qsl(url.query))
+        if method == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            params.update(parse.parse_qsl(self.rfile.read(length).decode('utf8')))
+        cookies = {name: morsel.value for name, morsel in
+                   SimpleCookie(self.headers.get('Cookie', '')).items()}
+
+        status, body = server.handle(method, url.path, params, cookies)
+        if status is None:
+            # 读取了请求但不响应，直接断开连接
+            self.close_connection = True
+            return
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf8')
+        etag = None
+        if method == 'GET' and status == 200:
+            # 与 CDN 一样按内容生成 ETag，内容没有变化时返回 304
+            etag = '"%s"' % hashlib.md5(body).hexdigest()[:16]
+            if self.headers.get('If-None-Match') == etag:
+                status, body = 304, b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def log_message(self, *args):
+        pass
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的 backlog 只有 5，并发建立连接时会触发 SYN 重传
+    request_queue_size = 128
+
+
+class MockServer:
+    '''模拟的 b 站 API 服务器，在后台线程中运行。
+
+    Args:
+        latency (float or tuple): 每个请求的延迟，秒。tuple 表示 (最小, 最大) 之间均匀分布。
+        errorRate (float): 随机返回 errorCode 的概率。
+        errorCode (int): 随机错误的返回码。
+        dropRate (float): 读取请求之后不响应、直接断开连接的概率。
+        rateLimits (dict): 接口路径 -> (rate, burst)，超出时返回 RATE_LIMIT_CODE。
+        host (str), port (int): 监听的地址，port 为 0 时自动选择。
+
+    Attributes:
+        counts (collections.Counter): 每个接口收到的请求数。
+        videoCounts (dict): uid -> 投稿数，没有给出的 uid 有 DEFAULT_VIDEOS 个投稿。
+        rankings (dict): (rid, day) -> 排行榜的 aid 列表，没有给出时按 rid 和 day 生成
+            100 个。
+
+    '''
+
+    RATE_LIMIT_CODE = -509
+    NOT_LOGINED_CODE = -101
+    CSRF_CODE = -111
+    DEFAULT_VIDEOS = 100
+
+    def __init__(self, latency=0, errorRate=0, errorCode=-500, rateLimits=None,
+                 host='127.0.0.1', port=0, dropRate=0):
+        self.latency = latency
+        self.errorRate = errorRate
+        self.errorCode = errorCode
+        self.dropRate = dropRate
+        self.rateLimits = {path: _Limit(*limit)
+                           for path, limit in (rateLimits or {}).items()}
+        self.counts = collections.Counter()
+        self.videoCounts = {}
+        self.rankings = {}
+
+        self._lock = threading.Lock()
+        self._sessions = {}     # SESSDATA -> bili_jct
+        self._dmid = 0
+        self._httpd = _HTTPServer((host, port), _Handler)
+        self._httpd.mock = self
+        self._thread = None
+
+        self.routes = {
+            '/api/oauth2/getKey': self.getKey,
+            '/api/v2/oauth2/login': self.login,
+            '/api/v2/oauth2/refresh_token': self.refreshToken,
+            '/home/userInfo': self.userInfo,
+            '/site/getCoin': self.getCoin,
+            '/plus/account/exp.php': self.coinExp,
+            '/x/web-interface/coin/add': self.addCoin,
+            '/x/v2/reply/add': self.addReply,
+            '/x/v2/dm/post': self.postDanmu,
+            '/msg/send': self.sendLiveDanmu,
+            '/sign/GetSignInfo': self.signInfo,
+            '/sign/doSign': self.doSign,
+            '/User/getUserInfo': self.liveUserInfo,
+            '/widget/getPageList': self.pageList,
+            '/ajax/member/getSubmitVideos': self.submitVideos,
+            '/index/recommend.json': self.recommend,
+            '/x/web-interface/ranking': self.ranking,
+            '/xlive/web-room/v1/index/getInfoByRoom': self.roomInfo,
+        }
+
+    @property
+    def address(self):
+        return '%s:%d' % self._httpd.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def transport(self, **kws):
+        '返回一个把所有请求发到本服务器的 Transport，参数同 Transport'
+        return MockTransport(self, **kws)
+
+    def rewrite(self, url):
+        '把 b 站的 url 改写为本服务器的 url'
+        parts = parse.urlsplit(url)
+        return parse.urlunsplit(('http', self.address, parts.path, parts.query, ''))
+
+    # 请求处理
+
+    def handle(self, method, path, params, cookies):
+        '返回 (HTTP 状态码, 响应体)，断开连接时返回 (None, None)'
+        with self._lock:
+            self.counts[path] += 1
+            limit = self.rateLimits.get(path)
+            limited = limit is not None and not limit.allow()
+
+        latency = self.latency
+        if isinstance(latency, tuple):
+            latency = random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+        route = self.routes.get(path)
+        if route is None:
+            return 404, b'Not Found'
+        if self.dropRate and random.random() < self.dropRate:
+            return None, None
+        if limited:
+            return 200, {'code': self.RATE_LIMIT_CODE, 'message': '请求过于频繁'}
+        if self.errorRate and random.random() < self.errorRate:
+            return 200, {'code': self.errorCode, 'message': 'mock error'}
+        return 200, route(params, cookies)
+
+    def _ok(self, data=None, **kws):
+        return dict(code=0, message='0', data=data, **kws)
+
+    def _requireLogin(self, cookies, params=None):
+        '未登录或 csrf 不正确时返回错误的响应体，否则返回 None'
+        with self._lock:
+            csrf = self._sessions.get(cookies.get('SESSDATA'))
+        if csrf is None:
+            return {'code': self.NOT_LOGINED_CODE, 'message': '账号未登录'}
+        if params is not None and params.get('csrf') != csrf:
+            return {'code': self.CSRF_CODE, 'message': 'csrf 校验失败'}
+        return None
+
+    def _newToken(self):
+        sess, csrf = uuid.uuid4().hex, uuid.uuid4().hex
+        with self._lock:
+            self._sessions[sess] = csrf
+        return {
+            'token_info': {
+                'mid': 1551,
+                'access_token': uuid.uuid4().hex,
+                'refresh_token': uuid.uuid4().hex,
+                'expires_in': 30 * 24 * 3600,
+            },
+            'cookie_info': {'cookies': [
+                {'name': 'SESSDATA', 'value': sess},
+                {'name': 'bili_jct', 'value': csrf},
+                {'name': 'DedeUserID', 'value': '1551'},
+            ]},
+        }
+
+    def getKey(self, params, cookies):
+        return self._ok({'hash': uuid.uuid4().hex[:16], 'key': PUBLIC_KEY})
+
+    def login(self, params, cookies):
+        if not params.get('username') or not params.get('password'):
+            return {'code': -629, 'message': '用户名或密码错误'}
+        return self._ok(self._newToken())
+
+    def refreshToken(self, params, cookies):
+        return self._ok(self._newToken())
+
+    def userInfo(self, params, cookies):
+        return self._requireLogin(cookies) or self._ok({
+            'level_info': {'current_level': 3}, 'coins': 10, 'uname': 'mock'})
+
+    def getCoin(self, params, cookies):
+        return self._requireLogin(cookies) or self._ok({'money': 10})
+
+    def coinExp(self, params, cookies):
+        return self._requireLogin(cookies) or {'code': 0, 'number': 10}
+
+    def addCoin(self, params, cookies):
+        return self._requireLogin(cookies, params) or self._ok({'like': False})
+
+    def addReply(self, params, cookies):
+        return self._requireLogin(cookies, params) or self._ok({'rpid': 1})
+
+    def postDanmu(self, params, cookies):
+        error = self._requireLogin(cookies, params)
+        if error:
+            return error
+        with self._lock:
+            self._dmid += 1
+            return self._ok({'dmid': self._dmid})
+
+    def sendLiveDanmu(self, params, cookies):
+        return self._requireLogin(cookies, params) or self._ok([])
+
+    def signInfo(self, params, cookies):
+        today = time.localtime()
+        return self._requireLogin(cookies) or self._ok({
+            'curYear': today.tm_year, 'curMonth': today.tm_mon,
+            'curDay': today.tm_mday,
+            'curDate': '%d-%d-%d' % (today.tm_year, today.tm_mon, today.tm_mday),
+            'signDaysList': []})
+
+    def doSign(self, params, cookies):
+        return self._requireLogin(cookies) or self._ok(
+            {'text': '3000 用户经验', 'specialText': ''})
+
+    def liveUserInfo(self, params, cookies):
+        return self._requireLogin(cookies) or self._ok({'user_level': 10})
+
+    def pageList(self, params, cookies):
+        aid = int(params.get('aid', 0))
+        return [{'page': 1, 'pagename': 'P1', 'cid': aid * 10, 'duration': 600}]
+
+    def ranking(self, params, cookies):
+        rid, day = int(params.get('rid', 0)), int(params.get('day', 3))
+        aids = self.rankings.get((rid, day)) or [
+            rid * 10000 + day * 1000 + i for i in range(100)]
+        return self._ok({'note': 'mock', 'list': [
+            {'aid': str(aid), 'title': 'video %d' % aid, 'author': 'mock', 'mid': 1551,
+             'play': 1000, 'pts': 10000 - i} for i, aid in enumerate(aids)]})
+
+    def roomInfo(self, params, cookies):
+        # 小于 10000 的是短号，真实房间号为短号 * 1000 + 7
+        roomID = int(params.get('room_id', 0))
+        if roomID <= 0:
+            return {'code': 19002000, 'message': '获取初始化数据失败'}
+        shortID, realID = (roomID, roomID * 1000 + 7) if roomID < 10000 else (0, roomID)
+        return self._ok({
+            'room_info': {'room_id': realID, 'short_id': shortID, 'uid': realID % 1000,
+                          'title': 'room %d' % realID, 'live_status': 1},
+            'anchor_info': {'base_info': {'uname': 'anchor %d' % realID}},
+        })
+
+    def recommend(self, params, cookies):
+        # 与 uid 1 的最新投稿重复
+        return {'list': [{'aid': 100000 + self.DEFAULT_VIDEOS - i} for i in range(10)]}
+
+    def submitVideos(self, params, cookies):
+        mid = int(params.get('mid', 0))
+        page = int(params.get('page', 1))
+        pageSize = int(params.get('pagesize', 30))
+        count = self.videoCounts.get(mid, self.DEFAULT_VIDEOS)
+        # 按发布时间从新到旧，aid 越大越新
+        indexes = range((page - 1) * pageSize, min(count, page * pageSize))
+        vlist = [{'aid': mid * 100000 + count - i, 'title': 'video %d' % (count - i),
+                  'mid': mid, 'created': 1500000000 + count - i} for i in indexes]
+        return {'status': True, 'data': {
+            'tlist': {}, 'vlist': vlist, 'count': count,
+            'pages': (count + pageSize - 1) // pageSize}}
+
+
+class _MockAdapter(HTTPAdapter):
+    def __init__(self, server, **kws):
+        self.server = server
+        super().__init__(**kws)
+
+    def send(self, request, **kws):
+        request.url = self.server.rewrite(request.url)
+        return super().send(request, **kws)
+
+
+class MockTransport(Transport):
+    '''把所有请求发到 MockServer 的 Transport。
+
+    Args:
+        server (MockServer): 模拟服务器。
+        其他参数同 Transport。
+    '''
+
+    def __init__(self, server, **kws):
+        self.server = server
+        super().__init__(**kws)
+
+    def _newAdapter(self, **kws):
+        return _MockAdapter(self.server, **kws)
@@ -0,0 +1,214 @@
+'''排行榜。
+
+User.getRankingList 返回结构化的排行榜，RankingWatcher 轮询排行榜并只报告变化。
+
+Usage::
+
+    watcher = RankingWatcher(user, rid=36, day=3)
+    while True:
+        diff = watcher.poll()
+        if diff:
+            print(diff.entered, diff.left, diff.moved)
+        time.sleep(60)
+'''
+import hashlib
+
+
+RANKING_URL = 'https://api.bilibili.com/x/web-interface/ranking'
+
+# 排行榜的分区，rid -> 名称
+CATEGORIES = {
+    0: '全站',
+    1: '动画',
+    168: '国创相关',
+    3: '音乐',
+    129: '舞蹈',
+    4: '游戏',
+    36: '科技',
+    188: '数码',
+    160: '生活',
+    211: '美食',
+    217: '动物圈',
+    119: '鬼畜',
+    155: '时尚',
+    5: '娱乐',
+    181: '影视',
+}
+
+# 统计的天数
+DAYS = (1, 3, 7, 30)
+
+
+def rankingParams(rid=0, day=3, original=False, recent=False):
+    '''排行榜接口的参数。
+
+    Raises:
+        ValueError: 不支持的分区或天数。
+    '''
+    if rid not in CATEGORIES:
+        raise ValueError('Unknown ranking category %r.' % rid)
+    if day not in DAYS:
+        raise ValueError('day should be one of %s.' % (DAYS,))
+    return {
+        'rid': rid,
+        'day': day,
+        'type': 2 if original else 1,
+        'arc_type': 1 if recent else 0,
+    }
+
+
+class RankItem:
+    '''排行榜中的一个视频。
+
+    Attributes:
+        rank (int): 名次，从 1 开始。
+        aid (int): 视频的 aid。
+        score (int): 综合得分。
+        rid (int): 所在排行榜的分区。
+        title (str): 标题。
+        author (str): up 主的名字。
+        mid (int): up 主的 uid。
+        play (int): 播放数。
+
+    '''
+
+    __slots__ = ('rank', 'aid', 'score', 'rid', 'title', 'author', 'mid', 'play')
+
+    def __init__(self, rank, aid, score=0, rid=0, title='', author='', mid=0, play=0):
+        self.rank = rank
+        self.aid = aid
+        self.score = score
+        self.rid = rid
+        self.title = title
+        self.author = author
+        self.mid = mid
+        self.play = play
+
+    def __repr__(self):
+        return '<RankItem #%d av%d %d>' % (self.rank, self.aid, self.score)
+
+    def __eq__(self, other):
+        return isinstance(other, RankItem) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __hash__(self):
+        # 同一个排行榜中 aid 不重复
+        return hash((self.rid, self.aid))
+
+
+def parseRanking(data, rid=0):
+    '''把排行榜接口的 data 转换为 RankItem 的列表。
+
+    同一个 aid 出现多次时只保留排名最高的一次，名次按去重后的顺序重新计算。
+    '''
+    items = []
+    seen = set()
+    for item in (data or {}).get('list') or ():
+        aid = int(item['aid'])
+        if aid in seen:
+            continue
+        seen.add(aid)
+        items.append(RankItem(
+            len(items) + 1, aid,
+            score=int(item.get('pts') or item.get('score') or 0),
+            rid=rid,
+            title=item.get('title', ''),
+            author=item.get('author', ''),
+            mid=int(item.get('mid') or 0),
+            play=int(item.get('play') or 0)))
+    return items
+
+
+class RankingDiff:
+    '''两次排行榜之间的变化。
+
+    Attributes:
+        entered (list of RankItem): 新上榜的视频。
+        left (list of RankItem): 落榜的视频，为上一次的数据。
+        moved (list of tuple): 名次变化的视频，(RankItem, 上一次的名次)。
+
+    '''
+
+    __slots__ = ('entered', 'left', 'moved')
+
+    def __init__(self, entered=(), left=(), moved=()):
+        self.entered = list(entered)
+        self.left = list(left)
+        self.moved = list(moved)
+
+    def __bool__(self):
+        return bool(self.entered or self.left or self.moved)
+
+    def __repr__(self):
+        return '<RankingDiff +%d -%d ~%d>' % (
+            len(self.entered), len(self.left), len(self.moved))
+
+
+def diffRankings(old, new):
+    '''比较两次排行榜。
+
+    Args:
+        old, new (list of RankItem)
+
+    Returns:
+        RankingDiff
+    '''
+    oldRanks = {item.aid: item for item in old}
+    newAids = set()
+    entered, moved = [], []
+    for item in new:
+        newAids.add(item.aid)
+        previous = oldRanks.get(item.aid)
+        if previous is None:
+            entered.append(item)
+        elif previous.rank != item.rank:
+            moved.append((item, previous.rank))
+    left = [item for item in old if item.aid not in newAids]
+    return RankingDiff(entered, left, moved)
+
+
+class RankingWatcher:
+    '''轮询一个排行榜，只报告名次的变化。
+
+    使用 ETag 发送条件请求，服务器返回 304 或内容与上一次完全相同时不解析。
+
+    Args:
+        user (User): 用来请求的用户。
+        rid, day, original, recent: 同 User.getRankingList。
+
+    Attributes:
+        items (list of RankItem): 最近一次的排行榜，第一次 poll 之前为空。
+
+    '''
+
+    def __init__(self, user, rid=0, day=3, original=False, recent=False):
+        self.user = user
+        self.params = rankingParams(rid, day, original, recent)
+        self.rid = rid
+        self.items = []
+        self._etag = None
+        self._digest = None
+
+    def poll(self):
+        '''获取排行榜并与上一次比较。
+
+        Returns:
+            RankingDiff: 第一次调用时所有视频都在 entered 中。
+        '''
+        headers = {'If-None-Match': self._etag} if self._etag else {}
+        response = self.user.get(RANKING_URL, params=self.params,
+                                 headers=headers, raw=True)
+        if response.status_code == 304:
+            return RankingDiff()
+
+        content = response.content
+        digest = hashlib.md5(content).digest()
+        if digest != self._digest:
+            items = parseRanking(self.user._parseResponse(content), self.rid)
+            diff = diffRankings(self.items, items)
+            self.items = items
+            self._digest = digest
+        else:
+            diff = RankingDiff()
+        self._etag = response.headers.get('ETag')
+        return diff
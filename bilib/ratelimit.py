@@ -0,0 +1,152 @@
+'''客户端限速。
+
+b 站对发送弹幕、评论、投币等接口有频率限制，超出后返回 -403 之类的错误码，这时
+请求已经浪费掉了。RateLimiter 按照 接口 × 账号 维护令牌桶，在 User.do 发送请求
+之前排队等待，而不是失败。
+
+Usage::
+
+    limiter = RateLimiter({'/x/v2/dm/post': (1 / 5, 1)})
+    user = User(phone, password, limiter=limiter)
+    limiter.stats()     # 每个接口的排队情况
+'''
+import asyncio
+import threading
+import time
+from urllib import parse
+
+
+class TokenBucket:
+    '''令牌桶，每秒补充 rate 个令牌，最多存 burst 个。
+
+    采用预约的方式：reserve() 立即扣除一个令牌（可以扣成负数）并返回需要等待的时间，
+    调用方按返回值等待即可。这样同步和异步的调用方可以共用，并且按调用顺序排队。
+    '''
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        '预约一个令牌，返回需要等待的秒数'
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+
+class _EndpointStats:
+    __slots__ = ('waiting', 'acquired', 'delayed', 'waited')
+
+    def __init__(self):
+        self.waiting = 0
+        self.acquired = 0
+        self.delayed = 0
+        self.waited = 0.0
+
+
+class RateLimiter:
+    '''按接口和账号限速的调度器，可以在多个 User 之间共享。
+
+    Args:
+        limits (dict): 接口路径到 (rate, burst) 的映射，rate 为每秒请求数。不给定时
+            使用 DEFAULT_LIMITS。
+        default (tuple): 没有在 limits 中的接口使用的 (rate, burst)，None 表示不限速。
+
+    '''
+
+    # 经验值，b 站没有公开具体的限制
+    DEFAULT_LIMITS = {
+        '/x/v2/dm/post': (1 / 5, 1),            # 视频弹幕
+        '/msg/send': (1, 1),                    # 直播弹幕
+        '/x/v2/reply/add': (1 / 10, 1),         # 评论
+        '/x/web-interface/coin/add': (1, 2),    # 投币
+    }
+
+    def __init__(self, limits=None, default=None):
+        self.limits = dict(self.DEFAULT_LIMITS if limits is None else limits)
+        self.default = default
+        self._buckets = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _reserve(self, url, account):
+        '返回 (endpoint, 需要等待的秒数)，不限速的接口 endpoint 为 None'
+        endpoint = parse.urlsplit(url).path
+        limit = self.limits.get(endpoint, self.default)
+        if limit is None:
+            return None, 0
+
+        with self._lock:
+            bucket = self._buckets.get((endpoint, account))
+            if bucket is None:
+                bucket = self._buckets[endpoint, account] = TokenBucket(*limit)
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                stats = self._stats[endpoint] = _EndpointStats()
+            delay = bucket.reserve()
+            stats.acquired += 1
+            if delay > 0:
+                stats.waiting += 1
+                stats.delayed += 1
+                stats.waited += delay
+        return endpoint, delay
+
+    def _done(self, endpoint):
+        with self._lock:
+            self._stats[endpoint].waiting -= 1
+
+    def acquire(self, url, account=None):
+        '''阻塞直到可以向 url 发送请求。
+
+        Returns:
+            float: 等待的秒数。
+        '''
+        endpoint, delay = self._reserve(url, account)
+        if delay > 0:
+            try:
+                time.sleep(delay)
+            finally:
+                self._done(endpoint)
+        return delay
+
+    async def acquireAsync(self, url, account=None):
+        '同 acquire，在事件循环中等待'
+        endpoint, delay = self._reserve(url, account)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._done(endpoint)
+        return delay
+
+    def queueDepth(self, endpoint=None):
+        '''正在排队的请求数。
+
+        Args:
+            endpoint (str): 接口路径，None 表示所有接口之和。
+        '''
+        with self._lock:
+            if endpoint is not None:
+                stats = self._stats.get(endpoint)
+                return stats.waiting if stats else 0
+            return sum(stats.waiting for stats in self._stats.values())
+
+    def stats(self):
+        '''每个接口的统计。
+
+        Returns:
+            dict: endpoint -> {'waiting', 'acquired', 'delayed', 'waited'}，
+                waited 为累计等待的秒数。
+        '''
+        with self._lock:
+            return {endpoint: {name: getattr(stats, name) for name in stats.__slots__}
+                    for endpoint, stats in self._stats.items()}
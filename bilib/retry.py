@@ -0,0 +1,169 @@
+'''请求失败时的重试策略。
+
+User.do 和 AsyncUser.do 在连接失败、读取超时或者服务器返回 429/5xx 时，按照
+RetryPolicy 决定是否重试以及等待多久。
+
+Usage::
+
+    policy = RetryPolicy(maxAttempts=3, deadline=10, budget=RetryBudget())
+    transport = Transport(retry=policy)
+'''
+import random
+import threading
+import time
+
+
+class RetryBudget:
+    '''重试预算，在多个请求之间共享，防止上游故障时所有调用一起重试。
+
+    每个成功的请求存入 ratio 个 token，每次重试消耗 1 个。另外每秒固定补充
+    minPerSecond 个，保证请求很少时也能重试。
+
+    Args:
+        ratio (float): 重试请求数与正常请求数之比的上限。
+        minPerSecond (float): 每秒保底补充的 token 数。
+        maxTokens (float): token 数的上限。
+
+    '''
+
+    def __init__(self, ratio=0.2, minPerSecond=1, maxTokens=20):
+        self.ratio = ratio
+        self.minPerSecond = minPerSecond
+        self.maxTokens = maxTokens
+        self._tokens = maxTokens
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.maxTokens,
+                           self._tokens + (now - self._last) * self.minPerSecond)
+        self._last = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.maxTokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        '消耗一个 token，预算不足时返回 False'
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    '''重试策略。
+
+    第 n 次重试前等待 min(maxBackoff, backoff * 2 ** (n - 1)) 秒，开启 jitter 时在
+    [0, 该值] 中均匀随机（full jitter）。服务器给出 Retry-After 时至少等待那么久。
+
+    建立连接失败总会重试；连接建立之后的断开、读取超时和 5xx 只有在请求幂等（GET）时
+    才重试，避免重复投币、重复发送弹幕。429 和 503 说明服务器没有处理请求，总会重试。
+
+    Args:
+        maxAttempts (int): 包括第一次在内的最大请求次数。
+        backoff (float): 退避的基数，秒。
+        maxBackoff (float): 单次等待的上限，秒。
+        jitter (bool): 是否随机化等待时间。
+        deadline (float): 一次调用（包括所有重试）的总时间上限，秒，None 表示不限。
+        timeout (float): 每次请求的超时，秒，不会超过 deadline 剩余的时间。
+            None 表示不限，服务器没有响应时会一直等待。
+        budget (RetryBudget): 共享的重试预算，None 表示不限。
+        statuses (tuple): 需要重试的 HTTP 状态码。
+
+    '''
+
+    # 这些状态码表示请求没有被处理，非幂等的请求也可以重试
+    UNPROCESSED_STATUSES = (429, 503)
+    IDEMPOTENT_METHODS = ('get', 'head', 'options')
+
+    # deadline 剩余的时间不足时，请求至少有这么长的超时（秒）
+    MIN_TIMEOUT = 0.01
+
+    def __init__(self, maxAttempts=5, backoff=0.2, maxBackoff=5, jitter=True,
+                 deadline=None, budget=None, statuses=(429, 500, 502, 503, 504),
+                 timeout=10):
+        self.maxAttempts = maxAttempts
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.timeout = timeout
+        self.budget = budget
+        self.statuses = statuses
+
+    def isIdempotent(self, method):
+        '根据 session.get / session.post 这样的方法名判断请求是否幂等'
+        return getattr(method, '__name__', '').lower() in self.IDEMPOTENT_METHODS
+
+    def shouldRetryStatus(self, status, idempotent):
+        return status in self.statuses and (
+            idempotent or status in self.UNPROCESSED_STATUSES)
+
+    @staticmethod
+    def parseRetryAfter(value):
+        '解析 Retry-After 头，支持秒数和 HTTP 日期，无法解析时返回 None'
+        if not value:
+            return None
+        try:
+            return max(0, float(value))
+        except ValueError:
+            pass
+        import email.utils
+        try:
+            return max(0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def attemptTimeout(self, start, timeout=None):
+        '''计算这一次请求的超时。
+
+        Args:
+            start (float): 第一次请求时的 time.monotonic()。
+            timeout (float): 调用方指定的超时，None 时使用 self.timeout。
+
+        Returns:
+            float: 超时的秒数，不限时返回 None。
+        '''
+        if timeout is None:
+            timeout = self.timeout
+        if self.deadline is not None:
+            remaining = max(self.MIN_TIMEOUT, self.deadline - (time.monotonic() - start))
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+    def nextDelay(self, attempt, start, retryAfter=None):
+        '''计算第 attempt 次请求失败后需要等待的时间。
+
+        Args:
+            attempt (int): 已经进行的请求次数。
+            start (float): 第一次请求时的 time.monotonic()。
+            retryAfter (str): 响应的 Retry-After 头。
+
+        Returns:
+            float: 等待的秒数，不应该再重试时返回 None。
+        '''
+        if attempt >= self.maxAttempts:
+            return None
+
+        delay = min(self.maxBackoff, self.backoff * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        retryAfter = self.parseRetryAfter(retryAfter)
+        if retryAfter is not None:
+            delay = max(delay, retryAfter)
+
+        if self.deadline is not None and \
+                time.monotonic() - start + delay > self.deadline:
+            return None
+        if self.budget is not None and not self.budget.withdraw():
+            return None
+        return delay
+
+    def succeeded(self):
+        if self.budget is not None:
+            self.budget.deposit()
@@ -0,0 +1,151 @@
+'''登陆凭据的持久化存储。
+
+User.login() 成功后把 token 和 cookies 按 phone 存下来，下次启动时直接恢复，
+只有在 token 过期时才走完整的 RSA 登陆流程。
+
+Usage::
+
+    store = SQLiteStore('credentials.db')
+    user = User(phone, password, store=store)
+    user.login()    # 有未过期的凭据时不发请求
+'''
+import json
+import os
+import sqlite3
+import threading
+
+
+class CredentialStore:
+    '''凭据存储的基类。
+
+    state 是一个可以 json 序列化的 dict，由 User 生成，至少包含 expiresTime。
+    子类需要实现 load, save, delete 并保证线程安全。
+    '''
+
+    def load(self, phone):
+        '返回 phone 对应的 state，不存在时返回 None'
+        raise NotImplementedError
+
+    def save(self, phone, state):
+        raise NotImplementedError
+
+    def delete(self, phone):
+        raise NotImplementedError
+
+
+class MemoryStore(CredentialStore):
+    '只保存在内存中，进程退出即丢失，主要用于测试'
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def load(self, phone):
+        with self._lock:
+            return self._data.get(phone)
+
+    def save(self, phone, state):
+        with self._lock:
+            self._data[phone] = state
+
+    def delete(self, phone):
+        with self._lock:
+            self._data.pop(phone, None)
+
+
+class FileStore(CredentialStore):
+    '''保存在一个 json 文件中。
+
+    Args:
+        path (str): 文件路径，不存在时自动创建。
+
+    Note:
+        每次 save 都会重写整个文件，账号很多时建议使用 SQLiteStore。
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = None
+
+    def _read(self):
+        if self._data is None:
+            if os.path.exists(self.path):
+                with open(self.path, encoding='utf8') as f:
+                    self._data = json.load(f)
+            else:
+                self._data = {}
+        return self._data
+
+    def _write(self, data):
+        '''写入 data，成功后才替换内存中的数据，不能序列化的 state 不会影响之后的写入'''
+        text = json.dumps(data)
+        # 先写临时文件再替换，避免进程中断时留下损坏的文件。
+        # 文件中有 token 和 cookies，只允许所有者读写
+        tmp = self.path + '.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf8') as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+        self._data = data
+
+    def load(self, phone):
+        with self._lock:
+            return self._read().get(phone)
+
+    def save(self, phone, state):
+        with self._lock:
+            data = dict(self._read())
+            # 保存一份副本，调用方之后修改 state 不影响这里
+            data[phone] = json.loads(json.dumps(state))
+            self._write(data)
+
+    def delete(self, phone):
+        with self._lock:
+            data = dict(self._read())
+            if data.pop(phone, None) is not None:
+                self._write(data)
+
+
+class SQLiteStore(CredentialStore):
+    '''保存在 SQLite 数据库中。
+
+    Args:
+        path (str): 数据库路径，':memory:' 表示内存数据库。
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        created = path != ':memory:' and not os.path.exists(path)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if created:
+            # 和 FileStore 一样只允许所有者读写
+            os.chmod(path, 0o600)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS credentials ('
+                'phone TEXT PRIMARY KEY, state TEXT NOT NULL, '
+                'expiresTime REAL NOT NULL)')
+
+    def load(self, phone):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT state FROM credentials WHERE phone = ?',
+                (phone,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, phone, state):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO credentials VALUES (?, ?, ?)',
+                (phone, json.dumps(state), state['expiresTime']))
+
+    def delete(self, phone):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM credentials WHERE phone = ?', (phone,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,106 @@
+'''HTTP 传输层。
+
+所有 User 和 Danmu 的请求都经过 Transport。一个 Transport 持有一个共享的
+keep-alive 连接池，可以给任意多个 User 使用，每个 User 只保留自己的 cookies。
+
+Usage::
+
+    transport = Transport(maxConnections=32, maxPerHost=8)
+    users = [User(phone, password, transport=transport) for ...]
+'''
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .retry import RetryPolicy, RetryBudget
+
+
+class _PooledSession(requests.Session):
+    '使用 Transport 连接池的 session，cookies 独立，连接共享'
+
+    def __init__(self, transport):
+        super().__init__()
+        self._transport = transport
+        self.mount('http://', transport.adapter)
+        self.mount('https://', transport.adapter)
+
+    def request(self, *args, **kws):
+        with self._transport._slots:
+            return super().request(*args, **kws)
+
+    def close(self):
+        # 连接池属于 Transport，不能随 session 一起关闭
+        pass
+
+
+class Transport:
+    '''可以在多个 User 之间共享的连接池。
+
+    Args:
+        maxConnections (int): 同时进行的请求总数上限，超出时阻塞等待。
+        maxPerHost (int): 每个 host 保持的连接数上限，超出时阻塞等待。
+        maxHosts (int): 缓存连接池的 host 数量。
+        retry (bilib.retry.RetryPolicy): 使用本连接池的 User 默认的重试策略，
+            默认带有一个共享的 RetryBudget。
+        timeout (float): 默认重试策略中每次请求的超时，秒，给定 retry 时忽略。
+
+    '''
+
+    def __init__(self, maxConnections=64, maxPerHost=8, maxHosts=16, retry=None,
+                 timeout=10):
+        self.maxConnections = maxConnections
+        self.retry = retry if retry else RetryPolicy(budget=RetryBudget(), timeout=timeout)
+        self.maxPerHost = maxPerHost
+        self.adapter = self._newAdapter(pool_connections=maxHosts,
+                                        pool_maxsize=maxPerHost,
+                                        pool_block=True)
+        self._slots = threading.BoundedSemaphore(maxConnections)
+
+        # 不需要登陆的请求共用一个不保存 cookies 的 session
+        self._anonymous = self.newSession()
+        self._anonymous.cookies.set_policy(
+            DefaultCookiePolicy(allowed_domains=[]))
+
+    def _newAdapter(self, **kws):
+        return HTTPAdapter(**kws)
+
+    def newSession(self):
+        '新建一个使用本连接池的 requests.Session'
+        return _PooledSession(self)
+
+    def get(self, url, *args, **kws):
+        '不带 cookies 的 GET 请求'
+        return self._anonymous.get(url, *args, **kws)
+
+    def post(self, url, *args, **kws):
+        '不带 cookies 的 POST 请求'
+        return self._anonymous.post(url, *args, **kws)
+
+    def close(self):
+        self.adapter.close()
+
+    def __repr__(self):
+        return '<%s max=%d perHost=%d>' % (
+            type(self).__name__, self.maxConnections, self.maxPerHost)
+
+
+_defaultTransport = None
+_defaultLock = threading.Lock()
+
+
+def getDefaultTransport():
+    '获取默认的 Transport，没有指定 transport 的 User 和 Danmu 都使用它'
+    global _defaultTransport
+    with _defaultLock:
+        if _defaultTransport is None:
+            _defaultTransport = Transport()
+        return _defaultTransport
+
+
+def setDefaultTransport(transport):
+    '替换默认的 Transport'
+    global _defaultTransport
+    with _defaultLock:
+        _defaultTransport = transport
@@ -4,13 +4,42 @@ import base64
 import time
 from urllib import parse
 import json
-import re
 import functools
-import unittest
+import threading
+import types
 
-import requests
-from bs4 import BeautifulSoup as bs
-import rsa
+from .danmu import Danmu
+from .metrics import RequestInfo
+from .cache import TTLCache
+from .ranking import RANKING_URL, rankingParams, parseRanking
+
+
+def _loads(content):
+    '''解析 json，第一次调用时选择后端并替换自己
+
+    安装了 orjson 时使用更快的 orjson，它的 JSONDecodeError 是标准库的子类。
+    '''
+    global _loads
+    try:
+        from orjson import loads
+    except ImportError:
+        loads = json.loads
+    _loads = loads
+    return loads(content)
+
+
+# b 站按北京时间（UTC+8，没有夏令时）换日，与本机的时区无关
+_DAY_OFFSET = 8 * 60 * 60
+_DAY = 24 * 60 * 60
+
+
+def _secondsUntilTomorrow(now=None):
+    '到北京时间下一个零点的秒数'
+    now = time.time() if now is None else now
+    return _DAY - (now + _DAY_OFFSET) % _DAY
+
+
+_API_ERROR = ('Fatal: API error', b'Fatal: API error')
 
 
 class BiliError(Exception):
@@ -29,6 +58,27 @@ class BiliRequireLogin(BiliError):
     pass
 
 
+class _KeyCache:
+    'getKey 结果的缓存，lock 由调用方持有，保证同一时间只有一个请求在拉取'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._value = None
+        self._expires = 0
+
+    def get(self):
+        if self._value is not None and time.time() < self._expires:
+            return self._value
+        return None
+
+    def set(self, value, ttl):
+        self._value = value
+        self._expires = time.time() + ttl
+
+    def invalidate(self):
+        self._value = None
+
+
 def _requireLogined(func):
     '类中的装饰器，装饰一个，要求调用之前必须登陆'
     @functools.wraps(func)
@@ -41,6 +91,17 @@ def _requireLogined(func):
     return wrapped
 
 
+class _hybridmethod:
+    '类中的装饰器，在类上调用时绑定到类，在实例上调用时绑定到实例'
+
+    def __init__(self, func):
+        self.__func__ = func
+        functools.update_wrapper(self, func)
+
+    def __get__(self, instance, owner):
+        return types.MethodType(self.__func__, owner if instance is None else instance)
+
+
 class User:
     '''bilibili 用户基类
 
@@ -52,17 +113,78 @@ class User:
         username (str): 默认用户名，可以传入，但在调用 login() 方法后会自动拉取。
         level (int): 同 username。
         coins (int): 同 username。
+        transport (bilib.transport.Transport): 使用的连接池，默认为共享的
+            getDefaultTransport()。
+        retry (bilib.retry.RetryPolicy): 重试策略，默认使用 transport.retry。
+        limiter (bilib.ratelimit.RateLimiter): 限速器，可以在多个用户间共享，
+            默认不限速。
+        store (bilib.store.CredentialStore): 登陆凭据的存储，给定时 login() 会优先
+            恢复未过期的凭据。
+        hooks (list of bilib.metrics.Hooks): 请求钩子，例如 bilib.metrics.Metrics，
+            可以在多个用户间共享。
 
     Raises:
         TypeError: 参数类型不符合。
 
+    Note:
+        同一个 User 可以在多个线程中同时使用。login() 和 token 续期同一时间只有
+        一个线程在进行；登陆状态整体替换，post() 发送的 cookie 和 csrf 参数来自
+        同一份快照，不会因为其他线程重新登陆而不一致。
+
     '''
 
     APPKEY = '1d8b6e7d45233436'
     SECRET_KEY = "560c52ccd288fed045859ed18bffd973"
-
-    def __init__(self, phone, password, username=None, level=0, coins=0, **kws):
-        self.session = None
+    HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/66.0.3359.181 Safari/537.36',
+        'Host': 'api.bilibili.com',
+        'Origin': 'https://www.bilibili.com',
+        'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+    }
+    # token 剩余有效期少于这个值（秒）时视为过期
+    EXPIRE_MARGIN = 10 * 60
+    # token 剩余有效期少于这个值（秒）时，在下一次请求前自动续期
+    REFRESH_MARGIN = 24 * 60 * 60
+    # getKey 返回的盐只在短时间内有效，缓存时间（秒）不宜过长
+    KEY_TTL = 20
+    # 盐过期时登陆接口返回的错误码
+    STALE_KEY_CODE = -662
+
+    _keyCache = _KeyCache()
+
+    # 账号状态的缓存时间（秒），0 表示不缓存。修改状态的操作会使相关的字段失效
+    STATE_TTL = {
+        'userInfo': 60,         # getUserInfo
+        'coins': 60,            # updateCoins
+        'coinExp': 60,          # getTodayCoinExp
+        'liveLevel': 300,       # getUserLiveLevel
+        'signed': 600,          # todaySigned
+        'safeQuestion': 3600,   # hasSafeQuestion
+    }
+    # 投币和签到会改变的字段
+    COIN_FIELDS = ('userInfo', 'coins', 'coinExp')
+    SIGN_FIELDS = ('signed', 'liveLevel')
+    # 每天重置的字段，缓存不会保留到第二天
+    DAILY_FIELDS = ('coinExp', 'signed')
+
+    def __init__(self, phone, password, username=None, level=0, coins=0, transport=None, store=None, retry=None, limiter=None, hooks=None, **kws):
+        self._session = None
+        # transport 和 session 在第一次使用时才创建，这样 import bilib 和创建 User
+        # 时不需要导入 requests
+        self._transport = transport
+        self._retry = retry
+        self.limiter = limiter
+        self.hooks = list(hooks) if hooks else []
+        self.store = store
+        # 登陆和续期期间持有，会包含网络请求
+        self._refreshLock = threading.RLock()
+        # 修改或读取多个相关的状态时持有，不包含网络请求
+        self._stateLock = threading.RLock()
+        self._loginCount = 0
+        # 登陆得到的 cookie，整体替换而不修改
+        self._cookies = {}
+        self._state = TTLCache(maxsize=len(self.STATE_TTL))
+        self._stateGeneration = 0
 
         self.assertType(phone, 'phone', str)
         self.phone = phone
@@ -73,12 +195,6 @@ class User:
         self.assertType(level, 'level', int)
         self.assertType(coins, 'coins', int)
 
-        self.session = requests.session()
-
-        self.session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/66.0.3359.181 Safari/537.36'
-        self.session.headers['Host'] = 'api.bilibili.com'
-        self.session.headers['Origin'] = 'https://www.bilibili.com'
-        self.session.headers['Content-Type'] = 'application/x-www-form-urlencoded; charset=UTF-8'
         self.logined = False
 
         self.level = level
@@ -87,6 +203,42 @@ class User:
 
         self.logger = logging.getLogger(self.phone)
 
+    @property
+    def transport(self):
+        if self._transport is None:
+            from .transport import getDefaultTransport
+            self._transport = getDefaultTransport()
+        return self._transport
+
+    @transport.setter
+    def transport(self, transport):
+        self._transport = transport
+
+    @property
+    def retry(self):
+        return self._retry if self._retry else self.transport.retry
+
+    @retry.setter
+    def retry(self, retry):
+        self._retry = retry
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._stateLock:
+                if self._session is None:
+                    self._session = self._newSession()
+        return self._session
+
+    @session.setter
+    def session(self, session):
+        self._session = session
+
+    def _newSession(self):
+        session = self.transport.newSession()
+        session.headers.update(self.HEADERS)
+        return session
+
     def initLogger(self, debug=False):
         if not self.logger:
             self.logger = logging.getLogger(self.phone)
@@ -108,8 +260,9 @@ class User:
         self.logger.setLevel(logging.DEBUG)
 
     def __del__(self):
-        if self.session:
-            self.session.close()
+        session = getattr(self, '_session', None)
+        if session:
+            session.close()
 
     def __repr__(self):
         if not self.logined:
@@ -142,48 +295,154 @@ class User:
             (s + key).encode('utf8')).hexdigest()
         return params
 
+    def _getKey(self):
+        '获取盐和 PEM 格式的 RSA 公钥，在 KEY_TTL 秒内所有 User 共用同一份'
+        with self._keyCache.lock:
+            keyPair = self._keyCache.get()
+            if keyPair is None:
+                url = 'https://passport.bilibili.com/api/oauth2/getKey'
+                params = self._signed({'appkey': self.APPKEY})
+                data = self.do(self.transport.post, url, params)
+                keyPair = self._parseKey(data)
+                self._keyCache.set(keyPair, self.KEY_TTL)
+        return keyPair
+
+    @staticmethod
+    def _parseKey(keyData):
+        # 公钥保持 PEM 字符串，由加密后端加载并缓存，也可以直接传给子进程
+        return keyData['hash'], keyData['key']
+
     def _getPwd(self, username, password):
         '对密码进行 RSA 加密'
-        url = 'https://passport.bilibili.com/api/oauth2/getKey'
-        params = self._signed({'appkey': self.APPKEY})
+        salt, key = self._getKey()
+        return self._encryptPwd(salt, key, username, password)
 
-        data = self.do(requests.post, url, params)
+    @staticmethod
+    def _encryptPwd(salt, key, username, password):
+        '''使用 bilib.crypto 的默认后端加密密码'''
+        from .crypto import getDefaultBackend
+        encrypted = getDefaultBackend().encrypt(key, (salt + password).encode('utf8'))
+        return User._quotePwd(username, encrypted)
 
-        salt, pubKey = data['hash'], data['key']
-        key = rsa.PublicKey.load_pkcs1_openssl_pem(pubKey.encode('utf8'))
-        password = base64.b64encode(
-            rsa.encrypt((salt + password).encode('utf8'), key))
-        password = parse.quote_plus(password)
+    @staticmethod
+    def _quotePwd(username, encrypted):
+        password = parse.quote_plus(base64.b64encode(encrypted))
         username = parse.quote_plus(username)
         return username, password
 
-    def do(self, method, url, *args, times=1, key='data', checkCode=True, **kws):
-        # robust
-        if times >= 5:
-            raise BiliError('Max retry times reached.')
+    def do(self, method, url, *args, key='data', checkCode=True, raw=False, **kws):
+        import requests
+        retry = self.retry
+        idempotent = retry.isIdempotent(method)
+        hooks = self.hooks
+        info = None
+        timeout = kws.pop('timeout', None)
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            code = retryAfter = None
+
+            if self.limiter is not None:
+                self.limiter.acquire(url, self.phone)
+
+            if hooks:
+                info = RequestInfo(hooks, self, method, url, attempt)
+                info.emit('beforeRequest')
+
+            # 处理 requests 抛出的异常
+            try:
+                response = method(url, *args, timeout=retry.attemptTimeout(start, timeout),
+                                  **kws)
+            except requests.ConnectionError as ex:
+                if info:
+                    info.failed(ex)
+                # 连接建立之后出错时服务器可能已经处理了请求
+                if not idempotent and not self._connectFailed(ex):
+                    raise
+                reason = type(ex).__name__
+            except requests.Timeout as ex:
+                if info:
+                    info.failed(ex)
+                # 读取超时时服务器可能已经处理了请求
+                if not idempotent:
+                    raise
+                reason = type(ex).__name__
+            else:
+                if info:
+                    info.responded(response.status_code, len(response.content))
+                if not retry.shouldRetryStatus(response.status_code, idempotent):
+                    retry.succeeded()
+                    if raw:
+                        if info:
+                            info.emit('afterResponse')
+                        return response
+                    if info:
+                        return self._parseTraced(info, response.content, key, checkCode)
+                    # 直接解析 bytes，response.text 在没有 charset 时还会猜测编码
+                    return self._parseResponse(response.content, key, checkCode)
+                if info:
+                    info.emit('afterResponse')
+                code = response.status_code
+                reason = 'HTTP %d' % code
+                retryAfter = response.headers.get('Retry-After')
+
+            # robust
+            delay = retry.nextDelay(attempt, start, retryAfter)
+            if delay is None:
+                raise BiliError('Max retry times reached. (%s)' % reason, code=code)
+            self.logger.warning('%s.do: %s. Retrying in %.2fs...' %
+                                (type(self).__name__, reason, delay))
+            time.sleep(delay)
 
-        # 处理 requests 抛出的异常
+    @staticmethod
+    def _connectFailed(ex):
+        '''requests.ConnectionError 是否发生在建立连接时，此时请求一定没有发出'''
+        import requests
+        from urllib3.exceptions import NewConnectionError
+        if isinstance(ex, requests.ConnectTimeout):
+            return True
+        # requests 把 urllib3 的 MaxRetryError 作为第一个参数，原因在它的 reason 中
+        reason = ex.args[0] if ex.args else None
+        return isinstance(getattr(reason, 'reason', reason), NewConnectionError)
+
+    def _parseTraced(self, info, content, key, checkCode):
+        '调用钩子的 _parseResponse，同步与异步版本共用'
         try:
-            response = method(url, *args, **kws)
-        except requests.ConnectTimeout:
-            self.logger.warning('%s.do: ConnectTimeout. Retrying...' %
-                                type(self).__name__)
-            return self.do(method, url, *args, times=times+1, **kws)
-        except requests.ConnectionError:
-            self.logger.warning('%s.do: ConnectionError. Retrying...' %
-                                type(self).__name__)
-            return self.do(method, url, *args, times=times+1, **kws)
+            data = self._parseResponse(content, key, checkCode)
+        except Exception as ex:
+            info.code = getattr(ex, 'code', None)
+            info.emit('afterResponse')
+            info.failed(ex)
+            raise
+        if checkCode:
+            info.code = 0
+        info.emit('afterResponse')
+        return data
 
+    @staticmethod
+    def _parseResponse(content, key='data', checkCode=True):
+        '''解析返回的内容，检查返回码并取出 key 对应的数据，同步与异步版本共用
+
+        Args:
+            content (bytes or str): 响应体，传入 bytes 时只在 json 解析时解码一次。
+            key (str, tuple or None): 需要的数据。tuple 表示逐层取出，如 ('data', 'vlist')，
+                中途不存在时返回 None；None 表示返回整个 json。
+            checkCode (bool): 是否检查返回码。
+
+        '''
         # 处理 API error
-        if response.text == 'Fatal: API error':
-            raise BiliError(response.text)
+        if content in _API_ERROR:
+            raise BiliError(_API_ERROR[0])
 
         # 处理 json 无法解析
         try:
-            jsData = response.json()
+            jsData = _loads(content)
         except json.JSONDecodeError:
+            if isinstance(content, bytes):
+                content = content.decode('utf8', 'replace')
             raise RuntimeError(
-                'Response is not a json string. %s' % response.text)
+                'Response is not a json string. %s' % content)
 
         # 处理错误返回码
         if checkCode and jsData['code'] not in (0, 'REPONSE_OK'):
@@ -192,26 +451,109 @@ class User:
                 code=jsData['code'])
 
         # 返回正常数据
-        return jsData.get(key, None)
+        if key is None:
+            return jsData
+        if not isinstance(key, tuple):
+            return jsData.get(key, None)
+        for k in key:
+            try:
+                jsData = jsData[k]
+            except (KeyError, IndexError, TypeError):
+                return None
+        return jsData
 
     def get(self, url, *args, **kws):
+        self._checkToken()
         return self.do(self.session.get, url, *args, **kws)
 
     def post(self, url, *args, **kws):
+        self._checkToken()
+        args = self._pinCookies(args, kws)
         return self.do(self.session.post, url, *args, **kws)
 
+    def _pinCookies(self, args, kws):
+        '''使用同一份 cookie 快照发送请求，并使参数中的 csrf 与之一致
+
+        参数中的 csrf 可能是在其他线程重新登陆之前取得的。
+        '''
+        cookies = self._cookies
+        csrf = cookies.get('bili_jct')
+        if csrf is None:
+            return args
+        kws.setdefault('cookies', cookies)
+        if args:
+            args = (self._withCsrf(args[0], csrf),) + args[1:]
+        for name in ('data', 'params'):
+            if name in kws:
+                kws[name] = self._withCsrf(kws[name], csrf)
+        return args
+
+    @staticmethod
+    def _withCsrf(params, csrf):
+        # 签名过的参数不能修改
+        if not isinstance(params, dict) or 'sign' in params:
+            return params
+        stale = [name for name in ('csrf', 'csrf_token')
+                 if name in params and params[name] != csrf]
+        if not stale:
+            return params
+        return dict(params, **{name: csrf for name in stale})
+
     # 登陆部分
 
-    def login(self):
+    def login(self, force=False):
         '''登陆
 
+        Args:
+            force (bool): 忽略 store 中保存的凭据，强制重新登陆。
+
         Note:
             用户需要手动调用本方法，在登陆后，user.level, user.coins, user.name
             会刷新, user.csrf 变为可用。
 
+            如果设置了 store 且其中有未过期的凭据，直接恢复，不发送任何请求。
+
+            多个线程同时调用时只有一个线程登陆，其他线程等待并直接使用它的结果。
+
         '''
+        loginCount = self._loginCount
+        with self._refreshLock:
+            # 等锁期间可能已经被其他线程登陆了
+            if not force and self._loginCount != loginCount:
+                return
+            self._login(force)
+            self._loginCount += 1
+
+    def _login(self, force):
+        if not force and self._restore():
+            self.logger.info(f'用户 {self.phone} 从缓存恢复登陆')
+            return
+
         self.logger.debug(f'用户 {self.phone} 登陆中...')
 
+        try:
+            data = self._postLogin()
+        except BiliError as ex:
+            if ex.code != self.STALE_KEY_CODE:
+                raise
+            # 缓存的盐已经失效，重新获取后再试一次
+            self._keyCache.invalidate()
+            data = self._postLogin()
+
+        # 处理返回数据
+        with self._stateLock:
+            self._setTokenInfo(data['token_info'])
+            self._setCookies({cookie['name']: cookie['value']
+                              for cookie in data['cookie_info']['cookies']})
+            self.logined = True
+            self.invalidate()
+        self.logger.info(f'用户 {self.phone} 登陆成功')
+
+        # 可能是在 _cached 的 load() 中续期失败而重新登陆的，不能再经过 _cached
+        self._remember('userInfo', self._loadUserInfo())
+        self._save()
+
+    def _postLogin(self):
         url = 'https://passport.bilibili.com/api/v2/oauth2/login'
 
         user, pwd = self._getPwd(self.phone, self.password)
@@ -221,23 +563,149 @@ class User:
             'username': user
         })
 
-        data = self.do(requests.post, url,
+        return self.do(self.transport.post, url,
                        #    params=params,
                        data=self._flaten(params),
                        headers={"Content-type": "application/x-www-form-urlencoded"})
 
-        # 处理返回数据
-        self.mid = data['token_info']['mid']
-        self._accessToken = data['token_info']['access_token']
-        self._refreshToken = data['token_info']['refresh_token']
-        self.expiresTime = time.time() + data['token_info']['expires_in']
+    def _setTokenInfo(self, tokenInfo):
+        with self._stateLock:
+            self.mid = tokenInfo['mid']
+            self._accessToken = tokenInfo['access_token']
+            self._refreshToken = tokenInfo['refresh_token']
+            self.expiresTime = time.time() + tokenInfo['expires_in']
+
+    # _copyJar 在遍历时被打断的最大尝试次数
+    COPY_JAR_ATTEMPTS = 5
+
+    def _setCookies(self, cookies):
+        # requests 准备请求时会不加锁地遍历 session.cookies，所以不能原地修改，
+        # 而是复制一份修改后整体替换
+        session = self.session
+        with self._stateLock:
+            jar = self._copyJar(session.cookies)
+            for name, value in cookies.items():
+                jar[name] = value
+            session.cookies = jar
+            self._cookies = dict(self._cookies, **cookies)
+
+    def _getCookies(self):
+        return {cookie.name: cookie.value for cookie in self._copyJar(self.session.cookies)}
 
-        for cookie in data['cookie_info']['cookies']:
-            self.session.cookies[cookie['name']] = cookie['value']
-        self.logger.info(f'用户 {self.phone} 登陆成功')
-        self.logined = True
+    @staticmethod
+    def _copyJar(jar):
+        '''复制 session 的 cookie jar
+
+        其他线程的响应可能同时在写入 Set-Cookie，jar.copy() 遍历到一半时会因为字典被修改
+        抛出 RuntimeError。写入很快就会结束，重试几次即可。
+        '''
+        for _ in range(User.COPY_JAR_ATTEMPTS - 1):
+            try:
+                return jar.copy()
+            except RuntimeError:
+                continue
+        return jar.copy()
 
-        self.getUserInfo()
+    def dumpState(self):
+        '''导出登陆状态，用于保存到 store。
+
+        Returns:
+            dict: 可以 json 序列化的登陆状态，各项来自同一次登陆或续期。
+        '''
+        with self._stateLock:
+            return {
+                'mid': self.mid,
+                'accessToken': self._accessToken,
+                'refreshToken': self._refreshToken,
+                'expiresTime': self.expiresTime,
+                'cookies': self._getCookies(),
+                'name': self.name,
+                'level': self.level,
+                'coins': self.coins,
+            }
+
+    def loadState(self, state):
+        '''从 dumpState() 的结果恢复登陆状态，不检查是否过期。'''
+        with self._stateLock:
+            self.mid = state['mid']
+            self._accessToken = state['accessToken']
+            self._refreshToken = state['refreshToken']
+            self.expiresTime = state['expiresTime']
+            self._setCookies(state['cookies'])
+            self.name = state['name']
+            self.level = state['level']
+            self.coins = state['coins']
+            self.logined = True
+            self.invalidate()
+
+    def _restore(self):
+        '从 store 恢复未过期的登陆状态，成功时返回 True'
+        if self.store is None:
+            return False
+        state = self.store.load(self.phone)
+        if not state or state['expiresTime'] < time.time() + self.EXPIRE_MARGIN:
+            return False
+        self.loadState(state)
+        return True
+
+    def _save(self):
+        if self.store is not None:
+            self.store.save(self.phone, self.dumpState())
+
+    def _needRefresh(self):
+        return self.logined and self.expiresTime - time.time() < self.REFRESH_MARGIN
+
+    def _checkToken(self):
+        # 不加锁的快速检查，绝大多数请求到这里就返回了
+        if self._needRefresh():
+            self.refreshToken()
+
+    def _refreshParams(self):
+        with self._stateLock:
+            params = {
+                'appkey': self.APPKEY,
+                'access_token': self._accessToken,
+                'refresh_token': self._refreshToken,
+            }
+        return self._signed(params)
+
+    def _setRefreshData(self, data):
+        with self._stateLock:
+            self._setTokenInfo(data['token_info'])
+            if 'cookie_info' in data:
+                self._setCookies({cookie['name']: cookie['value']
+                                  for cookie in data['cookie_info']['cookies']})
+        self._save()
+        self.logger.info(f'用户 {self.phone} token 续期成功')
+
+    def refreshToken(self, force=False):
+        '''使用 refresh token 续期，失败时重新登陆。
+
+        一般不需要手动调用，get()/post() 会在 token 剩余有效期少于 REFRESH_MARGIN
+        时自动调用。多个线程同时发现需要续期时，只有一个线程会发送请求。
+
+        Args:
+            force (bool): 即使 token 还没有快过期也续期。
+
+        Raises:
+            BiliRequireLogin: 如果用户未调用过 login() 方法
+        '''
+        if not self.logined:
+            raise BiliRequireLogin(
+                'This api requires user logined. Call method login() first.')
+        with self._refreshLock:
+            # 等锁期间可能已经被其他线程续期了
+            if not force and not self._needRefresh():
+                return
+            url = 'https://passport.bilibili.com/api/v2/oauth2/refresh_token'
+            try:
+                data = self.do(self.transport.post, url, self._refreshParams(),
+                               headers={'Host': 'passport.bilibili.com'})
+            except BiliError as ex:
+                self.logger.warning(f'token 续期失败 {ex!r}，重新登陆')
+                self.login(force=True)
+                return
+            self._setRefreshData(data)
 
     # 视频部分
     @_requireLogined
@@ -250,44 +718,185 @@ class User:
                         key='list')
         return [item['aid'] for item in data]
 
-    def getRankingList(self):
-        url = 'https://www.bilibili.com/ranking/all/0/0/1'
-        text = self.session.get(url, headers={'Host': 'www.bilibili.com'}).text
-        aids = re.findall(r'av(\d+)', text)
-        return aids
+    def getRankingList(self, rid=0, day=3, original=False, recent=False):
+        '''获取排行榜
 
-    def getVideosOfUser(self, uid):
-        url = 'https://space.bilibili.com/ajax/member/getSubmitVideos'
-        params = {
+        Args:
+            rid (int): 分区，0 为全站，见 bilib.ranking.CATEGORIES。
+            day (int): 统计的天数，1、3、7 或 30。
+            original (bool): 只包括原创视频。
+            recent (bool): 只包括近期投稿。
+
+        Returns:
+            list of bilib.ranking.RankItem: 按名次排序，aid 不重复。
+
+        Raises:
+            ValueError: 不支持的分区或天数。
+        '''
+        data = self.get(RANKING_URL, params=rankingParams(rid, day, original, recent))
+        return parseRanking(data, rid)
+
+    def getRankingAids(self, rid=0, day=3, original=False, recent=False):
+        '''获取排行榜中视频的 aid，参数同 getRankingList
+
+        Returns:
+            list of str: 按名次排序，与旧版本的 getRankingList 相同。
+        '''
+        return [str(item.aid) for item in self.getRankingList(rid, day, original, recent)]
+
+    # 投稿列表
+
+    VIDEOS_URL = 'https://space.bilibili.com/ajax/member/getSubmitVideos'
+    # (uid, page, pageSize, order) -> (取得的时间, ETag, data)，所有用户共享
+    videoPageCache = TTLCache(maxsize=4096, ttl=24 * 60 * 60)
+    # 缓存的投稿页在这段时间（秒）内直接使用，之后带上 ETag 向服务器确认
+    VIDEO_PAGE_FRESH = 5 * 60
+
+    def getVideosOfUser(self, uid, page=1, pageSize=30, order='pubdate'):
+        '''获取用户投稿的一页视频
+
+        Args:
+            uid (int): 用户的 uid。
+            page (int): 页码，从 1 开始。
+            pageSize (int): 每页的视频数。
+            order (str): 排序方式，如 'pubdate'、'click'。
+
+        Returns:
+            list of dict: 视频的信息。
+        '''
+        return (self._getVideoPage(uid, page, pageSize, order) or {}).get('vlist')
+
+    def iterVideosOfUser(self, uid, cursor=0, pageSize=30, order='pubdate', prefetch=4):
+        '''逐条返回用户的全部投稿，在后台线程中预取后面的页
+
+        Args:
+            uid (int): 用户的 uid。
+            cursor (int): 从第几条开始，传入之前迭代器的 cursor 可以继续。
+            pageSize (int), order (str): 同 getVideosOfUser。
+            prefetch (int): 最多同时预取的页数，0 表示不预取。
+
+        Returns:
+            bilib.videos.VideoIterator: 可以随时 close()，cursor 属性为已经返回的条数。
+        '''
+        from .videos import VideoIterator
+        return VideoIterator(
+            lambda page: self._getVideoPage(uid, page, pageSize, order),
+            cursor, pageSize, prefetch)
+
+    def _getVideoPage(self, uid, page, pageSize, order):
+        key = (uid, page, pageSize, order)
+        cached = self.videoPageCache.get(key)
+        if self._isFresh(cached):
+            return cached[2]
+        response = self.get(self.VIDEOS_URL,
+                            params=self._videoPageParams(*key),
+                            headers=self._videoPageHeaders(cached),
+                            raw=True)
+        return self._storeVideoPage(key, cached, response.status_code,
+                                    response.headers.get('ETag'), response.content)
+
+    def _isFresh(self, cached):
+        return cached is not None and time.time() - cached[0] < self.VIDEO_PAGE_FRESH
+
+    @staticmethod
+    def _videoPageParams(uid, page, pageSize, order):
+        return {
             'mid': uid,
-            'pagesize': 30,
+            'pagesize': pageSize,
             'tid': 0,
-            'page': 1,
+            'page': page,
             'keyword': '',
-            'order': 'pubdate',
+            'order': order,
         }
-        data = self.get(url,
-                        params=params,
-                        headers={'Host': 'space.bilibili.com'},
-                        checkCode=False)
-        return data['vlist']
+
+    @staticmethod
+    def _videoPageHeaders(cached):
+        '缓存过期时带上 ETag，没有变化时服务器返回 304'
+        headers = {'Host': 'space.bilibili.com'}
+        if cached is not None and cached[1]:
+            headers['If-None-Match'] = cached[1]
+        return headers
+
+    def _storeVideoPage(self, key, cached, status, etag, content):
+        '解析投稿页并放入缓存，同步与异步版本共用'
+        if status == 304 and cached is not None:
+            data = cached[2]
+            etag = etag or cached[1]
+        else:
+            data = self._parseResponse(content, 'data', checkCode=False)
+        self.videoPageCache.set(key, (time.time(), etag, data))
+        return data
 
     # 接口
 
+    # 账号状态
+
+    def _cached(self, field, load):
+        '''按 STATE_TTL 缓存 load() 的结果，同时进行的相同读取只发送一次请求
+
+        getOrLoad 在 load() 期间持有这个字段的锁。续期失败时会重新登陆，所以先在锁外
+        续期；登陆本身也不经过这里（见 _login），持有 _refreshLock 时不会等待字段的锁。
+        '''
+        ttl = self._stateTTL(field)
+        if not ttl:
+            return load()
+        self._checkToken()
+        generation = self._stateGeneration
+        value = self._state.getOrLoad(field, load, ttl)
+        if self._stateGeneration != generation:
+            # 读取期间状态被修改过，结果可能是旧的，不保留
+            self._state.delete(field)
+        return value
+
+    def _stateTTL(self, field):
+        '''field 的缓存时间，DAILY_FIELDS 最多缓存到北京时间的零点'''
+        ttl = self.STATE_TTL.get(field)
+        if ttl and field in self.DAILY_FIELDS:
+            ttl = min(ttl, _secondsUntilTomorrow())
+        return ttl
+
+    def invalidate(self, *fields):
+        '''使缓存的账号状态失效
+
+        Args:
+            fields (str): STATE_TTL 中的字段名，不给出时全部失效。
+        '''
+        with self._stateLock:
+            self._stateGeneration += 1
+        if not fields:
+            self._state.clear()
+        for field in fields:
+            self._state.delete(field)
+
+    def _remember(self, field, value):
+        '''不经过 _cached 读取到的值也放入缓存'''
+        ttl = self._stateTTL(field)
+        if ttl:
+            self._state.set(field, value, ttl)
+
     @_requireLogined
     def getUserInfo(self):
         '''拉取用户的信息
 
-        用来刷新用户信息，一般来说不需要手动调用。
+        用来刷新用户信息，一般来说不需要手动调用。结果缓存 STATE_TTL['userInfo'] 秒，
+        需要立即刷新时先调用 invalidate('userInfo')。
 
         Raises:
             BiliRequireLogin: 如果用户未调用过 login() 方法
         '''
+        self._cached('userInfo', self._loadUserInfo)
+
+    def _loadUserInfo(self):
         url = 'http://account.bilibili.com/home/userInfo'
         data = self.get(url, headers={'Host': 'account.bilibili.com'})
-        self.level = data['level_info']['current_level']
-        self.coins = int(data['coins'])
-        self.name = data['uname']
+        self._setUserInfo(data)
+        return data
+
+    def _setUserInfo(self, data):
+        with self._stateLock:
+            self.level = data['level_info']['current_level']
+            self.coins = int(data['coins'])
+            self.name = data['uname']
 
     @_requireLogined
     def updateCoins(self):
@@ -297,20 +906,25 @@ class User:
             BiliRequireLogin: 如果用户未调用过 login() 方法
 
         '''
-        url = 'https://account.bilibili.com/site/getCoin'
-        data = self.get(url, headers={'Host': 'account.bilibili.com',
-                                      'Referer': 'https://account.bilibili.com/account/coin'})
-        self.coins = data['money']
+        def load():
+            url = 'https://account.bilibili.com/site/getCoin'
+            data = self.get(url, headers={'Host': 'account.bilibili.com',
+                                          'Referer': 'https://account.bilibili.com/account/coin'})
+            self.coins = data['money']
+            return self.coins
+        self._cached('coins', load)
 
     @_requireLogined
     def getTodayCoinExp(self):
         '''返回今天投币经验
         '''
-        url = 'https://www.bilibili.com/plus/account/exp.php'
-        data = self.get(url, key='number', headers={
-                        'Host': 'www.bilibili.com'})
-        self.logger.debug('今日投币经验: %s' % data)
-        return data
+        def load():
+            url = 'https://www.bilibili.com/plus/account/exp.php'
+            data = self.get(url, key='number', headers={
+                            'Host': 'www.bilibili.com'})
+            self.logger.debug('今日投币经验: %s' % data)
+            return data
+        return self._cached('coinExp', load)
 
     @_requireLogined
     def giveCoin(self, aid, num=1, like=False):
@@ -326,6 +940,13 @@ class User:
             ValueError: 如果投币数量不是 1 或 2。
             BiliError: 根据 b 站返回确定。
         '''
+        url, params, headers = self._coinRequest(aid, num, like)
+        data = self.post(url, params, headers=headers)
+        self.invalidate(*self.COIN_FIELDS)
+        return data
+
+    def _coinRequest(self, aid, num, like):
+        '检查 giveCoin 的参数并返回 (url, params, headers)，同步与异步版本共用'
         self.assertType(aid, 'aid', int)
         self.assertType(num, 'num', int)
         if not num in (1, 2):
@@ -340,11 +961,10 @@ class User:
             'csrf': self.csrf
         }
         self.logger.info('给视频 aid=%d 投币 %d 个' % (aid, num))
-        data = self.post(url, params, headers={
+        return url, params, {
             'Host': 'api.bilibili.com',
             'Origin': 'https://www.bilibili.com',
-            'Referer': 'https://www.bilibili.com/video/av%d' % aid})
-        return data
+            'Referer': 'https://www.bilibili.com/video/av%d' % aid}
 
     @_requireLogined
     def comment(self, aid, msg):
@@ -359,11 +979,17 @@ class User:
             TypeError: 如果类型不匹配。
             BiliError: 根据 b 站返回确定。
         '''
+        url, params = self._commentRequest(aid, msg)
+        data = self.post(url, params=params)
+        return data
+
+    def _commentRequest(self, aid, msg):
+        '检查 comment 的参数并返回 (url, params)，同步与异步版本共用'
         self.assertType(aid, 'aid', int)
         self.assertType(msg, 'msg', str)
 
         url = 'https://api.bilibili.com/x/v2/reply/add'
-        params = {
+        return url, {
             'oid': aid,
             'type': '1',
             'message': msg,
@@ -372,9 +998,6 @@ class User:
             'csrf': self.csrf
         }
 
-        data = self.post(url, params=params)
-        return data
-
     # 弹幕
 
     @_requireLogined
@@ -390,8 +1013,7 @@ class User:
         Raises:
             BiliError: if any error occured.
         '''
-        import bilib
-        self.assertType(danmu, 'danmu', bilib.Danmu)
+        self.assertType(danmu, 'danmu', Danmu)
 
         url = 'https://api.bilibili.com/x/v2/dm/post'
         param = {
@@ -416,37 +1038,79 @@ class User:
 
     # 直播
 
-    @staticmethod
-    def getRoomInfo(showID):
-        url = 'https://live.bilibili.com/%s' % showID
-        page = requests.get(url, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/71.0.3578.98 Safari/537.36'
-        }).content.decode('utf8')
-        soup = bs(page, 'html.parser')
-        script = soup.find('div', {'class': 'script-requirement'}).script.text
-        data = json.loads(script.replace(
-            "window.__NEPTUNE_IS_MY_WAIFU__=", ''))
-
-        cid = data['roomInitRes']['data']['room_id']
-        title = data['baseInfoRes']['data']['title']
-        return {'cid': cid, 'title': title}
+    ROOM_INFO_URL = 'https://api.live.bilibili.com/xlive/web-room/v1/index/getInfoByRoom'
+    # 房间号（短号和真实房间号都会放入） -> 房间信息，所有用户共享
+    roomCache = TTLCache(maxsize=4096, ttl=60)
+
+    @_hybridmethod
+    def getRoomInfo(self, showID):
+        '''获取直播间的信息，结果会缓存 roomCache.ttl 秒
+
+        可以在类上调用，此时使用默认连接池的匿名用户；在实例上调用时请求经过该用户的
+        do()，使用它的连接池、重试策略、限速和钩子。
+
+        Args:
+            showID (int): 房间号，可以是短号。
+
+        Returns:
+            dict: 包含 roomid（真实房间号）、shortid（短号，没有时为 0）、uid、
+                uname（主播的名字）、title、liveStatus（0 未开播，1 直播中，2 轮播），
+                cid 同 roomid。
+
+        Raises:
+            BiliError: 房间不存在。
+        '''
+        showID = int(showID)
+        user = self if isinstance(self, User) else self._anonymous()
+        return self.roomCache.getOrLoad(showID, lambda: user._loadRoomInfo(showID))
+
+    def _loadRoomInfo(self, showID):
+        data = self.get(self.ROOM_INFO_URL, params={'room_id': showID},
+                        headers={'Host': 'api.live.bilibili.com'})
+        return self._cacheRoomInfo(self._parseRoomInfo(data))
 
     @staticmethod
-    def getAncherName(roomID):
-        url = 'https://api.live.bilibili.com/live_user/v1/UserInfo/get_anchor_in_room?roomid=%s'
-        data = json.loads(
-            requests.get(url % roomID,
-                         headers={'Host': 'api.live.bilibili.com'}).content.decode('utf8'))
-        return data['data']['info']['uname']
+    def _parseRoomInfo(data):
+        '解析 getInfoByRoom 的 data，同步与异步版本共用'
+        room = data['room_info']
+        return {
+            'roomid': room['room_id'],
+            'shortid': room.get('short_id') or 0,
+            'uid': room.get('uid'),
+            'uname': data.get('anchor_info', {}).get('base_info', {}).get('uname'),
+            'title': room.get('title'),
+            'liveStatus': room.get('live_status', 0),
+            'cid': room['room_id'],
+        }
+
+    @classmethod
+    def _anonymous(cls):
+        '未登陆的用户，用于在类上调用的接口'
+        return cls('anonymous', '')
+
+    @classmethod
+    def _cacheRoomInfo(cls, info):
+        '按真实房间号和短号都放入缓存'
+        for roomID in (info['roomid'], info['shortid']):
+            if roomID:
+                cls.roomCache.set(roomID, info)
+        return info
+
+    @_hybridmethod
+    def getAncherName(self, roomID):
+        '获取主播的名字，与 getRoomInfo 共用缓存'
+        return self.getRoomInfo(roomID)['uname']
 
     @_requireLogined
     def getUserLiveLevel(self):
-        data = self.get('https://api.live.bilibili.com/User/getUserInfo?ts=%s' %
-                        int(1000 * time.time()),
-                        headers={
-                            'Host': 'api.live.bilibili.com'
-                        })
-        return data['user_level']
+        def load():
+            data = self.get('https://api.live.bilibili.com/User/getUserInfo?ts=%s' %
+                            int(1000 * time.time()),
+                            headers={
+                                'Host': 'api.live.bilibili.com'
+                            })
+            return data['user_level']
+        return self._cached('liveLevel', load)
 
     @_requireLogined
     def postLiveDanmu(self, msg, roomid, fontsize=25):
@@ -475,6 +1139,7 @@ class User:
             return
         data = self.get('https://api.live.bilibili.com/sign/doSign',
                         headers={'Host': 'api.live.bilibili.com'})
+        self.invalidate(*self.SIGN_FIELDS)
         self.logger.info('今日收获: ' + data['text'])
         if data['specialText']:
             self.logger.info(data['specialText'])
@@ -482,8 +1147,14 @@ class User:
 
     @_requireLogined
     def todaySigned(self):
-        data = self.get('https://api.live.bilibili.com/sign/GetSignInfo',
-                        headers={'Host': 'api.live.bilibili.com'})
+        def load():
+            data = self.get('https://api.live.bilibili.com/sign/GetSignInfo',
+                            headers={'Host': 'api.live.bilibili.com'})
+            return self._isSigned(data)
+        return self._cached('signed', load)
+
+    @staticmethod
+    def _isSigned(data):
         curDate = '{}-{}-{}'.format(data['curYear'],
                                     data['curMonth'], data['curDay'])
         if data['curDate'] == curDate and data['signDaysList'] and data['signDaysList'][-1] == data['curDay']:
@@ -493,6 +1164,8 @@ class User:
 
     # 密保问题
 
+    SAFE_QUESTION_URL = 'https://passport.bilibili.com/web/site/updateSafeQuestion'
+
     @_requireLogined
     def hasSafeQuestion(self):
         '''检查用户是否有安全问题
@@ -500,11 +1173,13 @@ class User:
         return:
             bool
         '''
-        url = 'https://account.bilibili.com/home/reward'
-        data = self.get(url, headers={
-            'Referer': 'https://account.bilibili.com/account/home',
-            'Host': 'account.bilibili.com'})
-        return data['safequestion']
+        def load():
+            url = 'https://account.bilibili.com/home/reward'
+            data = self.get(url, headers={
+                'Referer': 'https://account.bilibili.com/account/home',
+                'Host': 'account.bilibili.com'})
+            return data['safequestion']
+        return self._cached('safeQuestion', load)
 
     @_requireLogined
     def initSafeQuestion(self, questionID, answer):
@@ -572,8 +1247,14 @@ class User:
 
     @_requireLogined
     def _updateSafeQuestion(self, oldSQ, oldAnswer, newSQ, newAnswer, canChange):
-        url = 'https://passport.bilibili.com/web/site/updateSafeQuestion'
-        params = {
+        data = self.post(self.SAFE_QUESTION_URL,
+                         self._safeQuestionParams(oldSQ, oldAnswer, newSQ, newAnswer, canChange),
+                         headers={'Host': 'passport.bilibili.com'})
+        self.invalidate('safeQuestion')
+        return data
+
+    def _safeQuestionParams(self, oldSQ, oldAnswer, newSQ, newAnswer, canChange):
+        return {
             'old_safe_question': oldSQ,
             'old_answer': oldAnswer,
             'new_safe_question': newSQ,
@@ -581,16 +1262,13 @@ class User:
             'can_change_safe_qa': canChange,
             'csrf': self.csrf
         }
-        data = self.post(url, params, headers={
-            'Host': 'passport.bilibili.com'})
-        return data
 
     # properties
 
     @property
     @_requireLogined
     def csrf(self):
-        return self.session.cookies['bili_jct']
+        return self._cookies['bili_jct']
 
     @property
     def level(self):
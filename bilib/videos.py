@@ -0,0 +1,185 @@
+'''分页接口的迭代器。
+
+VideoIterator 逐条返回用户的全部投稿，知道总页数后在后台线程中预取后面几页；
+AsyncVideoIterator 是 asyncio 版本。两者都可以随时停止，并从 cursor 继续。
+
+Usage::
+
+    videos = user.iterVideosOfUser(uid)
+    for video in videos:
+        if video['created'] < since:
+            break
+    videos.close()
+    saved = videos.cursor      # 之后用 iterVideosOfUser(uid, cursor=saved) 继续
+'''
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _PageIterator:
+    def __init__(self, fetch, cursor=0, pageSize=30, prefetch=4):
+        self.fetch = fetch
+        self.cursor = cursor
+        self.pageSize = pageSize
+        self.prefetch = prefetch
+        self.count = None
+        self.pages = None
+
+    def _setTotal(self, data):
+        self.count = data.get('count') or 0
+        self.pages = data.get('pages') or math.ceil(self.count / self.pageSize)
+
+    def _pagesAfter(self, page):
+        '需要预取的页码'
+        return range(page + 1, min(self.pages, page + self.prefetch) + 1)
+
+
+class VideoIterator(_PageIterator):
+    '''逐条返回分页接口中的全部条目，可以从中途继续。
+
+    Args:
+        fetch (callable): fetch(page) 返回一页的 data，包含 vlist、count 和 pages，
+            page 从 1 开始。会在多个线程中同时调用。
+        cursor (int): 从第几条开始，即之前已经取得的条目数。
+        pageSize (int): 每页的条目数，需要与 fetch 一致。
+        prefetch (int): 最多预取的页数，0 表示不预取。
+
+    Attributes:
+        cursor (int): 已经返回的条目数，可以保存下来用于继续。
+        count (int): 条目总数，取得第一页之前为 None。
+        pages (int): 总页数，取得第一页之前为 None。
+
+    Note:
+        按发布时间排序时，新的投稿会使后面的条目后移，继续时可能重复返回少量条目。
+    '''
+
+    def __init__(self, fetch, cursor=0, pageSize=30, prefetch=4):
+        super().__init__(fetch, cursor, pageSize, prefetch)
+        self._executor = None
+        self._futures = {}      # page -> Future
+        self._iterator = self._iterate()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _schedule(self, page):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.prefetch)
+        for p in self._pagesAfter(page):
+            if p not in self._futures:
+                self._futures[p] = self._executor.submit(self.fetch, p)
+
+    def _get(self, page):
+        future = self._futures.pop(page, None)
+        return future.result() if future else self.fetch(page)
+
+    def _iterate(self):
+        page, skip = divmod(self.cursor, self.pageSize)
+        page += 1
+        try:
+            data = self.fetch(page)
+            self._setTotal(data)
+            while True:
+                if self.prefetch:
+                    self._schedule(page)
+                vlist = data.get('vlist') or []
+                for item in vlist[skip:]:
+                    self.cursor += 1
+                    yield item
+                skip = 0
+                if page >= self.pages or len(vlist) < self.pageSize:
+                    return
+                page += 1
+                data = self._get(page)
+        finally:
+            self._cancel()
+
+    def _cancel(self):
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def close(self):
+        '停止迭代，取消还没有开始的预取'
+        self._iterator.close()
+        self._cancel()
+
+
+class AsyncVideoIterator(_PageIterator):
+    '''VideoIterator 的 asyncio 版本，使用 async for 迭代。
+
+    Args:
+        fetch (coroutine function): await fetch(page) 返回一页的 data。
+        其他参数同 VideoIterator。
+
+    '''
+
+    def __init__(self, fetch, cursor=0, pageSize=30, prefetch=4):
+        super().__init__(fetch, cursor, pageSize, prefetch)
+        self._tasks = {}        # page -> Task
+        self._iterator = self._iterate()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._iterator.__anext__()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _schedule(self, page):
+        for p in self._pagesAfter(page):
+            if p not in self._tasks:
+                self._tasks[p] = asyncio.ensure_future(self.fetch(p))
+
+    async def _get(self, page):
+        task = self._tasks.pop(page, None)
+        return await task if task else await self.fetch(page)
+
+    async def _iterate(self):
+        page, skip = divmod(self.cursor, self.pageSize)
+        page += 1
+        try:
+            data = await self.fetch(page)
+            self._setTotal(data)
+            while True:
+                if self.prefetch:
+                    self._schedule(page)
+                vlist = data.get('vlist') or []
+                for item in vlist[skip:]:
+                    self.cursor += 1
+                    yield item
+                skip = 0
+                if page >= self.pages or len(vlist) < self.pageSize:
+                    return
+                page += 1
+                data = await self._get(page)
+        finally:
+            self._cancel()
+
+    def _cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    async def close(self):
+        '停止迭代，取消还没有完成的预取'
+        await self._iterator.aclose()
+        self._cancel()
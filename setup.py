@@ -12,6 +12,12 @@ setup(
     author_email="gwy15thu@gmail.com",
 
     packages=find_packages(),
+    python_requires=">=3.8",
+    extras_require={
+        'async': ['aiohttp'],
+        'live': ['aiohttp', 'brotli'],
+        'speedups': ['orjson', 'cryptography'],
+    },
     include_package_data=True,
     platforms="any"
 )
@@ -0,0 +1,184 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import bilib
+from bilib.cache import TTLCache
+from bilib.metrics import Metrics
+from bilib.mockserver import MockServer
+from bilib.retry import RetryPolicy
+
+try:
+    from aiohttp import web
+    from bilib.aio import AsyncUser
+except ImportError:     # aiohttp 是可选依赖
+    web = None
+
+
+async def handleOk(request):
+    return web.json_response({'code': 0, 'data': {'uname': 'test'}})
+
+
+async def handleCode(request):
+    return web.json_response({'code': -403, 'message': 'forbidden'})
+
+
+async def handleFatal(request):
+    return web.Response(text='Fatal: API error')
+
+
+async def handleStall(request):
+    await asyncio.sleep(2)
+    return await handleOk(request)
+
+
+@unittest.skipIf(web is None, 'aiohttp is not installed')
+class AsyncUserTester(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        app = web.Application()
+        app.router.add_get('/ok', handleOk)
+        app.router.add_get('/code', handleCode)
+        app.router.add_get('/fatal', handleFatal)
+        app.router.add_get('/stall', handleStall)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base = 'http://127.0.0.1:%d' % port
+
+        self.user = AsyncUser('1230001234', '123')
+
+    async def asyncTearDown(self):
+        await self.user.close()
+        await self.runner.cleanup()
+
+    async def testDo(self):
+        data = await self.user.get(self.base + '/ok', headers={'Host': 'localhost'})
+        self.assertEqual(data, {'uname': 'test'})
+
+        with self.assertRaises(bilib.user.BiliError) as cm:
+            await self.user.get(self.base + '/code', headers={'Host': 'localhost'})
+        self.assertEqual(cm.exception.code, -403)
+
+        with self.assertRaises(bilib.user.BiliError):
+            await self.user.get(self.base + '/fatal', headers={'Host': 'localhost'})
+
+    async def testStallPastDeadline(self):
+        self.user.retry = RetryPolicy(backoff=0.01, deadline=0.5)
+        start = asyncio.get_running_loop().time()
+        with self.assertRaises(bilib.user.BiliError):
+            await self.user.get(self.base + '/stall', headers={'Host': 'localhost'})
+        self.assertLess(asyncio.get_running_loop().time() - start, 1.5)
+
+    async def testMetrics(self):
+        metrics = Metrics()
+        self.user.hooks.append(metrics)
+        await self.user.get(self.base + '/ok', headers={'Host': 'localhost'})
+        with self.assertRaises(bilib.user.BiliError):
+            await self.user.get(self.base + '/code', headers={'Host': 'localhost'})
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['latency'][('/ok', 200, 0)]['count'], 1)
+        self.assertEqual(snapshot['latency'][('/code', 200, -403)]['count'], 1)
+        self.assertEqual(snapshot['errors'], {('/code', 'BiliError', -403): 1})
+        self.assertGreater(snapshot['bytes']['/ok'], 0)
+
+    async def testRequireLogin(self):
+        with self.assertRaises(bilib.user.BiliRequireLogin):
+            await self.user.getUserInfo()
+        with self.assertRaises(bilib.user.BiliRequireLogin):
+            self.user.csrf
+        # 未登陆时调用不抛出，在 await 时抛出
+        for coroutine in (self.user.giveCoin(1), self.user.comment(1, 'msg'),
+                          self.user.initSafeQuestion(1, 'answer')):
+            with self.assertRaises(bilib.user.BiliRequireLogin):
+                await coroutine
+
+    async def testWriteInvalidates(self):
+        self.user.logined = True
+
+        async def post(url, data=None, **kws):
+            # 请求完成之前读取到的仍然是旧值
+            self.user._remember('coins', 1)
+            self.user._remember('safeQuestion', True)
+            await asyncio.sleep(0)
+            return {}
+
+        with mock.patch.object(AsyncUser, 'csrf', 'token'), \
+                mock.patch.object(self.user, 'post', post):
+            self.assertEqual(await self.user.giveCoin(1, like=True), {})
+            self.assertIsNone(self.user._state.get('coins'))
+            self.assertEqual(await self.user.initSafeQuestion(1, 'answer'), {})
+            self.assertIsNone(self.user._state.get('safeQuestion'))
+            self.assertEqual(await self.user.comment(1, 'msg'), {})
+
+    async def testStateCache(self):
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        values = await asyncio.gather(*(self.user._cached('coins', load) for _ in range(8)))
+        self.assertEqual(values, [1] * 8)
+        self.assertEqual(await self.user._cached('coins', load), 1)
+
+        # 读取期间失效的结果不缓存，之后的读取不等待它
+        self.user.invalidate('coins')
+        pending = asyncio.ensure_future(self.user._cached('coins', load))
+        while len(calls) < 2:
+            await asyncio.sleep(0)
+        self.user.invalidate('coins')
+        self.assertEqual(await pending, 2)
+        self.assertEqual(await self.user._cached('coins', load), 3)
+
+    def testInit(self):
+        with self.assertRaises(TypeError):
+            AsyncUser(12300001234, '123')
+        self.assertEqual(str(self.user), '<AsyncUser 1230001234 [not logged in]>')
+
+
+@unittest.skipIf(web is None, 'aiohttp is not installed')
+class AsyncDanmuTester(unittest.IsolatedAsyncioTestCase):
+    async def testResolveCid(self):
+        bilib.User._keyCache.invalidate()
+        with MockServer() as server, \
+                mock.patch.object(bilib.Danmu, 'pageCache', TTLCache()), \
+                mock.patch.object(bilib.Danmu, '_fetchPageList',
+                                  side_effect=AssertionError('blocking fetch')):
+            class MockAsyncUser(AsyncUser):
+                async def do(self, method, url, **kws):
+                    return await super().do(method, server.rewrite(url), **kws)
+
+            async with MockAsyncUser('1230001234', '123') as user:
+                self.assertEqual(await user.getCid(5), 50)
+                self.assertEqual(bilib.Danmu.getCid(5), 50)
+
+                # 没有 cid 的弹幕在发送前通过 session 异步查找
+                await user.login()
+                danmu = bilib.Danmu('test', 1000, 7)
+                await user.postDanmu(danmu)
+                self.assertEqual(danmu.cid, 70)
+            self.assertEqual(server.counts['/widget/getPageList'], 2)
+            self.assertEqual(server.counts['/x/v2/dm/post'], 1)
+
+
+@unittest.skipIf(web is None, 'aiohttp is not installed')
+class AsyncLoginTester(unittest.IsolatedAsyncioTestCase):
+    async def testConcurrentLogin(self):
+        bilib.User._keyCache.invalidate()
+        with MockServer(latency=0.01) as server:
+            class MockAsyncUser(AsyncUser):
+                async def do(self, method, url, **kws):
+                    return await super().do(method, server.rewrite(url), **kws)
+
+            async with MockAsyncUser('1230001234', '123') as user:
+                await asyncio.gather(*(user.login() for _ in range(5)))
+                self.assertTrue(user.logined)
+                self.assertEqual(server.counts['/api/v2/oauth2/login'], 1)
+
+                # 之后的调用和 force 仍然会登陆
+                await user.login()
+                await user.login(force=True)
+            self.assertEqual(server.counts['/api/v2/oauth2/login'], 3)
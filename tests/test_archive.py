@@ -0,0 +1,84 @@
+import io
+import os
+import tempfile
+import unittest
+
+import bilib
+from bilib.archive import writeArchive, DanmuArchive
+from bilib.batch import DanmuBatch
+from bilib.formats import readXml, writeXml, writeAss
+
+
+class ArchiveTester(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'test.bdma')
+        self.batch = DanmuBatch()
+        for i in range(1000):
+            self.batch.append('弹幕 %d' % (i % 7), (i * 7919) % 100_000, 271, 1551,
+                              color=i, mode=bilib.DanmuMode.TOP if i % 3 else bilib.DanmuMode.FLY)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testRoundTrip(self):
+        writeArchive(self.batch, self.path)
+        with DanmuArchive(self.path) as archive:
+            self.assertEqual(len(archive), 1000)
+            self.assertEqual(archive.stringCount, 7)
+            self.assertIsInstance(archive.t, memoryview)
+            self.assertEqual(list(archive.t), sorted(self.batch.t))
+
+            batch = archive.read()
+        expected = self.batch.sortByTime()
+        self.assertEqual(batch.msgs(), expected.msgs())
+        for name, _ in DanmuBatch.COLUMNS[:-1]:
+            self.assertEqual(getattr(batch, name), getattr(expected, name))
+
+    def testRange(self):
+        writeArchive(self.batch, self.path)
+        with DanmuArchive(self.path) as archive:
+            batch = archive.read(start=10_000, end=20_000)
+        expected = self.batch.filter(start=10_000, end=20_000).sortByTime()
+        self.assertEqual(len(batch), len(expected))
+        self.assertEqual(batch.msgs(), expected.msgs())
+        self.assertTrue(all(10_000 <= t < 20_000 for t in batch.t))
+
+    def testEmpty(self):
+        writeArchive(DanmuBatch(), self.path)
+        with DanmuArchive(self.path) as archive:
+            self.assertEqual(len(archive.read(start=1)), 0)
+
+    def testNotArchive(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            DanmuArchive(self.path)
+
+
+class FormatTester(unittest.TestCase):
+    def setUp(self):
+        self.danmus = [
+            bilib.Danmu('<a&b>', 1234, 271, 1551),
+            bilib.Danmu('顶部', 2000, 271, 1551, color=0xFF0000, mode=bilib.DanmuMode.TOP),
+            bilib.Danmu('底部', 3000, 271, 1551, fontsize=18, mode=bilib.DanmuMode.DOWN),
+        ]
+
+    def testXml(self):
+        f = io.StringIO()
+        writeXml(self.danmus, f, cid=1551)
+        danmus = list(readXml(io.BytesIO(f.getvalue().encode('utf8')), 271, 1551))
+        self.assertEqual([repr(d) for d in danmus], [repr(d) for d in self.danmus])
+        self.assertEqual([(d.color, d.mode, d.fontsize) for d in danmus],
+                         [(d.color, d.mode, d.fontsize) for d in self.danmus])
+
+    def testAss(self):
+        f = io.StringIO()
+        writeAss(self.danmus, f)
+        lines = [line for line in f.getvalue().splitlines()
+                 if line.startswith('Dialogue')]
+        self.assertEqual(len(lines), 3)
+        self.assertIn('0:00:01.23,0:00:09.23', lines[0])
+        self.assertIn('\\move(1920,0,', lines[0])
+        self.assertIn('\\c&H0000FF&', lines[1])
+        self.assertIn('\\an2', lines[2])
@@ -0,0 +1,53 @@
+import unittest
+
+import bilib
+from bilib import batch as batchModule
+from bilib.batch import DanmuBatch
+
+
+class DanmuBatchTester(unittest.TestCase):
+    def setUp(self):
+        self.danmus = [
+            bilib.Danmu('b', 70_234, 271, 1551),
+            bilib.Danmu('a', 12, 271, 1551, mode=bilib.DanmuMode.TOP),
+            bilib.Danmu('b', 3601_234, 272, 1552, color=0xFF0000),
+            bilib.Danmu('c', 12, 271, 1551),
+        ]
+        self.batch = DanmuBatch.fromDanmus(self.danmus)
+
+    def testSlots(self):
+        with self.assertRaises(AttributeError):
+            self.danmus[0].other = 1
+
+    def testRoundTrip(self):
+        self.assertEqual(len(self.batch), 4)
+        self.assertEqual(self.batch.strings, ['b', 'a', 'c'])
+        for danmu, other in zip(self.danmus, self.batch):
+            self.assertEqual(repr(danmu), repr(other))
+            self.assertEqual((danmu.cid, danmu.color, danmu.mode),
+                             (other.cid, other.color, other.mode))
+        self.assertEqual(self.batch[-1].msg, 'c')
+        self.assertEqual(self.batch[1:3].msgs(), ['a', 'b'])
+
+    def testTimeStrs(self):
+        self.assertEqual(self.batch.timeStrs(),
+                         [danmu.getTimeStr() for danmu in self.danmus])
+
+    def checkOps(self):
+        self.assertEqual(self.batch.sortByTime().msgs(), ['a', 'c', 'b', 'b'])
+        self.assertEqual(self.batch.filter(start=12, end=100_000).msgs(),
+                         ['b', 'a', 'c'])
+        self.assertEqual(self.batch.filter(aid=271, mode=bilib.DanmuMode.FLY).msgs(),
+                         ['b', 'c'])
+        self.assertEqual(self.batch.filter(lambda d: d.color != 0xFFFFFF).msgs(),
+                         ['b'])
+
+    def testOps(self):
+        self.checkOps()
+
+    def testOpsWithoutNumpy(self):
+        np, batchModule.np = batchModule.np, None
+        try:
+            self.checkOps()
+        finally:
+            batchModule.np = np
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from bilib.cache import TTLCache, SQLiteCache
+
+
+class TTLCacheTester(unittest.TestCase):
+    def testLRU(self):
+        cache = TTLCache(maxsize=2)
+        cache.set(1, 'a')
+        cache.set(2, 'b')
+        cache.get(1)
+        cache.set(3, 'c')
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+        self.assertEqual(len(cache), 2)
+
+    def testTTL(self):
+        cache = TTLCache(ttl=0.05)
+        cache.set(1, 'a')
+        cache.set(2, 'b', ttl=10)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get(2), 'b')
+
+    def testSingleFlight(self):
+        cache = TTLCache()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(cache.getOrLoad('key', loader)))
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 8)
+
+    def testDisk(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'cache.db')
+            disk = SQLiteCache(path)
+            TTLCache(disk=disk).set(271, [{'cid': 1}])
+            disk.close()
+
+            disk = SQLiteCache(path)
+            cache = TTLCache(disk=disk)
+            self.assertEqual(cache.get(271), [{'cid': 1}])
+            cache.set(1551, 'expired', ttl=-1)
+            self.assertIsNone(TTLCache(disk=disk).get(1551))
+            disk.close()
@@ -0,0 +1,88 @@
+import unittest
+from unittest import mock
+
+import bilib
+from bilib import transport
+from bilib.cache import TTLCache
+from bilib.crawl import Crawler
+from bilib.mockserver import MockServer
+
+
+PATH = '/ajax/member/getSubmitVideos'
+
+
+class CrawlerTester(unittest.TestCase):
+    def setUp(self):
+        bilib.User._keyCache.invalidate()
+        bilib.User.videoPageCache.clear()
+        self.server = MockServer().start()
+        self.transport = self.server.transport()
+        self.user = bilib.User('1230001234', '123', transport=self.transport)
+        self.crawler = Crawler(self.user, workers=4, cache=TTLCache(maxsize=100))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testVideosOfUsers(self):
+        self.server.videoCounts.update({1: 10, 2: 45, 3: 0})
+        videos = self.crawler.videosOfUsers([1, 2, 3, 2, 1])
+        self.assertEqual({uid: len(v) for uid, v in videos.items()}, {1: 10, 2: 45, 3: 0})
+        self.assertEqual(self.server.counts[PATH], 4)
+        self.assertEqual(self.crawler.stats['full'], 3)
+
+    def testIncremental(self):
+        self.server.videoCounts[1] = 70
+        first = self.crawler.videosOfUsers([1])[1]
+
+        # 没有变化：只确认第一页
+        with mock.patch.object(bilib.User, 'VIDEO_PAGE_FRESH', 0):
+            self.assertEqual(self.crawler.videosOfUsers([1])[1], first)
+            self.assertEqual(self.crawler.stats['cached'], 1)
+            self.assertEqual(self.server.counts[PATH], 4)
+
+            # 新投稿：只读取新的部分
+            self.server.videoCounts[1] = 75
+            videos = self.crawler.videosOfUsers([1])[1]
+            self.assertEqual(self.crawler.stats['incremental'], 1)
+            self.assertEqual(self.server.counts[PATH], 5)
+            self.assertEqual(videos[5:], first)
+            self.assertEqual([v['aid'] for v in videos], list(range(100075, 100000, -1)))
+
+            # 有投稿被删除：重新读取
+            self.crawler.cache.set(('videos', 1), first[:1] + first[2:])
+            self.assertEqual(len(self.crawler.videosOfUsers([1])[1]), 75)
+            self.assertEqual(self.crawler.stats['full'], 2)
+
+    def testCollectAids(self):
+        self.server.videoCounts[2] = 5
+        self.user.login()
+        aids = self.crawler.collectAids([1, 2], recommend=True)
+        # 推荐的 10 个视频都是 uid 1 的投稿
+        self.assertEqual(len(aids), 105)
+        self.assertEqual(len(set(aids)), len(aids))
+        self.assertTrue(all(isinstance(aid, int) for aid in aids))
+
+    def testPageLists(self):
+        old = transport.getDefaultTransport()
+        transport.setDefaultTransport(self.transport)
+        try:
+            bilib.Danmu.pageCache.clear()
+            pages = self.crawler.pageLists([3, 1, 3, 2])
+        finally:
+            transport.setDefaultTransport(old)
+        self.assertEqual(list(pages), [3, 1, 2])
+        self.assertEqual(pages[3][0]['cid'], 30)
+
+        with mock.patch.object(self.user, 'iterVideosOfUser',
+                               side_effect=bilib.user.BiliError('x', code=-404)):
+            self.assertEqual(self.crawler.videosOfUsers([1, 2]), {})
+        self.assertEqual(set(self.crawler.errors), {1, 2})
+
+        # 其他异常同样只影响出错的项
+        def getPageList(aid):
+            if aid == 2:
+                raise KeyError('cid')
+            return [aid]
+        with mock.patch.object(bilib.Danmu, 'getPageList', getPageList):
+            self.assertEqual(self.crawler.pageLists([1, 2, 3]), {1: [1], 3: [3]})
+        self.assertIsInstance(self.crawler.errors[2], KeyError)
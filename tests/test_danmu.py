@@ -1,6 +1,11 @@
 import unittest
+from unittest import mock
 
 import bilib
+from bilib import transport
+from bilib.cache import TTLCache
+from bilib.mockserver import MockServer
+from bilib.retry import RetryPolicy
 
 from tests import config
 
@@ -34,3 +39,69 @@ class DanmuTester(unittest.TestCase):
                 danmu = bilib.Danmu('test', case[0], aid, cid)
                 self.assertEqual(
                     str(danmu), f'<Danmu "test" @{case[1]} #{aid}>')
+
+
+class PageCacheTester(unittest.TestCase):
+    def setUp(self):
+        self.pages = [{'page': 1, 'cid': 101}, {'page': 2, 'cid': 102}]
+        self.patches = [
+            mock.patch.object(bilib.Danmu, 'pageCache', TTLCache()),
+            mock.patch.object(bilib.Danmu, '_fetchPageList',
+                              return_value=self.pages),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def testOneFetchPerAid(self):
+        danmus = [bilib.Danmu('test', t, 271) for t in range(10)]
+        self.assertEqual([danmu.cid for danmu in danmus], [101] * 10)
+        self.assertEqual(bilib.Danmu._fetchPageList.call_count, 1)
+
+    def testPage(self):
+        self.assertEqual(bilib.Danmu.getPageList(271), self.pages)
+        self.assertEqual(bilib.Danmu.getCid(271, page=2), 102)
+        with self.assertRaises(ValueError):
+            bilib.Danmu.getCid(271, page=3)
+
+    def testLazy(self):
+        danmu = bilib.Danmu('test', 0, 271, page=2)
+        bilib.Danmu._fetchPageList.assert_not_called()
+        self.assertEqual(danmu.cid, 102)
+
+    def testResolveCids(self):
+        danmus = [bilib.Danmu('test', 0, aid) for aid in (271, 272, 271, 273)]
+        bilib.Danmu.resolveCids(danmus)
+        self.assertEqual(bilib.Danmu._fetchPageList.call_count, 3)
+        self.assertEqual([danmu._cid for danmu in danmus], [101] * 4)
+
+
+class FetchPageListTester(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer().start()
+        self.old = transport.getDefaultTransport()
+        transport.setDefaultTransport(self.server.transport(
+            retry=RetryPolicy(maxAttempts=2, backoff=0.01)))
+
+    def tearDown(self):
+        transport.setDefaultTransport(self.old)
+        self.server.stop()
+
+    def testFetch(self):
+        self.assertEqual(bilib.Danmu._fetchPageList(5)[0]['cid'], 50)
+
+        # 经过 User.do，断开的连接会重试
+        self.server.dropRate = 1
+        with self.assertRaises(bilib.user.BiliError):
+            bilib.Danmu._fetchPageList(5)
+        self.assertEqual(self.server.counts['/widget/getPageList'], 3)
+
+        # 返回的不是分 P 列表
+        self.server.dropRate = 0
+        self.server.errorRate = 1
+        with self.assertRaises(bilib.user.BiliError) as cm:
+            bilib.Danmu._fetchPageList(5)
+        self.assertEqual(cm.exception.code, -500)
@@ -0,0 +1,61 @@
+import unittest
+
+import bilib
+from bilib.download import parseXml, parseSegment
+
+
+XML = '''<?xml version="1.0" encoding="UTF-8"?><i><chatserver>chat.bilibili.com</chatserver><chatid>1551</chatid>
+<d p="1.234,1,25,16777215,1550000000,0,abcdef,1">第一条</d>
+<d p="70.5,5,25,255,1550000000,0,abcdef,2">顶部</d>
+<d p="3.0,9,25,255,1550000000,0,abcdef,3">BAS</d>
+<d p="2.0,2,18,0,1550000000,0,abcdef,4">&lt;escaped&gt;</d>
+</i>'''.encode('utf8')
+
+
+def varint(value):
+    out = bytearray()
+    while True:
+        b = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def field(number, value):
+    if isinstance(value, int):
+        return varint(number << 3) + varint(value)
+    return varint(number << 3 | 2) + varint(len(value)) + value
+
+
+def elem(progress, mode, color, content):
+    return field(1, (field(1, 12345678901) + field(2, progress) + field(3, mode) +
+                     field(4, 25) + field(5, color) + field(6, b'abcdef') +
+                     field(7, content.encode('utf8')) + field(8, 1550000000)))
+
+
+class DownloadTester(unittest.TestCase):
+    def testXml(self):
+        # 任意切分都应该得到同样的结果
+        for size in (1, 7, len(XML)):
+            with self.subTest(size=size):
+                chunks = (XML[i:i + size] for i in range(0, len(XML), size))
+                danmus = list(parseXml(chunks, 271, 1551))
+                self.assertEqual([d.msg for d in danmus], ['第一条', '顶部', '<escaped>'])
+                self.assertEqual([d.t for d in danmus], [1234, 70500, 2000])
+                self.assertEqual(danmus[1].mode, bilib.DanmuMode.TOP)
+                self.assertEqual(danmus[1].color, 255)
+                self.assertEqual(danmus[2].mode, bilib.DanmuMode.FLY)
+                self.assertEqual(danmus[0].cid, 1551)
+
+    def testSegment(self):
+        data = (elem(1234, 1, 0xFFFFFF, '第一条') + elem(300_000, 4, 255, '底部') +
+                elem(5, 9, 0, 'BAS') + field(2, 1))
+        danmus = list(parseSegment(data, 271, 1551))
+        self.assertEqual([d.msg for d in danmus], ['第一条', '底部'])
+        self.assertEqual([d.t for d in danmus], [1234, 300_000])
+        self.assertEqual(danmus[1].mode, bilib.DanmuMode.DOWN)
+        self.assertEqual(danmus[1].color, 255)
+        self.assertEqual(list(parseSegment(b'')), [])
@@ -0,0 +1,117 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import bilib
+from bilib.fleet import Fleet
+from bilib.mockserver import MockServer
+from bilib.store import FileStore
+
+
+class FleetTester(unittest.TestCase):
+    def setUp(self):
+        bilib.User._keyCache.invalidate()
+        self.server = MockServer(latency=0.01).start()
+        self.transport = self.server.transport(maxConnections=16, maxPerHost=16)
+        self.users = [bilib.User('123%08d' % i, '123', transport=self.transport)
+                      for i in range(12)]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testRun(self):
+        report = Fleet(self.users + self.users[:2], workers=6).run()
+        self.assertEqual(len(report.accounts), 12)
+        self.assertEqual(report.failed(), {})
+        self.assertEqual(report.summary()['liveSignIn'],
+                         {'ok': 12, 'failed': 0, 'skipped': 0, 'resumed': 0})
+        result = report.accounts['12300000003']
+        self.assertTrue(result.ok)
+        self.assertEqual(result.results['getTodayCoinExp'], 10)
+        self.assertEqual(self.server.counts['/api/v2/oauth2/login'], 12)
+        self.assertEqual(self.server.counts['/sign/doSign'], 12)
+        json.dumps(report.toDict())
+
+    def testIsolation(self):
+        wrong = bilib.User('12399999999', 'wrong', transport=self.transport)
+        wrong._postLogin = mock.Mock(side_effect=bilib.user.BiliError('用户名或密码错误', code=-629))
+        self.users.append(wrong)
+
+        def coinExp(user):
+            if user.phone == '12300000005':
+                raise bilib.user.BiliError('busy', code=-509)
+            return user.getTodayCoinExp()
+
+        report = Fleet(self.users, tasks=['login', coinExp, 'getUserInfo']).run()
+        self.assertEqual(set(report.failed()), {'12300000005', '12399999999'})
+        self.assertEqual(report.accounts['12300000005'].status,
+                         {'login': 'ok', 'coinExp': 'failed', 'getUserInfo': 'ok'})
+        self.assertEqual(report.accounts['12399999999'].status,
+                         {'login': 'failed', 'coinExp': 'skipped', 'getUserInfo': 'skipped'})
+        self.assertEqual(report.summary()['coinExp'],
+                         {'ok': 11, 'failed': 1, 'skipped': 1, 'resumed': 0})
+
+    def testUnexpectedError(self):
+        # 接口少了字段，liveSignIn 抛出 KeyError
+        self.server.routes['/sign/doSign'] = \
+            lambda params, cookies: self.server._ok({'specialText': ''})
+        report = Fleet(self.users, workers=4).run()
+        self.assertEqual(len(report.failed()), 12)
+        self.assertTrue(all(isinstance(error, KeyError)
+                            for error in report.failed().values()))
+        self.assertEqual(report.summary()['liveSignIn']['failed'], 12)
+        self.assertEqual(report.summary()['getUserInfo']['ok'], 12)
+        json.dumps(report.toDict())
+
+    def testResume(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'progress.json')
+            flaky = {'12300000001', '12300000002'}
+
+            def signIn(user):
+                if user.phone in flaky:
+                    raise OSError('reset')
+                return user.liveSignIn()
+
+            tasks = ['login', 'getTodayCoinExp', signIn]
+            first = Fleet(self.users, tasks, progress=FileStore(path), runId='day1').run()
+            self.assertEqual(set(first.failed()), flaky)
+            self.assertEqual(self.server.counts['/sign/doSign'], 10)
+
+            flaky.clear()
+            second = Fleet(self.users, tasks, progress=FileStore(path), runId='day1').run()
+            self.assertEqual(second.failed(), {})
+            self.assertEqual(second.summary()['signIn']['resumed'], 10)
+            self.assertEqual(second.summary()['signIn']['ok'], 2)
+            # 只有两个没有完成的账号重新登陆
+            self.assertEqual(self.server.counts['/api/v2/oauth2/login'], 14)
+            self.assertEqual(self.server.counts['/plus/account/exp.php'], 12)
+            self.assertEqual(self.server.counts['/sign/doSign'], 12)
+
+            # 新的 runId 从头开始
+            third = Fleet(self.users[:1], tasks, progress=FileStore(path), runId='day2').run()
+            self.assertEqual(third.accounts['12300000000'].status['signIn'], 'ok')
+
+    def testUnsavableResult(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'progress.json')
+
+            def ranking(user):
+                # RankItem 不能 json 序列化
+                if user.phone == '12300000004':
+                    return user.getRankingList()[:1]
+                return user.getRankingAids()[:1]
+
+            report = Fleet(self.users, ['login', ranking], progress=FileStore(path)).run()
+            result = report.accounts['12300000004']
+            self.assertEqual(result.status, {'login': 'ok', 'ranking': 'ok'})
+            self.assertIsInstance(result.errors['progress'], TypeError)
+            self.assertFalse(result.ok)
+            self.assertEqual(set(report.failed()), {'12300000004'})
+
+            # 其他账号的进度不受影响
+            progress = FileStore(path)
+            self.assertEqual(len(progress.load('12300000005')['results']['ranking']), 1)
+            self.assertEqual(progress.load('12300000004')['results'], {'login': None})
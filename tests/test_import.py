@@ -0,0 +1,44 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import unittest
+
+
+SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import bilib
+user = bilib.User('1230001234', '123')
+danmu = bilib.Danmu('test', 1000, 271)
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(sys.modules)}))
+'''
+
+# 这些模块很慢，只应该在用到对应功能时导入
+HEAVY_MODULES = ('requests', 'urllib3', 'rsa', 'bs4', 'numpy', 'unittest',
+                 'asyncio', 'aiohttp', 'sqlite3', 'orjson', 'concurrent.futures',
+                 'cryptography')
+
+
+class ImportTester(unittest.TestCase):
+    # import bilib 并创建 User 和 Danmu 的时间预算，秒。目前大约 25ms，留出足够的余量，
+    # 只用来发现明显的退化
+    BUDGET = 0.1
+    RUNS = 5
+
+    def runScript(self):
+        # 在新的进程中导入，不受其他测试已经导入的模块影响
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', SCRIPT], cwd=root)
+        return json.loads(output)
+
+    def testLazyImports(self):
+        modules = set(self.runScript()['modules'])
+        self.assertEqual([name for name in HEAVY_MODULES if name in modules], [])
+
+    def testBudget(self):
+        # 取多次运行的中位数，一次偶然的卡顿不会导致失败
+        elapsed = statistics.median(self.runScript()['elapsed'] for _ in range(self.RUNS))
+        self.assertLess(elapsed, self.BUDGET)
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import struct
+import unittest
+import zlib
+from unittest import mock
+
+try:
+    from bilib import live
+except ImportError:     # aiohttp 是可选依赖
+    live = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def messagePacket(message, proto=None):
+    if proto is None:
+        proto = live.PROTO_JSON
+    body = json.dumps(message).encode('utf8')
+    return live.HEADER.pack(live.HEADER.size + len(body), live.HEADER.size,
+                            proto, live.OP_MESSAGE, 0) + body
+
+
+def authReply(code=0):
+    body = json.dumps({'code': code}).encode('utf8')
+    return live.HEADER.pack(live.HEADER.size + len(body), live.HEADER.size,
+                            live.PROTO_JSON, live.OP_AUTH_REPLY, 0) + body
+
+
+def compressed(*packets):
+    body = zlib.compress(b''.join(packets))
+    return live.HEADER.pack(live.HEADER.size + len(body), live.HEADER.size,
+                            live.PROTO_ZLIB, live.OP_MESSAGE, 0) + body
+
+
+@unittest.skipIf(live is None, 'aiohttp is not installed')
+class PacketTester(unittest.TestCase):
+    def testRoundTrip(self):
+        packet = live.makePacket(live.OP_AUTH, {'roomid': 1551})
+        (operation, body), = live.parsePackets(packet)
+        self.assertEqual(operation, live.OP_AUTH)
+        self.assertEqual(json.loads(bytes(body)), {'roomid': 1551})
+
+    def testCompressed(self):
+        data = (compressed(messagePacket({'cmd': 'DANMU_MSG'}),
+                           messagePacket({'cmd': 'SEND_GIFT'})) +
+                live.HEADER.pack(20, 16, live.PROTO_INT, live.OP_HEARTBEAT_REPLY, 0) +
+                struct.pack('>I', 1234))
+        packets = [live.decodeBody(op, body) for op, body in live.parsePackets(data)]
+        self.assertEqual(packets, [{'cmd': 'DANMU_MSG'}, {'cmd': 'SEND_GIFT'}, 1234])
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def testBrotli(self):
+        body = brotli.compress(messagePacket({'cmd': 'DANMU_MSG'}) +
+                               messagePacket({'cmd': 'SEND_GIFT'}))
+        data = live.HEADER.pack(live.HEADER.size + len(body), live.HEADER.size,
+                                live.PROTO_BROTLI, live.OP_MESSAGE, 0) + body
+        packets = [live.decodeBody(op, body) for op, body in live.parsePackets(data)]
+        self.assertEqual(packets, [{'cmd': 'DANMU_MSG'}, {'cmd': 'SEND_GIFT'}])
+
+    def testBroken(self):
+        packet = messagePacket({'cmd': 'DANMU_MSG'})
+        with self.assertRaises(ValueError):
+            list(live.parsePackets(packet[:-1]))
+
+
+@unittest.skipIf(live is None, 'aiohttp is not installed')
+class DispatchTester(unittest.IsolatedAsyncioTestCase):
+    async def testBackpressure(self):
+        queue = asyncio.Queue(maxsize=1)
+        client = live.LiveClient(1551, queue, session=None)
+        data = compressed(*(messagePacket({'cmd': 'DANMU_MSG', 'i': i}) for i in range(3)))
+
+        task = asyncio.ensure_future(client._dispatch(data))
+        await asyncio.sleep(0.01)
+        # 队列满时 dispatch 停在第二条消息
+        self.assertFalse(task.done())
+        received = [await queue.get() for _ in range(3)]
+        await task
+        self.assertEqual([message['i'] for _, message in received], [0, 1, 2])
+
+    async def testGap(self):
+        queue = asyncio.Queue()
+        client = live.LiveClient(1551, queue, session=None)
+        await client._dispatch(authReply() + messagePacket({'cmd': 'DANMU_MSG'}))
+        lastSeen = client.lastSeen
+        # 重连之后先放入缺失的时间段
+        await client._dispatch(authReply())
+        received = [queue.get_nowait()[1] for _ in range(queue.qsize())]
+        self.assertEqual([message['cmd'] for message in received],
+                         ['DANMU_MSG', live.CMD_GAP])
+        self.assertEqual(received[1]['since'], lastSeen)
+        self.assertGreaterEqual(received[1]['until'], lastSeen)
+
+    async def testHeartbeatFailure(self):
+        class WebSocket:
+            sent = 0
+
+            async def send_bytes(self, data):
+                self.sent += 1
+                if self.sent > 1:
+                    raise ConnectionResetError('reset')
+
+            async def __aiter__(self):
+                await asyncio.sleep(0.01)
+                return
+                yield
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                pass
+
+        session = mock.Mock()
+        session.ws_connect.return_value = WebSocket()
+        client = live.LiveClient(1551, asyncio.Queue(), session)
+        with mock.patch.object(client, '_getServer', mock.AsyncMock(return_value=('ws', ''))):
+            with self.assertLogs('bilib.live', 'WARNING') as cm:
+                await client._session()
+        self.assertIn('ConnectionResetError', cm.output[0])
+
+
+@unittest.skipIf(live is None, 'aiohttp is not installed')
+class MonitorTester(unittest.IsolatedAsyncioTestCase):
+    async def testClose(self):
+        async def session(client):
+            await asyncio.sleep(3600)
+
+        with mock.patch.object(live.LiveClient, '_session', session):
+            monitor = live.LiveMonitor([1, 2, 3])
+            await monitor.__aenter__()
+            tasks = list(monitor._tasks.values())
+            await asyncio.sleep(0)
+            await monitor.close()
+        self.assertTrue(all(task.done() for task in tasks))
+        self.assertTrue(monitor._session.closed)
@@ -0,0 +1,104 @@
+import unittest
+from unittest import mock
+
+import requests
+
+import bilib
+from bilib.metrics import Hooks, Metrics
+from bilib.mockserver import MockServer
+from bilib.retry import RetryPolicy
+
+
+class Recorder(Hooks):
+    def __init__(self):
+        self.events = []
+
+    def beforeRequest(self, info):
+        self.events.append(('before', info.endpoint, info.attempt))
+
+    def afterResponse(self, info):
+        self.events.append(('after', info.endpoint, info.status, info.code))
+
+    def onError(self, info, error):
+        self.events.append(('error', info.endpoint, type(error).__name__, info.code))
+
+
+class MetricsTester(unittest.TestCase):
+    def setUp(self):
+        bilib.User._keyCache.invalidate()
+        self.server = MockServer().start()
+        self.metrics = Metrics()
+        self.recorder = Recorder()
+        self.user = bilib.User('1230001234', '123', transport=self.server.transport(),
+                               retry=RetryPolicy(maxAttempts=2, backoff=0),
+                               hooks=[self.metrics, self.recorder])
+        # 每次调用都要发出请求
+        self.user.STATE_TTL = {}
+        self.user.login()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testHooks(self):
+        self.user.updateCoins()
+        self.assertEqual(self.recorder.events[-2:], [
+            ('before', '/site/getCoin', 1),
+            ('after', '/site/getCoin', 200, 0),
+        ])
+
+        self.server.errorRate = 1
+        with self.assertRaises(bilib.user.BiliError):
+            self.user.updateCoins()
+        self.assertEqual(self.recorder.events[-2:], [
+            ('after', '/site/getCoin', 200, -500),
+            ('error', '/site/getCoin', 'BiliError', -500),
+        ])
+
+    def testRetry(self):
+        get = self.user.session.get
+        calls = []
+
+        def flaky(url, *args, **kws):
+            calls.append(url)
+            if len(calls) == 1:
+                raise requests.ConnectionError('reset')
+            return get(url, *args, **kws)
+        flaky.__name__ = 'get'
+
+        with mock.patch.object(self.user.session, 'get', flaky):
+            self.user.updateCoins()
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['requests']['/site/getCoin'], 2)
+        self.assertEqual(snapshot['retries']['/site/getCoin'], 1)
+        self.assertEqual(snapshot['errors'][('/site/getCoin', 'ConnectionError', None)], 1)
+
+    def testSnapshot(self):
+        for _ in range(3):
+            self.user.getUserInfo()
+        snapshot = self.metrics.snapshot()
+        latency = snapshot['latency'][('/home/userInfo', 200, 0)]
+        self.assertEqual(latency['count'], 4)   # login 时也请求了一次
+        self.assertEqual(sum(latency['buckets']), 4)
+        self.assertGreater(snapshot['bytes']['/home/userInfo'], 0)
+        self.assertEqual(self.metrics.summary()[0]['endpoint'], '/home/userInfo')
+
+        self.metrics.reset()
+        self.assertEqual(self.metrics.snapshot()['requests'], {})
+
+    def testPrometheus(self):
+        self.user.getUserInfo()
+        text = self.metrics.prometheus()
+        self.assertIn('# TYPE bilib_request_duration_seconds histogram', text)
+        self.assertIn('bilib_requests_total{endpoint="/home/userInfo"} 2', text)
+        self.assertIn('bilib_request_duration_seconds_bucket{endpoint="/home/userInfo",'
+                      'status="200",code="0",le="+Inf"} 2', text)
+        self.assertIn('bilib_request_duration_seconds_count{endpoint="/home/userInfo",'
+                      'status="200",code="0"} 2', text)
+
+    def testBrokenHook(self):
+        hook = Hooks()
+        hook.beforeRequest = mock.Mock(side_effect=ValueError)
+        self.user.hooks.append(hook)
+        with self.assertLogs('bilib.metrics', 'ERROR'):
+            self.user.getUserInfo()
+        self.assertEqual(self.user.name, 'mock')
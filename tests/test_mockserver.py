@@ -0,0 +1,72 @@
+import unittest
+
+import bilib
+from bilib import transport
+from bilib.mockserver import MockServer
+from bilib.retry import RetryPolicy
+
+
+class MockServerTester(unittest.TestCase):
+    def setUp(self):
+        bilib.User._keyCache.invalidate()
+        self.server = MockServer().start()
+        self.transport = self.server.transport()
+        self.user = bilib.User('1230001234', '123', transport=self.transport)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testLogin(self):
+        with self.assertRaises(bilib.user.BiliRequireLogin):
+            self.user.getUserInfo()
+        self.user.login()
+        self.assertEqual(self.user.name, 'mock')
+        self.assertEqual(self.user.level, 3)
+        self.assertEqual(str(self.user), '<User 1230001234 lv.3>')
+
+    def testApis(self):
+        self.user.login()
+        self.user.updateCoins()
+        self.assertEqual(self.user.coins, 10)
+        self.assertEqual(self.user.getTodayCoinExp(), 10)
+        self.user.giveCoin(271)
+        self.user.comment(271, 'test')
+        self.user.postLiveDanmu('test', 1551)
+        self.assertEqual(self.user.getUserLiveLevel(), 10)
+        self.assertIsNotNone(self.user.liveSignIn())
+
+        danmu = bilib.Danmu('test', 1000, 271)
+        old = transport.getDefaultTransport()
+        transport.setDefaultTransport(self.transport)
+        try:
+            self.user.postDanmu(danmu)
+        finally:
+            transport.setDefaultTransport(old)
+        self.assertEqual(self.server.counts['/x/v2/dm/post'], 1)
+
+    def testCsrf(self):
+        self.user.login()
+        self.user._setCookies({'bili_jct': 'wrong'})
+        with self.assertRaises(bilib.user.BiliError) as cm:
+            self.user.giveCoin(271)
+        self.assertEqual(cm.exception.code, MockServer.CSRF_CODE)
+
+    def testErrors(self):
+        self.user.login()
+        self.server.errorRate = 1
+        self.user.invalidate('userInfo')
+        with self.assertRaises(bilib.user.BiliError) as cm:
+            self.user.getUserInfo()
+        self.assertEqual(cm.exception.code, -500)
+
+    def testRateLimit(self):
+        self.server.stop()
+        self.server = MockServer(rateLimits={'/x/v2/reply/add': (0.01, 2)}).start()
+        user = bilib.User('1230001234', '123', transport=self.server.transport(),
+                          retry=RetryPolicy(maxAttempts=1))
+        user.login()
+        user.comment(271, '1')
+        user.comment(271, '2')
+        with self.assertRaises(bilib.user.BiliError) as cm:
+            user.comment(271, '3')
+        self.assertEqual(cm.exception.code, MockServer.RATE_LIMIT_CODE)
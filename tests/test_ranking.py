@@ -0,0 +1,61 @@
+import unittest
+
+import bilib
+from bilib.mockserver import MockServer
+from bilib.ranking import RankItem, RankingWatcher, diffRankings, parseRanking
+
+
+PATH = '/x/web-interface/ranking'
+
+
+class RankingTester(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer().start()
+        self.user = bilib.User('1230001234', '123', transport=self.server.transport())
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testGetRankingList(self):
+        items = self.user.getRankingList(rid=36, day=7)
+        self.assertEqual(len(items), 100)
+        self.assertEqual(items[0], RankItem(1, 367000, 10000, 36, 'video 367000',
+                                            'mock', 1551, 1000))
+        self.assertEqual([item.rank for item in items], list(range(1, 101)))
+        self.assertEqual(len(set(items)), 100)
+        self.assertEqual(self.user.getRankingAids(rid=36, day=7),
+                         [str(item.aid) for item in items])
+        with self.assertRaises(ValueError):
+            self.user.getRankingList(rid=-1)
+        with self.assertRaises(ValueError):
+            self.user.getRankingList(day=2)
+
+    def testParse(self):
+        items = parseRanking({'list': [{'aid': '3', 'pts': 9}, {'aid': 1}, {'aid': '3'}]}, 4)
+        self.assertEqual([(item.rank, item.aid, item.score, item.rid) for item in items],
+                         [(1, 3, 9, 4), (2, 1, 0, 4)])
+        self.assertEqual(parseRanking(None), [])
+
+    def testDiff(self):
+        old = parseRanking({'list': [{'aid': aid} for aid in (1, 2, 3, 4)]})
+        new = parseRanking({'list': [{'aid': aid} for aid in (2, 1, 3, 5)]})
+        diff = diffRankings(old, new)
+        self.assertEqual([item.aid for item in diff.entered], [5])
+        self.assertEqual([item.aid for item in diff.left], [4])
+        self.assertEqual([(item.aid, item.rank, rank) for item, rank in diff.moved],
+                         [(2, 1, 2), (1, 2, 1)])
+        self.assertFalse(diffRankings(new, new))
+
+    def testWatcher(self):
+        self.server.rankings[(0, 3)] = [10, 20, 30]
+        watcher = RankingWatcher(self.user)
+        self.assertEqual(len(watcher.poll().entered), 3)
+
+        # 没有变化时服务器返回 304
+        self.assertFalse(watcher.poll())
+        self.assertEqual(self.server.counts[PATH], 2)
+
+        self.server.rankings[(0, 3)] = [20, 10, 40]
+        diff = watcher.poll()
+        self.assertEqual(repr(diff), '<RankingDiff +1 -1 ~2>')
+        self.assertEqual([item.aid for item in watcher.items], [20, 10, 40])
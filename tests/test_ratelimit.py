@@ -0,0 +1,43 @@
+import threading
+import time
+import unittest
+
+from bilib.ratelimit import RateLimiter, TokenBucket
+
+
+URL = 'https://api.bilibili.com/x/v2/dm/post'
+
+
+class RateLimiterTester(unittest.TestCase):
+    def testBucket(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, delta=0.01)
+        self.assertAlmostEqual(bucket.reserve(), 0.2, delta=0.01)
+
+    def testPerAccount(self):
+        limiter = RateLimiter({'/x/v2/dm/post': (1, 1)})
+        self.assertEqual(limiter.acquire(URL, 'a'), 0)
+        self.assertEqual(limiter.acquire(URL, 'b'), 0)
+        # 不限速的接口
+        self.assertEqual(limiter.acquire('https://api.bilibili.com/other', 'a'), 0)
+
+    def testQueue(self):
+        limiter = RateLimiter({'/x/v2/dm/post': (20, 1)})
+        start = time.monotonic()
+        threads = [threading.Thread(target=limiter.acquire, args=(URL, 'a'))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        self.assertGreater(limiter.queueDepth(), 0)
+        for thread in threads:
+            thread.join()
+
+        # 5 个请求，每秒 20 个，至少需要 0.2s
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+        self.assertEqual(limiter.queueDepth('/x/v2/dm/post'), 0)
+        stats = limiter.stats()['/x/v2/dm/post']
+        self.assertEqual(stats['acquired'], 5)
+        self.assertEqual(stats['delayed'], 4)
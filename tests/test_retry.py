@@ -0,0 +1,160 @@
+import socket
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import bilib
+from bilib.mockserver import MockServer
+from bilib.retry import RetryPolicy, RetryBudget
+from bilib.transport import Transport
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self):
+        self.server.hits += 1
+        if self.server.hits <= self.server.stalls:
+            time.sleep(2)
+        if self.server.hits <= self.server.failures:
+            status, body = 503, b'busy'
+        else:
+            status, body = 200, b'{"code": 0, "data": "ok", "extra": 1}'
+        self.send_response(status)
+        if status == 503:
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = reply
+
+    def log_message(self, *args):
+        pass
+
+
+class RetryPolicyTester(unittest.TestCase):
+    def testDelay(self):
+        policy = RetryPolicy(maxAttempts=4, backoff=1, maxBackoff=3, jitter=False)
+        start = time.monotonic()
+        self.assertEqual([policy.nextDelay(i, start) for i in range(1, 5)],
+                         [1, 2, 3, None])
+        self.assertEqual(policy.nextDelay(1, start, '5'), 5)
+
+    def testDeadline(self):
+        policy = RetryPolicy(backoff=1, jitter=False, deadline=1.5)
+        start = time.monotonic()
+        self.assertEqual(policy.nextDelay(1, start), 1)
+        self.assertIsNone(policy.nextDelay(2, start))
+
+    def testAttemptTimeout(self):
+        start = time.monotonic()
+        self.assertEqual(RetryPolicy(timeout=3).attemptTimeout(start), 3)
+        self.assertEqual(RetryPolicy(timeout=3).attemptTimeout(start, 1), 1)
+        self.assertIsNone(RetryPolicy(timeout=None).attemptTimeout(start))
+        self.assertLessEqual(RetryPolicy(timeout=3, deadline=2).attemptTimeout(start), 2)
+        self.assertEqual(RetryPolicy(deadline=2).attemptTimeout(start - 5),
+                         RetryPolicy.MIN_TIMEOUT)
+        self.assertEqual(Transport(timeout=4).retry.timeout, 4)
+
+    def testBudget(self):
+        budget = RetryBudget(ratio=0.5, minPerSecond=0, maxTokens=2)
+        policy = RetryPolicy(budget=budget)
+        start = time.monotonic()
+        self.assertIsNotNone(policy.nextDelay(1, start))
+        self.assertIsNotNone(policy.nextDelay(1, start))
+        self.assertIsNone(policy.nextDelay(1, start))
+        policy.succeeded()
+        policy.succeeded()
+        self.assertIsNotNone(policy.nextDelay(1, start))
+
+    def testIdempotent(self):
+        policy = RetryPolicy()
+        transport = Transport()
+        self.assertTrue(policy.isIdempotent(transport.get))
+        self.assertFalse(policy.isIdempotent(transport.post))
+        self.assertTrue(policy.shouldRetryStatus(500, True))
+        self.assertFalse(policy.shouldRetryStatus(500, False))
+        self.assertTrue(policy.shouldRetryStatus(503, False))
+
+
+class UserRetryTester(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.hits = 0
+        self.server.failures = 2
+        self.server.stalls = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        policy = RetryPolicy(maxAttempts=3, backoff=0.01)
+        self.user = bilib.User('1230001234', '123', retry=policy)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testRetry(self):
+        # key 和 checkCode 在重试时也要传递
+        self.assertEqual(self.user.get(self.url, key='extra'), 1)
+        self.assertEqual(self.server.hits, 3)
+
+    def testMaxAttempts(self):
+        self.server.failures = 3
+        with self.assertRaises(bilib.user.BiliError) as cm:
+            self.user.post(self.url)
+        self.assertEqual(cm.exception.code, 503)
+        self.assertEqual(self.server.hits, 3)
+
+    def testReadTimeout(self):
+        # GET 的读超时会重试
+        self.server.failures = 0
+        self.server.stalls = 1
+        self.user.retry = RetryPolicy(maxAttempts=3, backoff=0.01, timeout=0.2)
+        self.assertEqual(self.user.get(self.url, key='extra'), 1)
+        self.assertEqual(self.server.hits, 2)
+
+    def testStallPastDeadline(self):
+        self.server.stalls = 100
+        self.user.retry = RetryPolicy(backoff=0.01, deadline=0.5)
+        start = time.monotonic()
+        with self.assertRaises(bilib.user.BiliError):
+            self.user.get(self.url)
+        self.assertLess(time.monotonic() - start, 1.5)
+
+
+class DroppedConnectionTester(unittest.TestCase):
+    def setUp(self):
+        bilib.User._keyCache.invalidate()
+        self.server = MockServer().start()
+        policy = RetryPolicy(maxAttempts=3, backoff=0.01)
+        self.user = bilib.User('1230001234', '123', retry=policy,
+                               transport=self.server.transport())
+        self.user.login()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testDropped(self):
+        self.server.dropRate = 1
+        # 请求已经发出，POST 不重试，避免重复投币
+        with self.assertRaises(requests.ConnectionError):
+            self.user.giveCoin(271)
+        self.assertEqual(self.server.counts['/x/web-interface/coin/add'], 1)
+
+        # GET 是幂等的，会重试
+        with self.assertRaises(bilib.user.BiliError):
+            self.user.updateCoins()
+        self.assertEqual(self.server.counts['/site/getCoin'], 3)
+
+    def testRefused(self):
+        # 连接没有建立，POST 也会重试
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            url = 'http://127.0.0.1:%d/' % sock.getsockname()[1]
+        user = bilib.User('1230001234', '123', retry=self.user.retry)
+        with self.assertRaises(bilib.user.BiliError) as cm:
+            user.post(url)
+        self.assertIn('Max retry', str(cm.exception))
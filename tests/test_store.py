@@ -0,0 +1,96 @@
+import os
+import tempfile
+import time
+import unittest
+
+import bilib
+from bilib.store import FileStore, SQLiteStore, MemoryStore
+
+
+def makeState(expiresTime):
+    return {
+        'mid': 1551,
+        'accessToken': 'access',
+        'refreshToken': 'refresh',
+        'expiresTime': expiresTime,
+        'cookies': {'bili_jct': 'csrf', 'SESSDATA': 'sess'},
+        'name': 'test',
+        'level': 3,
+        'coins': 10,
+    }
+
+
+class StoreTester(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def checkStore(self, store):
+        state = makeState(time.time())
+        self.assertIsNone(store.load('123'))
+        store.save('123', state)
+        self.assertEqual(store.load('123'), state)
+        store.delete('123')
+        self.assertIsNone(store.load('123'))
+
+    def testFileStore(self):
+        path = os.path.join(self.dir.name, 'store.json')
+        self.checkStore(FileStore(path))
+
+        FileStore(path).save('123', makeState(1))
+        self.assertEqual(FileStore(path).load('123')['expiresTime'], 1)
+
+        # 不能序列化的 state 不会留在内存中，之后的保存不受影响
+        store = FileStore(path)
+        with self.assertRaises(TypeError):
+            store.save('456', {'expiresTime': object()})
+        self.assertIsNone(store.load('456'))
+        store.save('789', makeState(2))
+        self.assertEqual(FileStore(path).load('789')['expiresTime'], 2)
+
+    @unittest.skipIf(os.name == 'nt', 'POSIX permissions')
+    def testPermissions(self):
+        # 保存 token 的文件不能被其他用户读取
+        umask = os.umask(0o022)
+        try:
+            path = os.path.join(self.dir.name, 'store.json')
+            FileStore(path).save('123', makeState(1))
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+            path = os.path.join(self.dir.name, 'store.db')
+            SQLiteStore(path).close()
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        finally:
+            os.umask(umask)
+
+    def testSQLiteStore(self):
+        path = os.path.join(self.dir.name, 'store.db')
+        store = SQLiteStore(path)
+        self.checkStore(store)
+        store.save('123', makeState(1))
+        store.close()
+
+        store = SQLiteStore(path)
+        self.assertEqual(store.load('123')['expiresTime'], 1)
+        store.close()
+
+    def testUserRestore(self):
+        store = MemoryStore()
+        store.save('1230001234', makeState(time.time() + 3600))
+        user = bilib.User('1230001234', '123', store=store)
+        user.login()
+
+        self.assertTrue(user.logined)
+        self.assertEqual(user.csrf, 'csrf')
+        self.assertEqual(user.level, 3)
+        self.assertEqual(user.dumpState()['cookies'],
+                         {'bili_jct': 'csrf', 'SESSDATA': 'sess'})
+
+    def testUserExpired(self):
+        store = MemoryStore()
+        store.save('1230001234', makeState(time.time()))
+        user = bilib.User('1230001234', '123', store=store)
+        self.assertFalse(user._restore())
+        self.assertFalse(user.logined)
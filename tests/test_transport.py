@@ -0,0 +1,55 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import bilib
+from bilib.transport import Transport
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{"code": 0, "data": %d}' % self.server.ports.setdefault(
+            self.client_address[1], len(self.server.ports))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', 'bili_jct=abc; Path=/')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TransportTester(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.ports = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        self.transport = Transport(maxConnections=4, maxPerHost=2)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.transport.close()
+
+    def testSharedPool(self):
+        users = [bilib.User('123000%04d' % i, '123', transport=self.transport)
+                 for i in range(3)]
+        for user in users:
+            user.get(self.url, headers={'Host': 'localhost'})
+            # session.close() 不能关闭共享的连接池
+            user.session.close()
+        # 三个用户复用同一个 keep-alive 连接
+        self.assertEqual(len(self.server.ports), 1)
+
+    def testCookies(self):
+        user = bilib.User('1230001234', '123', transport=self.transport)
+        user.get(self.url)
+        self.assertEqual(user.session.cookies['bili_jct'], 'abc')
+
+        self.transport.get(self.url)
+        self.assertEqual(len(self.transport._anonymous.cookies), 0)
@@ -1,10 +1,27 @@
+import calendar
+import http.cookiejar
+import json
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
 import bilib
+from bilib import transport
+from bilib.metrics import Hooks, Metrics
+from bilib.mockserver import MockServer
 
 from tests import config
 
 
+TEST_PUBKEY = '''-----BEGIN PUBLIC KEY-----
+MFwwDQYJKoZIhvcNAQEBBQADSwAwSAJBAMGxBG+iGqZcDC9BLi3eZ011sUa/Y4J1
+o8IaV5uPHsMe6f2fyG3l7VvaiKomNvz9xzIHgQWkSRVP9cIguq2Yf3sCAwEAAQ==
+-----END PUBLIC KEY-----
+'''
+
+
 class ErrorTest(unittest.TestCase):
     def testRepr(self):
         self.assertEqual(repr(bilib.user.BiliError('reason')),
@@ -13,6 +30,264 @@ class ErrorTest(unittest.TestCase):
                          '<BiliRequireLogin: reason>')
 
 
+class ParseResponseTester(unittest.TestCase):
+    BODY = '{"code": 0, "data": {"vlist": [{"aid": 271, "title": "测试"}]}}'
+
+    def testParse(self):
+        parse = bilib.User._parseResponse
+        for body in (self.BODY, self.BODY.encode('utf8')):
+            self.assertEqual(parse(body)['vlist'][0]['title'], '测试')
+            self.assertEqual(parse(body, key=('data', 'vlist', 0, 'aid')), 271)
+            self.assertIsNone(parse(body, key=('data', 'tlist', 0)))
+            self.assertEqual(parse(body, key=None)['code'], 0)
+
+    def testErrors(self):
+        parse = bilib.User._parseResponse
+        with self.assertRaises(bilib.user.BiliError):
+            parse(b'Fatal: API error')
+        with self.assertRaises(RuntimeError):
+            parse(b'<html>')
+        with self.assertRaises(bilib.user.BiliError) as cm:
+            parse('{"code": -400, "message": "错误"}'.encode('utf8'))
+        self.assertEqual(cm.exception.code, -400)
+        self.assertEqual(str(cm.exception), '错误')
+        self.assertEqual(parse(b'{"code": -400, "list": [1]}', 'list', checkCode=False), [1])
+
+    def testStandardLibrary(self):
+        with mock.patch('bilib.user._loads', json.loads):
+            self.assertEqual(bilib.User._parseResponse(self.BODY.encode('utf8'),
+                                                       key=('data', 'vlist', 0, 'aid')), 271)
+            with self.assertRaises(RuntimeError):
+                bilib.User._parseResponse(b'{')
+
+
+class RoomInfoTester(unittest.TestCase):
+    def setUp(self):
+        bilib.User.roomCache.clear()
+        self.server = MockServer().start()
+        self.old = transport.getDefaultTransport()
+        transport.setDefaultTransport(self.server.transport())
+
+    def tearDown(self):
+        transport.setDefaultTransport(self.old)
+        self.server.stop()
+
+    def testRoomInfo(self):
+        info = bilib.User.getRoomInfo(1551)
+        self.assertEqual(info, {
+            'roomid': 1551007, 'shortid': 1551, 'uid': 7, 'uname': 'anchor 1551007',
+            'title': 'room 1551007', 'liveStatus': 1, 'cid': 1551007})
+        # 短号和真实房间号共用缓存
+        self.assertIs(bilib.User.getRoomInfo('1551007'), info)
+        self.assertEqual(bilib.User.getAncherName(1551), 'anchor 1551007')
+        self.assertEqual(self.server.counts['/xlive/web-room/v1/index/getInfoByRoom'], 1)
+
+        with self.assertRaises(bilib.user.BiliError):
+            bilib.User.getRoomInfo(0)
+
+    def testRoomInfoOfUser(self):
+        # 在实例上调用时经过该用户的 do() 和钩子
+        metrics = Metrics()
+        user = bilib.User('1230001234', '123', transport=self.server.transport(),
+                          hooks=[metrics])
+        self.assertEqual(user.getAncherName(1551), 'anchor 1551007')
+        self.assertEqual(user.getRoomInfo(1551007)['shortid'], 1551)
+        self.assertEqual(
+            metrics.snapshot()['requests'], {'/xlive/web-room/v1/index/getInfoByRoom': 1})
+
+
+class StateCacheTester(unittest.TestCase):
+    def setUp(self):
+        bilib.User._keyCache.invalidate()
+        self.server = MockServer(latency=0.05).start()
+        self.user = bilib.User('1230001234', '123', transport=self.server.transport())
+        self.user.login()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testCoalesce(self):
+        with ThreadPoolExecutor(8) as pool:
+            levels = list(pool.map(lambda _: self.user.getUserLiveLevel(), range(8)))
+        self.assertEqual(levels, [10] * 8)
+        self.assertEqual(self.server.counts['/User/getUserInfo'], 1)
+        # login 时已经读取过
+        self.user.getUserInfo()
+        self.assertEqual(self.server.counts['/home/userInfo'], 1)
+
+    def testInvalidate(self):
+        self.user.updateCoins()
+        self.user.getTodayCoinExp()
+        self.user.giveCoin(271)
+        self.user.updateCoins()
+        self.user.getTodayCoinExp()
+        self.assertEqual(self.server.counts['/site/getCoin'], 2)
+        self.assertEqual(self.server.counts['/plus/account/exp.php'], 2)
+
+        self.assertFalse(self.user.todaySigned())
+        self.user.liveSignIn()
+        self.user.todaySigned()
+        self.assertEqual(self.server.counts['/sign/GetSignInfo'], 2)
+
+        self.user.invalidate()
+        self.user.getUserInfo()
+        self.assertEqual(self.server.counts['/home/userInfo'], 2)
+
+    def expireToken(self):
+        # 续期失败，退回到重新登陆
+        self.server.routes['/api/v2/oauth2/refresh_token'] = \
+            lambda params, cookies: {'code': -101, 'message': '账号未登录'}
+        self.user.expiresTime = time.time() + 60
+        self.user.invalidate()
+
+    def runWithTimeout(self, *funcs):
+        '''在后台线程中调用，死锁时测试失败而不是挂起'''
+        errors = []
+
+        def call(func):
+            try:
+                func()
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=call, args=(func,), daemon=True) for func in funcs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive(), 'deadlocked')
+        self.assertEqual(errors, [])
+
+    def testReloginWhileLoading(self):
+        self.expireToken()
+        self.runWithTimeout(self.user.getUserInfo)
+        self.assertEqual(self.server.counts['/api/v2/oauth2/login'], 2)
+        self.assertEqual(self.user.name, 'mock')
+        self.assertFalse(self.user._needRefresh())
+
+    def testReloginFromManyThreads(self):
+        self.expireToken()
+        calls = [self.user.getUserInfo, self.user.updateCoins, self.user.todaySigned,
+                 self.user.getTodayCoinExp]
+        self.runWithTimeout(*calls * 4)
+        self.assertEqual(self.server.counts['/api/v2/oauth2/login'], 2)
+
+    def testDisabled(self):
+        self.user.STATE_TTL = dict(bilib.User.STATE_TTL, coins=0)
+        self.user.updateCoins()
+        self.user.updateCoins()
+        self.assertEqual(self.server.counts['/site/getCoin'], 2)
+
+    def testDailyFields(self):
+        # 2026-10-17 16:00 UTC 是北京时间 10-18 零点，与本机的时区无关
+        reset = calendar.timegm((2026, 10, 17, 16, 0, 0))
+        self.assertEqual(bilib.user._secondsUntilTomorrow(reset - 60), 60)
+        self.assertEqual(bilib.user._secondsUntilTomorrow(reset), 24 * 60 * 60)
+        self.assertEqual(bilib.user._secondsUntilTomorrow(reset + 1), 24 * 60 * 60 - 1)
+        # UTC 零点时距离换日还有 16 小时
+        self.assertEqual(bilib.user._secondsUntilTomorrow(reset - 16 * 60 * 60),
+                         16 * 60 * 60)
+
+        # 零点之前读取到的签到状态不会保留到第二天
+        with mock.patch('bilib.user._secondsUntilTomorrow', return_value=0.05):
+            self.assertEqual(self.user._stateTTL('signed'), 0.05)
+            self.assertEqual(self.user._stateTTL('coins'), 60)
+            self.user.todaySigned()
+        self.user.todaySigned()
+        self.assertEqual(self.server.counts['/sign/GetSignInfo'], 1)
+        time.sleep(0.1)
+        self.user.todaySigned()
+        self.assertEqual(self.server.counts['/sign/GetSignInfo'], 2)
+
+
+class ThreadSafetyTester(unittest.TestCase):
+    def setUp(self):
+        bilib.User._keyCache.invalidate()
+        self.server = MockServer().start()
+        self.user = bilib.User('1230001234', '123', transport=self.server.transport())
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testLoginOnce(self):
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda _: self.user.login(), range(8)))
+        self.assertEqual(self.server.counts['/api/v2/oauth2/login'], 1)
+        self.assertTrue(self.user.logined)
+
+        self.user.login()
+        self.assertEqual(self.server.counts['/api/v2/oauth2/login'], 2)
+
+    def testRefreshWhilePosting(self):
+        self.user.login()
+        stop = threading.Event()
+
+        def refresh():
+            while not stop.is_set():
+                self.user.refreshToken(force=True)
+
+        def comment(i):
+            return self.user.comment(271, str(i))
+
+        with ThreadPoolExecutor(9) as pool:
+            refresher = pool.submit(refresh)
+            try:
+                results = list(pool.map(comment, range(200)))
+            finally:
+                stop.set()
+            refresher.result()
+        self.assertEqual(len(results), 200)
+        self.assertGreater(self.server.counts['/api/v2/oauth2/refresh_token'], 1)
+
+    def testRefreshBetweenCsrfAndSend(self):
+        self.user.login()
+        refreshed = []
+
+        class Refresher(Hooks):
+            def beforeRequest(hook, info):
+                # 模拟参数生成之后、请求发出之前其他线程完成了续期
+                if info.endpoint == '/x/v2/reply/add' and not refreshed:
+                    refreshed.append(self.user.csrf)
+                    self.user.refreshToken(force=True)
+
+        self.user.hooks.append(Refresher())
+        self.user.comment(271, 'test')
+        self.assertNotEqual(refreshed[0], self.user.csrf)
+
+    def testSnapshot(self):
+        self.user.login()
+        state = self.user.dumpState()
+        self.assertEqual(state['cookies']['bili_jct'], self.user.csrf)
+
+        # 旧的 csrf 参数换成与发送的 cookie 一致的
+        params = {'csrf': 'stale', 'aid': 1}
+        kws = {}
+        args = self.user._pinCookies((params,), kws)
+        self.assertEqual(args[0], {'csrf': self.user.csrf, 'aid': 1})
+        self.assertEqual(params['csrf'], 'stale')
+        self.assertIs(kws['cookies'], self.user._cookies)
+
+    def testCopyJarWhileWriting(self):
+        self.user.login()
+        jar = self.user.session.cookies
+        # 模拟遍历时其他线程写入了 Set-Cookie
+        with mock.patch.object(type(jar), 'copy', autospec=True, side_effect=[
+                RuntimeError('dictionary changed size during iteration'), jar.copy()]):
+            self.assertEqual(self.user._getCookies()['bili_jct'], self.user.csrf)
+
+        # 一直失败时抛出，不会无限重试
+        error = RuntimeError('dictionary changed size during iteration')
+        with mock.patch.object(type(jar), 'copy', autospec=True, side_effect=error) as copy:
+            with self.assertRaises(RuntimeError):
+                self.user._getCookies()
+        self.assertEqual(copy.call_count, bilib.User.COPY_JAR_ATTEMPTS)
+
+        # 不是 RequestsCookieJar 时直接抛出
+        self.user.session.cookies = http.cookiejar.CookieJar()
+        with self.assertRaises(AttributeError):
+            self.user._setCookies({'a': '1'})
+
+
 class UserTester(unittest.TestCase):
     def setUp(self):
         self.config = config.getConfig()
@@ -108,3 +383,76 @@ class UserTester(unittest.TestCase):
         self.user.login()
         self.user.comment(24110743, '考古')
 
+
+
+class RefreshTester(unittest.TestCase):
+    def setUp(self):
+        self.user = bilib.User('1230001234', '123')
+        self.user.loadState({
+            'mid': 1551, 'accessToken': 'a', 'refreshToken': 'r',
+            'expiresTime': time.time() + 60,
+            'cookies': {'bili_jct': 'csrf'},
+            'name': 'test', 'level': 1, 'coins': 0})
+
+    def testRefreshOnce(self):
+        calls = []
+
+        def do(method, url, *args, **kws):
+            calls.append(url)
+            time.sleep(0.05)
+            return {'token_info': {
+                'mid': 1551, 'access_token': 'a2', 'refresh_token': 'r2',
+                'expires_in': 30 * 24 * 3600}}
+
+        with mock.patch.object(self.user, 'do', do):
+            with ThreadPoolExecutor(8) as pool:
+                for _ in range(8):
+                    pool.submit(self.user._checkToken)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.user._accessToken, 'a2')
+        self.assertFalse(self.user._needRefresh())
+
+    def testRefreshFallback(self):
+        def do(method, url, *args, **kws):
+            raise bilib.user.BiliError('expired', code=-101)
+
+        with mock.patch.object(self.user, 'do', do), \
+                mock.patch.object(self.user, 'login') as login:
+            self.user.refreshToken()
+        login.assert_called_once_with(force=True)
+
+
+class KeyCacheTester(unittest.TestCase):
+    keyData = {'hash': 'salt', 'key': TEST_PUBKEY}
+
+    def setUp(self):
+        bilib.User._keyCache.invalidate()
+        self.urls = []
+
+    def do(self, method, url, *args, **kws):
+        self.urls.append(url)
+        if url.endswith('getKey'):
+            return self.keyData
+        if self.urls.count(url) == 1:
+            raise bilib.user.BiliError('stale hash', code=-662)
+        return {'token_info': {
+            'mid': 1551, 'access_token': 'a', 'refresh_token': 'r',
+            'expires_in': 30 * 24 * 3600},
+            'cookie_info': {'cookies': [{'name': 'bili_jct', 'value': 'csrf'}]}}
+
+    def testShared(self):
+        users = [bilib.User('123000%04d' % i, '123') for i in range(5)]
+        for user in users:
+            with mock.patch.object(user, 'do', self.do):
+                user._getPwd(user.phone, user.password)
+        self.assertEqual(len(self.urls), 1)
+
+    def testStaleKey(self):
+        user = bilib.User('1230001234', '123')
+        with mock.patch.object(user, 'do', self.do), \
+                mock.patch.object(user, '_loadUserInfo', return_value={}):
+            user.login()
+        self.assertTrue(user.logined)
+        self.assertEqual([url.rsplit('/', 1)[-1] for url in self.urls],
+                         ['getKey', 'login', 'getKey', 'login'])
@@ -0,0 +1,112 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import bilib
+from bilib.metrics import Metrics
+from bilib.mockserver import MockServer
+from bilib.videos import AsyncVideoIterator
+
+try:
+    from bilib.aio import AsyncUser
+except ImportError:     # aiohttp 是可选依赖
+    AsyncUser = None
+
+
+PATH = '/ajax/member/getSubmitVideos'
+
+
+class VideoIteratorTester(unittest.TestCase):
+    def setUp(self):
+        bilib.User.videoPageCache.clear()
+        self.server = MockServer().start()
+        self.metrics = Metrics()
+        self.user = bilib.User('1230001234', '123', transport=self.server.transport(),
+                               hooks=[self.metrics])
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testIterate(self):
+        videos = self.user.iterVideosOfUser(1551)
+        aids = [video['aid'] for video in videos]
+        self.assertEqual(aids, list(range(155100100, 155100000, -1)))
+        self.assertEqual((videos.count, videos.pages, videos.cursor), (100, 4, 100))
+        self.assertEqual(self.server.counts[PATH], 4)
+
+        self.assertEqual(len(self.user.getVideosOfUser(1551, page=4)), 10)
+        self.assertEqual(self.server.counts[PATH], 4)
+
+    def testResume(self):
+        videos = self.user.iterVideosOfUser(1551, pageSize=20, prefetch=2)
+        first = [video['aid'] for _, video in zip(range(45), videos)]
+        videos.close()
+        self.assertEqual(videos.cursor, 45)
+        # 第 3 页之后最多预取 2 页
+        self.assertLessEqual(self.server.counts[PATH], 5)
+        self.assertEqual(list(videos), [])
+
+        rest = [video['aid'] for video in
+                self.user.iterVideosOfUser(1551, cursor=videos.cursor, pageSize=20)]
+        self.assertEqual(first + rest, list(range(155100100, 155100000, -1)))
+
+    def testNoPrefetch(self):
+        self.server.videoCounts[1] = 61
+        with self.user.iterVideosOfUser(1, prefetch=0) as videos:
+            self.assertEqual(len(list(videos)), 61)
+        self.server.videoCounts[2] = 0
+        self.assertEqual(list(self.user.iterVideosOfUser(2)), [])
+
+    def testETag(self):
+        list(self.user.iterVideosOfUser(1551))
+        with mock.patch.object(bilib.User, 'VIDEO_PAGE_FRESH', 0):
+            aids = [video['aid'] for video in self.user.iterVideosOfUser(1551)]
+        self.assertEqual(len(aids), 100)
+        self.assertEqual(self.server.counts[PATH], 8)
+        statuses = {key[1]: value['count'] for key, value in
+                    self.metrics.snapshot()['latency'].items() if key[0] == PATH}
+        self.assertEqual(statuses, {200: 4, 304: 4})
+
+
+class AsyncVideoIteratorTester(unittest.IsolatedAsyncioTestCase):
+    async def fetch(self, page):
+        self.fetched.append(page)
+        await asyncio.sleep(0)
+        start = (page - 1) * 10
+        return {'count': 95, 'vlist': list(range(start, min(95, start + 10)))}
+
+    async def testIterate(self):
+        self.fetched = []
+        items = [item async for item in AsyncVideoIterator(self.fetch, pageSize=10)]
+        self.assertEqual(items, list(range(95)))
+        self.assertEqual(sorted(self.fetched), list(range(1, 11)))
+
+    async def testResume(self):
+        self.fetched = []
+        async with AsyncVideoIterator(self.fetch, cursor=33, pageSize=10, prefetch=2) as videos:
+            items = []
+            async for item in videos:
+                items.append(item)
+                if len(items) == 5:
+                    break
+        self.assertEqual(items, list(range(33, 38)))
+        self.assertEqual(videos.cursor, 38)
+        self.assertEqual(videos.pages, 10)
+        self.assertLessEqual(max(self.fetched), 6)
+
+
+@unittest.skipIf(AsyncUser is None, 'aiohttp is not installed')
+class AsyncUserVideosTester(unittest.IsolatedAsyncioTestCase):
+    async def testIterate(self):
+        bilib.User.videoPageCache.clear()
+        with MockServer() as server:
+            class MockAsyncUser(AsyncUser):
+                async def do(self, method, url, **kws):
+                    return await super().do(method, server.rewrite(url), **kws)
+
+            async with MockAsyncUser('1230001234', '123') as user:
+                aids = [video['aid'] async for video in user.iterVideosOfUser(7)]
+                self.assertEqual(aids, list(range(700100, 700000, -1)))
+                with mock.patch.object(bilib.User, 'VIDEO_PAGE_FRESH', 0):
+                    self.assertEqual(len(await user.getVideosOfUser(7, page=2)), 30)
+            self.assertEqual(server.counts[PATH], 5)